@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmarks of the main phases of the simulation, measured on synthetic datasets (see `synthetic_data`).
+
+    predict             batch prediction of the utilities of the consumers (`predict_utilities_matrix`)
+    rank                ranking of the utilities of the consumers into a RecommendationStore
+    rerank              reranking of the recommendations with the profits (`rerank_items_consider_profit`)
+    thresholds          expectation thresholds of all the consumers
+    construction_cold   construction of the first RecommendationModel of a process, loading the shared inputs
+    construction        construction of a RecommendationModel once the shared inputs are loaded
+    step                one step of a RecommendationModel
+    retrain             retraining of the predictions with the feedback (`update_predictions`), the predictions kept by
+                        the model being checked against the predictions of the retrained factors
+    collect             collection of the records of one step
+    sweep               a short ParallelBatchRunner sweep of all the scenarios
+
+At a scale s, the matrix phases (predict, rank, rerank and thresholds) run on a dataset with s times the users and the
+items of the MovieLens dataset, on as many consumers as `max_matrix_cells` allows. The model phases run on a dataset with
+s times the users, so they measure the simulation at several numbers of consumers, and are skipped when the utilities
+matrix of all the consumers is larger than `max_matrix_cells`. The sweep runs on the smallest of these datasets.
+
+The results are saved as JSON in `results/benchmarks` and compared to the baseline of the machine, `baseline.json` in
+the same directory by default: a phase slower than its baseline by more than `regression_tolerance` is a regression.
+
+Usage:
+    python benchmark.py [--scales 1 10] [--phases predict step] [--baseline PATH] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from mesa_utils.batchrunner import ParallelBatchRunner
+from model import RecommendationModel
+from read_config import benchmark_parameters, model_input, model_parameters
+from recommendation_store import RecommendationStore
+from simulation_context import set_data_directory
+from synthetic_data import NUM_ITEMS, NUM_USERS, generate_synthetic_data
+from utils import (create_directory, generate_profitdata, get_results_dir, get_run_seed, predict_utilities_matrix,
+                   rerank_items_consider_profit, store_recommender_systems_generated_data)
+
+MATRIX_PHASES = ["predict", "rank", "rerank", "thresholds"]
+MODEL_PHASES = ["construction_cold", "construction", "step", "retrain", "collect"]
+PHASES = MATRIX_PHASES + MODEL_PHASES + ["sweep"]
+
+
+def get_benchmark_dir() -> str:
+    """
+
+    :return: str of the directory of the benchmarks results and of their synthetic datasets.
+    """
+    return os.path.join(get_results_dir(), "benchmarks")
+
+
+def get_synthetic_data(users_scale: float, items_scale: float) -> str:
+    """
+
+    :param users_scale: float multiplying the number of users of the MovieLens dataset.
+    :param items_scale: float multiplying the number of items of the MovieLens dataset.
+    :return: str of the synthetic data directory.
+
+    A function generates a synthetic data directory the first time it is needed, it is reused afterwards.
+    """
+    seed = benchmark_parameters["seed"]
+    directory = os.path.join(get_benchmark_dir(), "data", f"users{users_scale}x-items{items_scale}x-seed{seed}")
+    ratings_path = os.path.join(directory, model_input["dataset_directory"], model_input["ratings_dataset"])
+    if not os.path.exists(ratings_path):
+        print(f"Generating the synthetic dataset {directory}")
+        generate_synthetic_data(directory, users_scale, items_scale, seed)
+    return directory
+
+
+def get_synthetic_factors(users: np.ndarray, items: np.ndarray, rng: np.random.Generator,
+                          num_factors: int = 100) -> dict:
+    """
+
+    :param users: np.ndarray of the users ids.
+    :param items: np.ndarray of the items ids.
+    :param rng: np.random.Generator.
+    :param num_factors: int of the number of factors.
+    :return: dict of random factors, in the same format as `get_svd_factors`.
+
+    A function draws the factors of an SVD model without training it, to measure the phases that use the factors.
+    """
+    return {"pu": rng.normal(0, 0.1, (len(users), num_factors)),
+            "qi": rng.normal(0, 0.1, (len(items), num_factors)),
+            "bu": rng.normal(0, 0.3, len(users)),
+            "bi": rng.normal(0, 0.3, len(items)),
+            "global_mean": 3.5,
+            "biased": True,
+            "rating_scale": (min(model_input["rating_scale"]), max(model_input["rating_scale"])),
+            "raw2inner_users": {int(u): i for i, u in enumerate(users)},
+            "raw2inner_items": {int(i): j for j, i in enumerate(items)}}
+
+
+def measure(function: callable, repeats: int) -> list:
+    """
+
+    :param function: callable without arguments.
+    :param repeats: int of the number of calls.
+    :return: list of the wall-clock durations of the calls in seconds.
+    """
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def get_record(phase: str, durations: list, scale: float, consumers: int, items: int) -> dict:
+    """
+
+    :param phase: str of the phase name.
+    :param durations: list of the measured durations in seconds.
+    :param scale: float of the scale of the dataset.
+    :param consumers: int of the number of consumers of the phase.
+    :param items: int of the number of items of the phase.
+    :return: dict of the result of the phase, its duration being the median of the measured ones.
+    """
+    print(f"{phase} at {scale}x ({consumers} consumers, {items} items): {np.median(durations):.4f}s")
+    return {"phase": phase, "scale": scale, "consumers": consumers, "items": items,
+            "seconds": float(np.median(durations)), "durations": durations}
+
+
+def benchmark_matrix_phases(scale: float, phases: list) -> list:
+    """
+
+    :param scale: float multiplying the users and the items of the MovieLens dataset.
+    :param phases: list of the phases to measure.
+    :return: list of the results of the phases.
+    """
+    directory = get_synthetic_data(scale, scale)
+    dataset_dir = os.path.join(directory, model_input["dataset_directory"])
+    users = np.unique(pd.read_csv(os.path.join(dataset_dir, model_input["ratings_dataset"]), usecols=["userId"]))
+    item_ids = pd.read_csv(os.path.join(dataset_dir, model_input["items_dataset"]), usecols=["movieId"])["movieId"]
+    item_ids = item_ids.to_numpy()
+    consumers = users[:max(1, min(len(users), benchmark_parameters["max_matrix_cells"] // len(item_ids)))]
+    factors = get_synthetic_factors(users, item_ids, np.random.default_rng(benchmark_parameters["seed"]))
+    pool_size = model_parameters["recommendation_length"] + model_parameters["timesteps"]
+    repeats = benchmark_parameters["repeats"]
+    size = {"scale": scale, "consumers": len(consumers), "items": len(item_ids)}
+    records = []
+    if "predict" in phases:
+        durations = measure(lambda: predict_utilities_matrix(factors, consumers, item_ids), repeats)
+        records.append(get_record("predict", durations, **size))
+    utilities = predict_utilities_matrix(factors, consumers, item_ids).astype(model_input["utilities_dtype"])
+    store = RecommendationStore.from_utilities(consumers, item_ids, utilities, pool_size=pool_size)
+    if "rank" in phases:
+        durations = measure(lambda: RecommendationStore.from_utilities(consumers, item_ids, utilities,
+                                                                       pool_size=pool_size), repeats)
+        records.append(get_record("rank", durations, **size))
+    if "rerank" in phases:
+        profits = generate_profitdata(benchmark_parameters["seed"], len(item_ids))
+        durations = measure(lambda: rerank_items_consider_profit(store, profits, [0.5, 0.5], pool_size), repeats)
+        records.append(get_record("rerank", durations, **size))
+    if "thresholds" in phases:
+        rows = np.arange(len(consumers))
+        quantiles = model_parameters["quantile_consumer_expectation"]
+        durations = measure(lambda: store.compute_quantiles(rows, quantiles), repeats)
+        records.append(get_record("thresholds", durations, **size))
+    return records
+
+
+def check_predictions(model: object) -> None:
+    """
+
+    :param model: RecommendationModel whose factors were retrained.
+
+    A function checks that the utilities predicted by a model, some of them computed by earlier retrainings, are the
+     utilities predicted by its current factors, and raises a RuntimeError otherwise.
+    """
+    consumers = model.predicted_consumers
+    candidates = model.item_ids[model.predicted_candidates]
+    expected = predict_utilities_matrix(model.svd_factors, consumers, candidates).astype(model.predicted_utilities.dtype)
+    stale = np.flatnonzero((expected != model.predicted_utilities).any(axis=1))
+    if len(stale):
+        raise RuntimeError(f"The predicted utilities of {len(stale)} consumers are not the predictions of the retrained "
+                           f"factors, e.g. consumer {consumers[stale[0]]}")
+
+
+def fits_model_phases(scale: float) -> bool:
+    """
+
+    :param scale: float multiplying the users of the MovieLens dataset.
+    :return: bool, True if the utilities matrix of all the consumers is not larger than `max_matrix_cells`.
+    """
+    return round(NUM_USERS * scale) * NUM_ITEMS <= benchmark_parameters["max_matrix_cells"]
+
+
+def use_model_data(scale: float) -> str:
+    """
+
+    :param scale: float multiplying the users of the MovieLens dataset.
+    :return: str of the synthetic data directory.
+
+    A function makes the models of the process use a synthetic dataset and generates its recommendations data.
+    """
+    directory = get_synthetic_data(scale, 1)
+    set_data_directory(directory)
+    store_recommender_systems_generated_data()
+    return directory
+
+
+def benchmark_model_phases(scale: float, phases: list) -> list:
+    """
+
+    :param scale: float multiplying the users of the MovieLens dataset.
+    :param phases: list of the phases to measure.
+    :return: list of the results of the phases.
+    """
+    use_model_data(scale)
+    kwargs = {"recommendation_strategy": "consumer_only",
+              "quantile_consumer_expectation": model_parameters["quantile_consumer_expectation"][0],
+              "seed": benchmark_parameters["seed"]}
+    repeats = benchmark_parameters["repeats"]
+    durations = measure(lambda: RecommendationModel(**kwargs), 1)
+    model = RecommendationModel(**kwargs)
+    size = {"scale": scale, "consumers": model.num_consumers, "items": len(model.item_ids)}
+    records = []
+    if "construction_cold" in phases:
+        records.append(get_record("construction_cold", durations, **size))
+    if "construction" in phases:
+        records.append(get_record("construction", measure(lambda: RecommendationModel(**kwargs), repeats), **size))
+    if "step" in phases:
+        records.append(get_record("step", measure(model.step, benchmark_parameters["steps"]), **size))
+    if "retrain" in phases:
+        records.append(get_record("retrain", measure(model.recompute_consumers_utilities, repeats), **size))
+        check_predictions(model)
+    if "collect" in phases:
+        records.append(get_record("collect", measure(lambda: model.datacollector.collect(model), repeats), **size))
+    return records
+
+
+def benchmark_sweep(scale: float) -> list:
+    """
+
+    :param scale: float multiplying the users of the MovieLens dataset.
+    :return: list of the result of the sweep.
+    """
+    directory = use_model_data(scale)
+    var_params = {"recommendation_strategy": model_parameters["recommendation_strategy"],
+                  "quantile_consumer_expectation": model_parameters["quantile_consumer_expectation"]}
+    with tempfile.TemporaryDirectory() as result_dir:
+        batch_run = ParallelBatchRunner(RecommendationModel,
+                                        variable_parameters=var_params,
+                                        seed_function=get_run_seed,
+                                        iterations=benchmark_parameters["sweep_iterations"],
+                                        max_steps=benchmark_parameters["sweep_steps"],
+                                        processes=model_parameters["number_of_processes"],
+                                        result_dir=result_dir,
+                                        initializer=set_data_directory,
+                                        initargs=(directory,),
+                                        display_progress=False)
+        durations = measure(batch_run.run_all, 1)
+    return [get_record("sweep", durations, scale, round(NUM_USERS * scale), NUM_ITEMS)]
+
+
+def compare_to_baseline(records: list, baseline: dict) -> list:
+    """
+
+    :param records: list of the results of the phases.
+    :param baseline: dict of the baseline results, loaded from its JSON file.
+    :return: list of the results slower than their baseline by more than `regression_tolerance`.
+
+    A function prints the change of the duration of each phase from its baseline.
+    """
+    baseline_seconds = {(r["phase"], r["scale"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for record in records:
+        key = (record["phase"], record["scale"])
+        if key not in baseline_seconds:
+            print(f"{record['phase']} at {record['scale']}x: no baseline")
+            continue
+        change = record["seconds"] / baseline_seconds[key] - 1
+        regression = change > benchmark_parameters["regression_tolerance"]
+        print(f"{record['phase']} at {record['scale']}x: {record['seconds']:.4f}s, baseline "
+              f"{baseline_seconds[key]:.4f}s ({change:+.0%}){' REGRESSION' if regression else ''}")
+        if regression:
+            regressions.append(record)
+    return regressions
+
+
+def run_benchmarks(scales: list, phases: list) -> dict:
+    """
+
+    :param scales: list of the scales of the datasets.
+    :param phases: list of the phases to measure.
+    :return: dict of the results, with the machine and the parameters they were measured with.
+    """
+    records = []
+    for scale in scales:
+        if set(phases) & set(MATRIX_PHASES):
+            records += benchmark_matrix_phases(scale, phases)
+        if set(phases) & set(MODEL_PHASES):
+            if fits_model_phases(scale):
+                records += benchmark_model_phases(scale, phases)
+            else:
+                print(f"The model phases are skipped at {scale}x, the utilities matrix is larger than max_matrix_cells")
+    model_scales = [s for s in scales if fits_model_phases(s)]
+    if "sweep" in phases and model_scales:
+        records += benchmark_sweep(min(model_scales))
+    return {"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                        "cpu_count": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__},
+            "parameters": dict(benchmark_parameters, scales=scales, phases=phases),
+            "results": records}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the main phases of the simulation on synthetic datasets.")
+    parser.add_argument("--scales", type=float, nargs="+", default=benchmark_parameters["scales"])
+    parser.add_argument("--phases", nargs="+", choices=PHASES, default=PHASES)
+    parser.add_argument("--baseline", default=os.path.join(get_benchmark_dir(), "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+    scales = [int(s) if float(s).is_integer() else s for s in args.scales]
+
+    results = run_benchmarks(scales, args.phases)
+    create_directory(get_benchmark_dir())
+    results_path = os.path.join(get_benchmark_dir(), f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(results_path, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print(f"Results are stored in {results_path}")
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fp:
+            regressions = compare_to_baseline(results["results"], json.load(fp))
+    if args.save_baseline:
+        shutil.copyfile(results_path, args.baseline)
+        print(f"Baseline is stored in {args.baseline}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of the full state of a run: the consumers, the recommendations, the random generators, the social media
+counters, the provider totals and the records collected but not written yet.
+
+The inputs shared by the runs of a process (the catalog, the utilities, the profits and the initial rankings, see
+`simulation_context`) are not stored in a checkpoint but referenced, and they are taken from the context of the process
+restoring it, which must read the same data directory. An initial ranking is written once next to the checkpoints that
+reference it (`get_rankings_path`), and it is read from there by a process that has not ranked it. The writers of the
+outputs (the results files, the instrumentation sink and the memory accounting) are created again when a run is
+restored.
+
+A checkpoint is used to:
+    resume a run: the runs writing results files are checkpointed every `checkpoint_every` steps (`get_checkpoint_path`)
+        and `create_or_resume` restores a run from its last checkpoint, the results files being cut back to the records
+        written at the checkpoint.
+    fork a run: `fork_model` copies a run in the process, and `run_warmup` checkpoints a warm-up run from which every
+        scenario of a sweep is forked by `fork_warmup`, in the process or in the workers. A fork is switched to its
+        scenario by `RecommendationModel.set_scenario`.
+"""
+
+import glob
+import io
+import os
+import pickle
+
+from instrumentation import FileSink
+from memory_accounting import MemoryAccounting
+from read_config import model_parameters
+from result_sink import ResultSink
+from simulation_context import get_simulation_context
+from utils import SCENARIOS, get_sensitive_params
+
+CHECKPOINT_VERSION = 1
+
+
+# the attributes of an initial ranking shared by the overlays of the runs, see `RecommendationStore.overlay`
+RANKING_ATTRIBUTES = ("consumer_ids", "item_ids", "items", "ratings", "utilities", "candidates", "profits", "row_of",
+                      "consumers_order", "index_of", "column_of")
+
+
+def get_shared_inputs(context: object, rankings: bool = True) -> dict:
+    """
+
+    :param context: SimulationContext of the process.
+    :param rankings: bool, if True the initial rankings cached by the context are shared inputs too.
+    :return: dict of the reference of each shared input, by the id of its object.
+    """
+    shared = {}
+    if rankings:
+        for key, store in context.rankings.items():
+            shared[id(store)] = ("rankings", key)
+            for name in RANKING_ATTRIBUTES:
+                if getattr(store, name) is not None:
+                    shared[id(getattr(store, name))] = ("rankings", key, name)
+            for quantile, thresholds in store.thresholds.items():
+                shared[id(thresholds)] = ("rankings", key, "thresholds", quantile)
+    shared[id(context)] = ("context",)
+    for name in ("item_ids", "rated_items", "initial_beta", "traced_consumers", "candidates"):
+        shared[id(getattr(context, name))] = ("context", name)
+    for i, array in enumerate(context.utilities):
+        shared[id(array)] = ("utilities", i)
+    for seed, profits in context.profits.items():
+        shared[id(profits)] = ("profits", seed)
+    return shared
+
+
+class CheckpointPickler(pickle.Pickler):
+    """
+    A pickler storing a reference to the shared inputs instead of their content, and nothing of the output writers.
+    The keys of the initial rankings it referenced are kept in `rankings`.
+    """
+
+    def __init__(self: object, file: object, context: object, rankings: bool = True) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.shared = get_shared_inputs(context, rankings)
+        self.rankings = set()
+
+    def persistent_id(self: object, obj: object) -> tuple:
+        if isinstance(obj, (ResultSink, FileSink, MemoryAccounting)):
+            return ("output",)
+        pid = self.shared.get(id(obj))
+        if pid is not None and pid[0] == "rankings":
+            self.rankings.add(pid[1])
+        return pid
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    """
+    An unpickler resolving the references to the shared inputs with the context of the process. The initial rankings
+    the context has not ranked are read from `directory`.
+    """
+
+    def __init__(self: object, file: object, context: object, directory: str = None) -> None:
+        super().__init__(file)
+        self.context = context
+        self.directory = directory
+
+    def persistent_load(self: object, pid: tuple) -> object:
+        if pid[0] == "output":
+            return None
+        if pid[0] == "rankings":
+            store = get_ranking(self.context, pid[1], self.directory)
+            if len(pid) == 2:
+                return store
+            return store.thresholds[pid[3]] if pid[2] == "thresholds" else getattr(store, pid[2])
+        if pid[0] == "context":
+            return self.context if len(pid) == 1 else getattr(self.context, pid[1])
+        if pid[0] == "utilities":
+            return self.context.utilities[pid[1]]
+        if pid[0] == "profits":
+            return self.context.get_profits(pid[1])
+        raise pickle.UnpicklingError(f"Unknown shared input: {pid}")
+
+
+def get_rankings_path(directory: str, key: tuple) -> str:
+    """
+
+    :param directory: str of the directory of the checkpoints.
+    :param key: tuple of the key of an initial ranking in the context, see `SimulationContext.get_recommendations`.
+    :return: str of the path of the file of the ranking.
+    """
+    return os.path.join(directory, f"rankings-{'-'.join(str(k) for k in key)}.p")
+
+
+def save_ranking(context: object, key: tuple, directory: str) -> None:
+    """
+
+    :param context: SimulationContext of the process.
+    :param key: tuple of the key of the initial ranking.
+    :param directory: str of the directory of the checkpoints.
+
+    A function writes an initial ranking next to the checkpoints referencing it, once: the ranking of a key is the same
+    in every process.
+    """
+    path = get_rankings_path(directory, key)
+    if os.path.exists(path):
+        return
+    buffer = io.BytesIO()
+    CheckpointPickler(buffer, context, rankings=False).dump(context.rankings[key])
+    # the runs of several processes may write the same ranking at once
+    with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+
+def get_ranking(context: object, key: tuple, directory: str = None) -> object:
+    """
+
+    :param context: SimulationContext of the process.
+    :param key: tuple of the key of the initial ranking.
+    :param directory: str of the directory of the checkpoints.
+    :return: RecommendationStore of the initial ranking, from the context or read from its file and cached.
+    """
+    def read():
+        if directory is None:
+            raise pickle.UnpicklingError(f"The initial ranking {key} is not cached by the process")
+        with open(get_rankings_path(directory, key), "rb") as f:
+            return CheckpointUnpickler(f, context).load()
+    return context.get_recommendations(key, read)
+
+
+def dump_checkpoint(model: object, directory: str = None) -> bytes:
+    """
+
+    :param model: RecommendationModel.
+    :param directory: str of the directory the checkpoint is written to, the initial rankings it references are written
+        there too. It is None for a checkpoint restored by the same process, e.g. a fork.
+    :return: bytes of the checkpoint of the model.
+
+    A function checkpoints a run. The records of a run writing results files are written before, and the sizes of its
+    files are stored in the checkpoint, so the run can be resumed from the same files (CSV results files only).
+    """
+    sink = getattr(model.datacollector, "sink", None)
+    files = None
+    if sink is not None:
+        if sink.results_format != "csv":
+            raise ValueError("Only the runs writing CSV results files can be checkpointed")
+        model.datacollector.flush()
+        sink.wait()
+        files = {"directory": sink.directory, "run_name": sink.run_name,
+                 "sizes": {os.path.basename(path): os.path.getsize(path) for path in sink.paths.values()}}
+    buffer = io.BytesIO()
+    pickler = CheckpointPickler(buffer, model.context)
+    pickler.dump({"version": CHECKPOINT_VERSION, "model": model, "files": files})
+    if directory is not None:
+        for key in pickler.rankings:
+            save_ranking(model.context, key, directory)
+    return buffer.getvalue()
+
+
+def save_checkpoint(model: object, path: str) -> None:
+    """
+
+    :param model: RecommendationModel.
+    :param path: str of the path of the checkpoint file.
+
+    A function writes the checkpoint of a run to a file, replacing the previous checkpoint only once it is complete.
+    """
+    data = dump_checkpoint(model, os.path.dirname(path))
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_model(data: bytes, result_dir: str = None, directory: str = None, **kwargs: dict) -> object:
+    """
+
+    :param data: bytes of a checkpoint.
+    :param result_dir: str of the directory of the results files of the restored run, the records are kept in memory
+        when None.
+    :param directory: str of the directory the checkpoint was written to, None for a checkpoint of the same process.
+    :param **kwargs: dict of the scenario of the restored run, see `RecommendationModel.set_scenario`.
+    :return: RecommendationModel restored from the checkpoint.
+
+    A function restores a run. A run that wrote results files before the checkpoint can only be resumed in the same
+    scenario and directory: its files are cut back to their sizes at the checkpoint. A run that had finished is not
+    resumed, its files are left as they are, e.g. merged by `plot_results`. The records of a run that kept them in
+    memory are written to the files of the restored run, under its scenario.
+    """
+    checkpoint = CheckpointUnpickler(io.BytesIO(data), get_simulation_context(), directory).load()
+    if checkpoint["version"] != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version: {checkpoint['version']}")
+    model, files = checkpoint["model"], checkpoint["files"]
+    model.set_scenario(**kwargs)
+    if files is not None:
+        if result_dir is None or os.path.abspath(result_dir) != os.path.abspath(files["directory"]) or \
+                model.run_name != files["run_name"]:
+            raise ValueError(f"The records of {files['run_name']} were written to {files['directory']}, "
+                             "the run can only be resumed there in the same scenario")
+        if not model.running or model.schedule.steps >= model_parameters["timesteps"]:
+            model.running = False
+            model.reopen_outputs()
+            return model
+        missing = [name for name in files["sizes"] if not os.path.exists(os.path.join(result_dir, name))]
+        if missing:
+            raise FileNotFoundError(f"The results files {', '.join(missing)} of {files['run_name']} were removed or "
+                                    "merged since its checkpoint, the run cannot be resumed")
+        for path in glob.glob(os.path.join(result_dir, f"*-data-{files['run_name']}.csv")):
+            if os.path.basename(path) not in files["sizes"]:
+                os.remove(path)
+        for name, size in files["sizes"].items():
+            os.truncate(os.path.join(result_dir, name), size)
+    model.reopen_outputs(result_dir)
+    return model
+
+
+def restore_model(path: str, result_dir: str = None, **kwargs: dict) -> object:
+    """
+
+    :param path: str of the path of the checkpoint file.
+    :param result_dir: str of the directory of the results files of the restored run.
+    :param **kwargs: dict of the scenario of the restored run, see `RecommendationModel.set_scenario`.
+    :return: RecommendationModel restored from the checkpoint, see `load_model`.
+    """
+    with open(path, "rb") as f:
+        return load_model(f.read(), result_dir, os.path.dirname(path), **kwargs)
+
+
+def fork_model(model: object, **kwargs: dict) -> object:
+    """
+
+    :param model: RecommendationModel keeping its records in memory.
+    :param **kwargs: dict of the scenario of the fork, see `RecommendationModel.set_scenario`.
+    :return: RecommendationModel of an independent copy of the run switched to the scenario.
+    """
+    return load_model(dump_checkpoint(model), **kwargs)
+
+
+def get_run_name(kwargs: dict) -> str:
+    """
+
+    :param kwargs: dict of the parameters of a run.
+    :return: str of the name of the run, as `RecommendationModel.run_name`.
+    """
+    d_params = {p: kwargs[p] for p in get_sensitive_params()}
+    return f"{SCENARIOS[str(d_params)]}-run{kwargs.get('iteration', 0)}"
+
+
+def get_checkpoint_path(result_dir: str, run_name: str) -> str:
+    """
+
+    :param result_dir: str of the directory of the results files of the run.
+    :param run_name: str of the name of the run.
+    :return: str of the path of the last checkpoint of the run.
+    """
+    return os.path.join(result_dir, f"checkpoint-{run_name}.p")
+
+
+def create_or_resume(create: callable, **kwargs: dict) -> object:
+    """
+
+    :param create: callable creating a run from its parameters, e.g. RecommendationModel.
+    :param **kwargs: dict of the parameters of the run.
+    :return: RecommendationModel restored from the last checkpoint of the run, or created when there is none.
+
+    A function resumes a run of an interrupted sweep. The records of a run interrupted before its first checkpoint are
+    removed, the run starts again, and a run that had finished is not run again (see `load_model`).
+    """
+    result_dir = kwargs.get("result_dir")
+    if result_dir is not None:
+        run_name = get_run_name(kwargs)
+        path = get_checkpoint_path(result_dir, run_name)
+        if os.path.exists(path):
+            return restore_model(path, result_dir)
+        for path in glob.glob(os.path.join(result_dir, f"*-data-{run_name}.*")):
+            os.remove(path)
+    return create(**kwargs)
+
+
+def get_warmup_path(directory: str, iteration: int) -> str:
+    """
+
+    :param directory: str of the directory of the warm-up checkpoints.
+    :param iteration: int of the iteration.
+    :return: str of the path of the warm-up checkpoint of the iteration.
+    """
+    return os.path.join(directory, f"warmup-run{iteration}.p")
+
+
+def run_warmup(create: callable, directory: str, steps: int, **kwargs: dict) -> str:
+    """
+
+    :param create: callable creating a run from its parameters, e.g. RecommendationModel.
+    :param directory: str of the directory of the warm-up checkpoints.
+    :param steps: int of the number of steps of the warm-up.
+    :param **kwargs: dict of the parameters of the warm-up run, without `result_dir`: its records are kept in memory
+        and written by each fork.
+    :return: str of the path of the warm-up checkpoint.
+
+    A function runs the steps shared by the scenarios of an iteration once and checkpoints them, a warm-up already
+    checkpointed is not run again.
+    """
+    path = get_warmup_path(directory, kwargs.get("iteration", 0))
+    if not os.path.exists(path):
+        model = create(**kwargs)
+        for _ in range(steps):
+            model.step()
+        save_checkpoint(model, path)
+    return path
+
+
+def fork_warmup(directory: str, result_dir: str = None, **kwargs: dict) -> object:
+    """
+
+    :param directory: str of the directory of the warm-up checkpoints.
+    :param result_dir: str of the directory of the results files of the fork.
+    :param **kwargs: dict of the parameters of the run: its scenario, iteration and seed.
+    :return: RecommendationModel of the run forked from the warm-up of its iteration, see `run_warmup`.
+    """
+    return restore_model(get_warmup_path(directory, kwargs.get("iteration", 0)), result_dir, **kwargs)
@@ -5,6 +5,7 @@ import sys
 import numpy as np
 from mesa import Agent
 from mesa.model import Model
+from random_streams import CONSUME, FEEDBACK, LOOK, POST
 from read_config import *
 from scipy.stats import beta
 from utils import update_consumer_personal_experiences
@@ -26,6 +27,17 @@ class ConsumerAgent(Agent):
         self.consumption_probability = self.trust
         self.consumption_probability_limits = [0, 0]  # [lower limit, upper limit]]
         self.provider_reputation_in_memory = 0  # to remember the previous reputation that had seen on the social media
+        self.draw_row = None  # the row of the consumer in the random numbers drawn for the step
+
+    def draw(self: Agent, column: int) -> float:
+        """
+
+        :param column: int of the column of a decision in the uniform random numbers of the step.
+        :return: float in [0, 1).
+
+        A function gets the uniform random number of the consumer for a decision, see `random_streams`.
+        """
+        return self.model.step_draws.uniforms[self.draw_row, column]
 
     def consume_item(self: Agent) -> bool:
         """
@@ -34,7 +46,7 @@ class ConsumerAgent(Agent):
 
         A function decides either to consume an item or not.
         """
-        p = np.random.uniform(0, 1)
+        p = self.draw(CONSUME)
         if self.consumption_probability >= p:
             return 1
         else:
@@ -71,7 +83,7 @@ class ConsumerAgent(Agent):
         """
         A function to define consumer's decision to observe the social media
         """
-        probability_looking_social_media = np.random.uniform()
+        probability_looking_social_media = self.draw(LOOK)
         if probability_looking_social_media >= model_parameters["observing_socialmedia_likelihood"]:
             self.provider_reputation_in_memory = (
                 self.model.social_media[0]) / (self.model.social_media[0] + self.model.social_media[1]+1)
@@ -86,9 +98,8 @@ class ConsumerAgent(Agent):
         A function computes the true utility of the consumed item.
         """
         predicted_utility = item["rating"]
-        error = np.random.normal(
-            model_parameters["error"]["mu"],
-            model_parameters["error"]["sd"])
+        error = model_parameters["error"]["mu"] + \
+            model_parameters["error"]["sd"] * self.model.step_draws.normals[self.draw_row]
         self.true_utility = predicted_utility + error
         if self.true_utility < 0.5:
             self.true_utility = 0.5
@@ -96,23 +107,16 @@ class ConsumerAgent(Agent):
             self.true_utility = 5
         self.true_utility = round(self.true_utility, 3)
 
-    def pick_item(self: Agent, items: list) -> dict:
+    def pick_item(self: Agent, items: np.ndarray) -> int:
         """
 
-        :param items: list of dicts.
+        :param items: np.ndarray of the ranks of the recommended items.
         :return: int.
 
-        A function chooses an item from a list of recommendations.
-        """
-        # generate N probabilities that are summed up to 1 from Dirichlet distribution
-        rank_dist = np.random.dirichlet(
-            np.ones(self.model.recommendation_length), size=1)
-        # sort the probabilities descendingly, the first items on the list have
-        # items on the top of the list get higher probabilities
-        rank_dist = -np.sort(-rank_dist)
-        indcies = list(range(len(items)))
-        # pick a random index using the generated probabilities
-        selected_indx = np.random.choice(indcies, p=rank_dist[0])
+        A function chooses an item from a list of recommendations, the positions of all consumers are picked at once
+         by the model (see `random_streams.sample_rank_positions`).
+        """
+        selected_indx = self.model.get_picked_positions()[self.draw_row]
         selected_item = items[selected_indx]
         return selected_item
 
@@ -125,7 +129,7 @@ class ConsumerAgent(Agent):
             self.positive_negative_experience[0] + self.positive_negative_experience[1])
 
     def post_to_social_media(self: Agent) -> None:
-        p = np.random.uniform(0, 1)
+        p = self.draw(POST)
         social_media_prob = self.social_media_prob()
         if p >= social_media_prob:
             if self.is_satisfied():
@@ -150,7 +154,7 @@ class ConsumerAgent(Agent):
 
         A function makes decision if a consumer submits feedback to the service provider or not.
         """
-        p = np.random.uniform()
+        p = self.draw(FEEDBACK)
         if p >= self.model.feedback_likelihood:
             return 1
         return 0
@@ -167,6 +171,46 @@ class ConsumerAgent(Agent):
         else:
             return 0
 
+    @property
+    def satisfied(self: Agent) -> int:
+        """
+
+        :return: int, 1 if the consumer is satisfied of the last consumed item, 0 otherwise.
+        """
+        return self.is_satisfied()
+
+    @property
+    def lower_limit(self: Agent) -> float:
+        """
+
+        :return: float of the lower limit of the consumption probability.
+        """
+        return self.consumption_probability_limits[0]
+
+    @property
+    def upper_limit(self: Agent) -> float:
+        """
+
+        :return: float of the upper limit of the consumption probability.
+        """
+        return self.consumption_probability_limits[1]
+
+    @property
+    def num_positive_personal(self: Agent) -> float:
+        """
+
+        :return: float of the positive personal experiences rounded to 3 decimals.
+        """
+        return round(self.positive_negative_experience[0], 3)
+
+    @property
+    def num_negative_personal(self: Agent) -> float:
+        """
+
+        :return: float of the negative personal experiences rounded to 3 decimals.
+        """
+        return round(self.positive_negative_experience[1], 3)
+
     def update_experience(self: Agent) -> None:
         """
 
@@ -188,6 +232,7 @@ class ConsumerAgent(Agent):
 
          A function updates consumer's state variables each time step.
         """
+        self.draw_row = self.model.step_draws.row(self.consumer_id)
         if model_parameters["drop_out_on"]:
             if self.trust < (
                     self.initialtrust *
@@ -196,15 +241,17 @@ class ConsumerAgent(Agent):
 
         self.selecteditem = None
         # get recommendtion list
-        self.recommended_list = self.model.topn[self.consumer_id]
+        recommendations = self.model.recommendations
+        topn = self.model.topn[recommendations.row_of[self.consumer_id]]
+        self.recommended_list = topn[topn >= 0]
         # check if the agent consumed all the items
-        if not self.recommended_list:
+        if not len(self.recommended_list):
             print(f"No more item available for agent {self.consumer_id}")
-            pass
-        if self.consume_item():
+        elif self.consume_item():
             # compute the consumption rate
-            # selecteditem as a tuple (movieid, rate)
-            self.selecteditem = self.pick_item(self.recommended_list)
+            # selecteditem as a dict {iid, rating}
+            selected_rank = self.pick_item(self.recommended_list)
+            self.selecteditem = recommendations.get_item(self.consumer_id, selected_rank)
             # compute the true utility of consumed item
             self.compute_true_utility(self.selecteditem)
             # update provider utilities after consuming the item
@@ -213,9 +260,7 @@ class ConsumerAgent(Agent):
             if model_parameters["social_media_on"]:
                 self.post_to_social_media()
             # remove the selecteditem from the recommendations, so it won't be recommended again
-            inx = self.model.recommendations[self.consumer_id].index(
-                self.selecteditem)
-            del self.model.recommendations[self.consumer_id][inx]
+            recommendations.consume(self.consumer_id, selected_rank)
             # replace the predicted utility by the true one
             self.selecteditem["rating"] = self.true_utility
             # send feedback and post public trust
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+from mesa.model import Model
+from random_streams import CONSUME, FEEDBACK, LOOK, POST
+from read_config import *
+from scipy.stats import beta
+from utils import update_consumer_personal_experiences
+
+
+class ConsumerPopulation:
+    """
+    A vectorized alternative to the `ConsumerAgent` objects. The state variables of all consumers are held in NumPy
+    arrays (one entry per consumer), and the whole population is advanced by a few array operations per step.
+
+    A step follows the same decisions as `ConsumerAgent.consumer_adapt` and reads the same random numbers (see
+    `random_streams`). Consumers are activated in a random order, which only matters for social media: each consumer
+    observes the posts of the consumers activated before it and its own post. The order is shuffled with the random
+    generator of the model as the scheduler does, so both consumer modes give the same results for the same seed.
+    """
+
+    def __init__(self: object, model: Model, consumer_ids: list, beta_params: list, thresholds: list) -> None:
+        """
+
+        :param model: Model of the simulation.
+        :param consumer_ids: list of consumers ids.
+        :param beta_params: list of the initial [positive, negative] experiences of each consumer.
+        :param thresholds: list of the expectation thresholds of each consumer.
+        """
+        self.model = model
+        self.consumer_ids = np.asarray(consumer_ids)
+        beta_params = np.asarray(beta_params, dtype=np.float64)
+        self.positive_experience = beta_params[:, 0].copy()
+        self.negative_experience = beta_params[:, 1].copy()
+        self.compute_trust()
+        self.initialtrust = self.trust.copy()
+        self.minimum_utility_threshold = np.asarray(thresholds, dtype=np.float64)
+        self.true_utility = np.zeros(len(self.consumer_ids))
+        self.selecteditem = np.full(len(self.consumer_ids), None, dtype=object)
+        self.consumption_probability = self.trust.copy()
+        self.lower_limit = np.zeros(len(self.consumer_ids))
+        self.upper_limit = np.zeros(len(self.consumer_ids))
+        self.provider_reputation_in_memory = np.zeros(len(self.consumer_ids))
+        self.active = np.ones(len(self.consumer_ids), dtype=bool)
+        self.activation_order = list(range(len(self.consumer_ids)))
+
+    def compute_trust(self: object) -> None:
+        """
+
+         A function updates the trust of all consumers using the expected value of the beta distribution.
+        """
+        self.trust = self.positive_experience / (self.positive_experience + self.negative_experience)
+
+    def social_media_prob(self: object, true_utility: np.ndarray) -> np.ndarray:
+        """
+
+        :param true_utility: np.ndarray of the true utilities of the consumed items.
+        :return: np.ndarray of probabilities.
+
+        A function computes the probabilities of posting to social media from U-shape beta distribution.
+        """
+        return (1.4 - beta.pdf(true_utility / 5, a=2, b=2) + 0.2) / 1.6
+
+    def step(self: object) -> None:
+        """
+
+         A function updates the state variables of all active consumers, as `ConsumerAgent.consumer_adapt` does for one consumer.
+        """
+        model = self.model
+        recommendations = model.recommendations
+        # activation order of the consumers
+        self.model.random.shuffle(self.activation_order)
+        rows = np.array(self.activation_order, dtype=np.int64)
+        draws = model.step_draws
+        draw_rows = draws.rows(self.consumer_ids[rows])
+        dropout = np.zeros(len(rows), dtype=bool)
+        if model_parameters["drop_out_on"]:
+            dropout = self.trust[rows] < self.initialtrust[rows] * model_parameters["dropout_threshold"]
+
+        self.selecteditem[rows] = None
+        topn = model.topn[recommendations.get_rows(self.consumer_ids[rows])]
+        lengths = (topn >= 0).sum(axis=1)
+        # consumers who consumed all the items have nothing to consume
+        consume = (self.consumption_probability[rows] >= draws.uniforms[draw_rows, CONSUME]) & (lengths > 0)
+        consumers = rows[consume]
+        consumers_draw_rows = draw_rows[consume]
+        likes = np.zeros(len(rows), dtype=np.int64)
+        dislikes = np.zeros(len(rows), dtype=np.int64)
+        if len(consumers):
+            positions = draws.pick_positions(consumers_draw_rows, lengths[consume])
+            selected_ranks = topn[consume][np.arange(len(consumers)), positions]
+            store_rows = recommendations.get_rows(self.consumer_ids[consumers])
+            predicted_utility = recommendations.ratings[store_rows, selected_ranks].astype(np.float64)
+            error = model_parameters["error"]["mu"] + \
+                model_parameters["error"]["sd"] * draws.normals[consumers_draw_rows]
+            true_utility = np.round(np.clip(np.round(predicted_utility, 3) + error, 0.5, 5), 3)
+            self.true_utility[consumers] = true_utility
+            items = recommendations.items[store_rows, selected_ranks]
+            model.add_provider_utilities(model.profits[items].astype(np.float64))
+            send_feedback = draws.uniforms[consumers_draw_rows, FEEDBACK] >= model.feedback_likelihood
+            satisfied = true_utility >= self.minimum_utility_threshold[consumers]
+            if model_parameters["social_media_on"]:
+                post = draws.uniforms[consumers_draw_rows, POST] >= self.social_media_prob(true_utility)
+                likes[consume] = post & satisfied
+                dislikes[consume] = post & ~satisfied
+            recommendations.consume_many(store_rows, selected_ranks)
+            for r, item, utility, feedback in zip(consumers, items, true_utility, send_feedback):
+                # the same dict as a consumer agent gets from `RecommendationStore.get_item`
+                selecteditem = {"iid": int(recommendations.item_ids[item]), "rating": float(utility)}
+                if recommendations.profits is not None:
+                    selecteditem["profit"] = float(recommendations.profits[item])
+                selecteditem["feedback"] = int(feedback)
+                self.selecteditem[r] = selecteditem
+                model.store_consumed_items(int(self.consumer_ids[r]), selecteditem)
+            d = np.abs(self.minimum_utility_threshold[consumers] - true_utility)
+            inc = update_consumer_personal_experiences(d)
+            self.positive_experience[consumers] += np.where(satisfied, inc, 0)
+            self.negative_experience[consumers] += np.where(satisfied, 0, inc)
+            self.compute_trust()
+
+        # limits of the consumption probability
+        deviation_from_trust = model.a * model_parameters["social_media_reliance"]
+        self.lower_limit[rows] = np.maximum(self.trust[rows] - deviation_from_trust, 0)
+        self.upper_limit[rows] = np.minimum(self.trust[rows] + deviation_from_trust, 1)
+        # consumption probability, each consumer sees the posts made until its activation
+        self.consumption_probability[rows] = self.trust[rows]
+        if model_parameters["social_media_on"]:
+            seen_likes = model.social_media[0] + np.cumsum(likes)
+            seen_dislikes = model.social_media[1] + np.cumsum(dislikes)
+            look = draws.uniforms[draw_rows, LOOK] >= model_parameters["observing_socialmedia_likelihood"]
+            lookers = rows[look]
+            self.provider_reputation_in_memory[lookers] = seen_likes[look] / (seen_likes[look] + seen_dislikes[look] + 1)
+            cons = model_parameters["trust_weight"] * self.trust[lookers] + \
+                model_parameters["socia_media_weight"] * self.provider_reputation_in_memory[lookers]
+            self.consumption_probability[lookers] = np.maximum(self.lower_limit[lookers],
+                                                               np.minimum(self.upper_limit[lookers], cons))
+            model.social_media[0] += int(likes.sum())
+            model.social_media[1] += int(dislikes.sum())
+        # remove the dropout consumers after the step
+        if dropout.any():
+            self.active[rows[dropout]] = False
+            self.activation_order = [r for r in self.activation_order if self.active[r]]
+
+    def report(self: object, name: str) -> np.ndarray:
+        """
+
+        :param name: str of a reported variable.
+        :return: np.ndarray of the values of the variable for the active consumers.
+
+        A function reports a variable of the active consumers, it is used by the DataCollector.
+        """
+        if name == "satisfied":
+            return (self.true_utility >= self.minimum_utility_threshold)[self.active].astype(int)
+        if name == "num_positive_personal":
+            return np.round(self.positive_experience[self.active], 3)
+        if name == "num_negative_personal":
+            return np.round(self.negative_experience[self.active], 3)
+        return getattr(self, name)[self.active]
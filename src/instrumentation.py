@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class NullSink:
+    """
+    A sink discarding the step records, the instrumentation given this sink does not measure anything.
+    """
+    enabled = False
+
+    def write(self: object, record: dict) -> None:
+        pass
+
+    def close(self: object, summary: dict) -> None:
+        pass
+
+
+class MemorySink:
+    """
+    A sink keeping the step records and the summary of the run in memory.
+    """
+    enabled = True
+
+    def __init__(self: object) -> None:
+        self.records = []
+        self.summary = None
+
+    def write(self: object, record: dict) -> None:
+        self.records.append(record)
+
+    def close(self: object, summary: dict) -> None:
+        self.summary = summary
+
+
+class FileSink:
+    """
+    A sink writing the step records to a CSV or JSON Lines file as the run goes, and the summary of the run to a JSON
+    file next to it.
+    """
+    enabled = True
+
+    def __init__(self: object, path: str, file_format: str = "csv") -> None:
+        """
+
+        :param path: str of the path of the records file, without extension.
+        :param file_format: str of the format of the records file, "csv" or "jsonl".
+        """
+        if file_format not in ("csv", "jsonl"):
+            raise ValueError(f"Unknown instrumentation format: {file_format}")
+        self.path = f"{path}.{file_format}"
+        self.summary_path = f"{path}-summary.json"
+        self.file_format = file_format
+        self.file = open(self.path, "w", newline="")
+        self.writer = None
+
+    def write(self: object, record: dict) -> None:
+        if self.file_format == "jsonl":
+            self.file.write(json.dumps(record) + "\n")
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(record))
+            self.writer.writeheader()
+        self.writer.writerow(record)
+
+    def close(self: object, summary: dict) -> None:
+        self.file.close()
+        with open(self.summary_path, "w") as fp:
+            json.dump(summary, fp, indent=4)
+
+
+class PhaseTimer:
+    """
+    A context manager adding the wall-clock time spent in its block to a phase of the current step.
+    """
+    __slots__ = ("instrumentation", "phase", "start")
+
+    def __init__(self: object, instrumentation: object, phase: str) -> None:
+        self.instrumentation = instrumentation
+        self.phase = phase
+
+    def __enter__(self: object) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self: object, *exc_info) -> None:
+        self.instrumentation.timings[self.phase] += time.perf_counter() - self.start
+
+
+class NullTimer:
+    """
+    A context manager doing nothing, used when the instrumentation is disabled.
+    """
+    __slots__ = ()
+
+    def __enter__(self: object) -> None:
+        pass
+
+    def __exit__(self: object, *exc_info) -> None:
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class StepInstrumentation:
+    """
+    Named timers and counters of the steps of a run. The time spent in each phase of a step (`phase`) and the events
+    counted during the step (`count`) make one record per step, handed to a sink: `MemorySink`, `FileSink` or
+    `NullSink`. With a `NullSink` the timers do nothing and the counters are not updated, so the instrumentation of a run
+    that is not measured costs one method call per phase.
+
+    Every record has the same fields, the step, the seconds of each phase, the total seconds of the step, each counter
+    and each gauge (a value measured at the end of the step, e.g. the memory, see `gauge`), the phases that did not run
+    in a step, e.g. the retraining, having 0 seconds. `close` writes the summary of the run: the total, mean and maximum
+    seconds of each phase over the steps, the total of each counter and the maximum of each gauge.
+    """
+
+    def __init__(self: object, phases: list, counters: list, sink: object = None, gauges: list = ()) -> None:
+        """
+
+        :param phases: list of the names of the timed phases of a step.
+        :param counters: list of the names of the counters of a step.
+        :param sink: object receiving the step records, a NullSink by default.
+        :param gauges: list of the names of the gauges of a step.
+        """
+        self.phases = list(phases)
+        self.counters = list(counters)
+        self.gauges = dict.fromkeys(gauges, 0)
+        self.sink = sink if sink is not None else NullSink()
+        self.enabled = self.sink.enabled
+        self.timings = dict.fromkeys(self.phases, 0.0)
+        self.counts = dict.fromkeys(self.counters, 0)
+        self.step_start = None
+        self.history = defaultdict(list)
+
+    def set_sink(self: object, sink: object, gauges: list = ()) -> None:
+        """
+
+        :param sink: object receiving the step records from now on.
+        :param gauges: list of the names of the gauges, added to the previous ones.
+        """
+        self.sink = sink
+        self.enabled = sink.enabled
+        for name in gauges:
+            self.gauges.setdefault(name, 0)
+
+    def phase(self: object, name: str) -> object:
+        """
+
+        :param name: str of the name of the phase.
+        :return: object of a context manager timing its block as the phase.
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return PhaseTimer(self, name)
+
+    def count(self: object, name: str, value: int = 1) -> None:
+        """
+
+        :param name: str of the name of the counter.
+        :param value: int added to the counter.
+        """
+        if self.enabled:
+            self.counts[name] += value
+
+    def gauge(self: object, name: str, value: float) -> None:
+        """
+
+        :param name: str of the name of the gauge.
+        :param value: float of the value of the gauge at the end of the step.
+        """
+        if self.enabled:
+            self.gauges[name] = value
+
+    def start_step(self: object) -> None:
+        """
+
+        A function starts the timer of the whole step.
+        """
+        if self.enabled:
+            self.step_start = time.perf_counter()
+
+    def end_step(self: object, step: int) -> None:
+        """
+
+        :param step: int of the step.
+
+        A function hands the record of the step to the sink and resets the timers and the counters.
+        """
+        if not self.enabled:
+            return
+        record = {"step": step}
+        for name in self.phases:
+            record[f"{name}_seconds"] = self.timings[name]
+        record["total_seconds"] = time.perf_counter() - self.step_start
+        record.update(self.counts)
+        record.update(self.gauges)
+        for name, value in record.items():
+            self.history[name].append(value)
+        self.sink.write(record)
+        self.timings = dict.fromkeys(self.phases, 0.0)
+        self.counts = dict.fromkeys(self.counters, 0)
+
+    def summary(self: object) -> dict:
+        """
+
+        :return: dict of the summary of the steps recorded so far.
+        """
+        summary = {"steps": len(self.history["step"])}
+        if not summary["steps"]:
+            return summary
+        for name in self.phases + ["total"]:
+            seconds = np.asarray(self.history[f"{name}_seconds"])
+            summary[name] = {"total_seconds": float(seconds.sum()), "mean_seconds": float(seconds.mean()),
+                             "max_seconds": float(seconds.max())}
+        for name in self.counters:
+            summary[name] = int(np.sum(self.history[name]))
+        for name in self.gauges:
+            summary[name] = max(self.history[name])
+        return summary
+
+    def close(self: object) -> dict:
+        """
+
+        :return: dict of the summary of the run, also handed to the sink.
+        """
+        summary = self.summary()
+        self.sink.close(summary)
+        return summary
+
+
+def create_sink(instrumentation_format: str, directory: str = None, run_name: str = None) -> object:
+    """
+
+    :param instrumentation_format: str of the sink, "none", "memory", "csv" or "jsonl".
+    :param directory: str of the directory of the files of the run, the records are kept in memory when it is None.
+    :param run_name: str of the name of the run, part of the files names.
+    :return: object of the sink of the step records of a run.
+
+    A function creates the sink of the step records of a run, the files are `steps-data-{run_name}.csv` (or `.jsonl`)
+    and `steps-data-{run_name}-summary.json`.
+    """
+    if instrumentation_format == "none":
+        return NullSink()
+    if instrumentation_format == "memory" or directory is None:
+        return MemorySink()
+    return FileSink(os.path.join(directory, f"steps-data-{run_name}"), instrumentation_format)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tracemalloc
+
+
+def get_rss() -> int:
+    """
+
+    :return: int of the resident set size of the process in bytes.
+
+    A function reads the current resident set size from `/proc` on Linux, elsewhere it falls back to the peak resident
+    set size of the process.
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryAccounting:
+    """
+    The memory of a run sampled at the step boundaries: the resident set size of its process, the memory allocated by
+    Python and NumPy when `mode` is "tracemalloc", and the bytes of the main components of the run (e.g. the
+    recommendations or the collector buffers) given by the run. A sample is compared to the memory `budget` of the run.
+
+    The resident set size is the memory of the whole process, including the inputs shared by the runs of the process
+    (see `simulation_context`), so the budget of a run bounds the memory of the process while it runs.
+    """
+
+    def __init__(self: object, components: list, mode: str = "rss", budget: int = None) -> None:
+        """
+
+        :param components: list of the names of the components whose bytes are given to `sample`.
+        :param mode: str of the measure of the process memory, "rss" or "tracemalloc".
+        :param budget: int of the memory budget of the run in bytes, None for no budget.
+        """
+        if mode not in ("rss", "tracemalloc"):
+            raise ValueError(f"Unknown memory accounting mode: {mode}")
+        self.components = list(components)
+        self.mode = mode
+        self.budget = budget or None
+        self.started_tracing = mode == "tracemalloc" and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @property
+    def fields(self: object) -> list:
+        """
+
+        :return: list of the names of the fields of a sample.
+        """
+        fields = ["rss_bytes"]
+        if self.mode == "tracemalloc":
+            fields += ["traced_bytes", "traced_peak_bytes"]
+        return fields + [f"{name}_bytes" for name in self.components]
+
+    def sample(self: object, components: dict) -> dict:
+        """
+
+        :param components: dict of the bytes of each component.
+        :return: dict of the sampled memory in bytes, with the fields of `fields`.
+        """
+        sample = {"rss_bytes": get_rss()}
+        if self.mode == "tracemalloc":
+            sample["traced_bytes"], sample["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+        for name in self.components:
+            sample[f"{name}_bytes"] = int(components[name])
+        return sample
+
+    def exceeds_budget(self: object, sample: dict) -> bool:
+        """
+
+        :param sample: dict of a sample.
+        :return: bool, True if the resident set size of the sample is above the budget.
+        """
+        return self.budget is not None and sample["rss_bytes"] > self.budget
+
+    def report(self: object, sample: dict, run_name: str, step: int) -> str:
+        """
+
+        :param sample: dict of a sample.
+        :param run_name: str of the name of the run.
+        :param step: int of the step of the sample.
+        :return: str describing the memory of the run relative to its budget.
+        """
+        components = ", ".join(f"{name} {sample[f'{name}_bytes'] / 2 ** 20:.1f} MB" for name in self.components)
+        budget = "no budget" if self.budget is None else f"a budget of {self.budget / 2 ** 20:.1f} MB"
+        return f"{run_name} at step {step}: RSS {sample['rss_bytes'] / 2 ** 20:.1f} MB for {budget} ({components})"
+
+    def close(self: object) -> None:
+        """
+
+        A function stops tracing the allocations when the accounting started it.
+        """
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+
+def create_memory_accounting(components: list, mode: str, budget_mb: float) -> MemoryAccounting:
+    """
+
+    :param components: list of the names of the components of the run.
+    :param mode: str of the memory accounting, "none", "rss" or "tracemalloc".
+    :param budget_mb: float of the memory budget of the run in MB, 0 for no budget.
+    :return: MemoryAccounting of the run, None when the memory is neither measured nor bounded.
+
+    A function creates the memory accounting of a run, a budget without a mode is checked against the resident set size.
+    """
+    if mode == "none" and not budget_mb:
+        return None
+    return MemoryAccounting(components, "rss" if mode == "none" else mode, int(budget_mb * 2 ** 20) or None)
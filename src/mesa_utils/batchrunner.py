@@ -0,0 +1,173 @@
+"""
+Parallel Batch Runner
+=====================
+
+ParallelBatchRunner runs a model for every combination of the variable
+parameters, several iterations each, in a pool of worker processes.
+
+Each run receives explicit `iteration` and `seed` keyword arguments. The seed is
+derived from the scenario and the iteration by the `seed_function` given to
+the runner, so the results of a run do not depend on the worker that executed
+it or on the order the runs were scheduled.
+
+Workers do not send the model or its DataCollector back to the parent. They
+send the collected model and agent variables as dictionaries of column
+arrays, which are concatenated once all the runs are done, and the summary
+of the step timings of the run when the model is instrumented. When a
+`result_dir` is given, the runs stream their records to files of that
+directory instead and send nothing back.
+
+"""
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+
+def run_model(model_cls, kwargs, max_steps):
+    """Run one model and return its collected variables as column arrays.
+
+    Args:
+        model_cls: The class of the model to run, or a function creating
+            the model from the keyword arguments of a run.
+        kwargs: Keyword arguments of the model.
+        max_steps: Maximum number of steps of the run.
+
+    """
+    model = model_cls(**kwargs)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    # the summary of the step timings of the run, when the model is instrumented
+    instrumentation = getattr(model, "instrumentation", None)
+    summary = instrumentation.close() if instrumentation is not None else None
+    if getattr(model, "memory", None) is not None:
+        model.memory.close()
+    if getattr(model.datacollector, "sink", None) is not None:
+        # the records were written by the sink of the run
+        model.datacollector.close()
+        return None
+    model_vars = model.datacollector.get_model_vars_dataframe()
+    agent_vars = model.datacollector.get_agent_vars_dataframe()
+    return {
+        "model": {column: model_vars[column].to_numpy() for column in model_vars},
+        "agents": {column: agent_vars[column].to_numpy() for column in agent_vars},
+        "instrumentation": summary,
+    }
+
+
+class ParallelBatchRunner:
+    """Class for running a model over all the combinations of its variable
+    parameters in parallel.
+
+    Runs are executed in a process pool of `processes` workers. When
+    `processes` is 1, they are executed in the current process, which is
+    useful for debugging.
+
+    """
+
+    def __init__(self, model_cls, variable_parameters, seed_function, fixed_parameters=None,
+                 iterations=1, max_steps=1000, processes=None, result_dir=None, initializer=None, initargs=(),
+                 display_progress=True):
+        """Create a new ParallelBatchRunner.
+
+        Args:
+            model_cls: The class of the model to run, or a function creating
+                the model from the keyword arguments of a run.
+            variable_parameters: Dictionary of parameter names to lists of
+                values; every combination of the values is a scenario.
+            seed_function: Function taking the scenario parameters and the
+                iteration and returning the seed of the run.
+            fixed_parameters: Dictionary of parameters shared by all runs.
+            iterations: Number of runs of each scenario.
+            max_steps: Maximum number of steps of each run.
+            processes: Number of worker processes, all the cores by default.
+            result_dir: Directory the runs write their records to, passed
+                to the model as the `result_dir` keyword argument. The
+                records are kept in memory when it is None.
+            initializer: Function called with `initargs` in every worker
+                process before its first run, or in the current process
+                when `processes` is 1.
+            initargs: Arguments of `initializer`.
+            display_progress: Print the number of finished runs.
+
+        """
+        self.model_cls = model_cls
+        self.variable_parameters = variable_parameters
+        self.seed_function = seed_function
+        self.fixed_parameters = fixed_parameters or {}
+        self.iterations = iterations
+        self.max_steps = max_steps
+        self.processes = processes or os.cpu_count()
+        self.result_dir = result_dir
+        self.initializer = initializer
+        self.initargs = initargs
+        self.display_progress = display_progress
+        self.results = []
+
+    def _make_runs(self):
+        """Generate the keyword arguments of every run, ordered by scenario
+        and iteration."""
+        names = list(self.variable_parameters.keys())
+        runs = []
+        for values in itertools.product(*self.variable_parameters.values()):
+            params = dict(zip(names, values))
+            for iteration in range(self.iterations):
+                kwargs = dict(self.fixed_parameters)
+                kwargs.update(params)
+                kwargs["iteration"] = iteration
+                kwargs["seed"] = self.seed_function(params, iteration)
+                if self.result_dir is not None:
+                    kwargs["result_dir"] = self.result_dir
+                runs.append(kwargs)
+        return runs
+
+    def run_all(self):
+        """Run the model for all the scenarios and iterations."""
+        runs = self._make_runs()
+        self.results = [None] * len(runs)
+        if self.processes == 1:
+            if self.initializer is not None:
+                self.initializer(*self.initargs)
+            for i, kwargs in enumerate(runs):
+                self.results[i] = run_model(self.model_cls, kwargs, self.max_steps)
+                self._report_progress(i + 1, len(runs))
+            return
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=self.initializer,
+                                 initargs=self.initargs) as executor:
+            futures = {executor.submit(run_model, self.model_cls, kwargs, self.max_steps): i
+                       for i, kwargs in enumerate(runs)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                self.results[futures[future]] = future.result()
+                self._report_progress(done, len(runs))
+
+    def _report_progress(self, done, total):
+        if self.display_progress:
+            print(f"{done}/{total} runs done")
+
+    def _concat(self, key):
+        if self.result_dir is not None:
+            raise ValueError(f"The records of the runs were written to {self.result_dir}")
+        columns = self.results[0][key].keys()
+        return pd.DataFrame({
+            column: np.concatenate([result[key][column] for result in self.results])
+            for column in columns
+        })
+
+    def get_model_vars_dataframe(self):
+        """Create a pandas DataFrame of the model variables of all the runs,
+        one row per run and step."""
+        return self._concat("model")
+
+    def get_instrumentation_summaries(self):
+        """Return the summaries of the step timings of all the runs, in the
+        order of the runs."""
+        if self.result_dir is not None:
+            raise ValueError(f"The summaries of the runs were written to {self.result_dir}")
+        return [result["instrumentation"] for result in self.results]
+
+    def get_agent_vars_dataframe(self):
+        """Create a pandas DataFrame of the agent variables of all the runs,
+        one row per run, step and agent."""
+        return self._concat("agents")
@@ -34,10 +34,16 @@ The default DataCollector here makes several assumptions:
     * The schedule has an agent list called agents
     * For collecting agent-level variables, agents must have a unique_id
 
+ColumnarDataCollector collects the agent-level variables into preallocated
+NumPy buffers, one row per step and one column per agent, instead of a list of
+tuple records per step. AggregateDataCollector only keeps per-step summaries of
+the agent-level variables.
+
 """
 from functools import partial
 import itertools
 from operator import attrgetter
+import numpy as np
 import pandas as pd
 import types
 
@@ -168,8 +174,7 @@ class DataCollector:
                 return _prefix + reports
 
         #agent_records = map(get_reports, model.schedule.agents)
-        consumersClass = list(model.schedule.agents_by_type.keys())[1]
-        agent_records = map(get_reports, model.schedule.agents_by_type[consumersClass])
+        agent_records = map(get_reports, model.consumers)
         return agent_records
 
 
@@ -259,4 +264,352 @@ class DataCollector:
         """
         if table_name not in self.tables:
             raise Exception("No such table.")
-        return pd.DataFrame(self.tables[table_name])
\ No newline at end of file
+        return pd.DataFrame(self.tables[table_name])
+
+
+class ColumnarDataCollector(DataCollector):
+    """Class for collecting the agent-level variables of a model into typed
+    column buffers.
+
+    Each agent reporter is the name of an attribute. Every variable is stored
+    in a NumPy buffer of `max_steps + 1` rows (the initial state and one row
+    per step) and one column per agent id, which is grown if the model runs
+    longer. A mask flags the agents recorded at each step, so agents removed
+    from the model simply stop being recorded.
+
+    The agents are read from the `population` of the model when it has one,
+    whose `report` method returns the values of a variable for its active
+    agents as an array, otherwise from the consumer agents of the schedule.
+    Only the agents whose ids are in `agent_ids` are recorded, so a cohort of
+    the agents can be traced.
+
+    Values that are the same for the whole run (e.g. the scenario) are given
+    as `constants`: they are stored once and only repeated when the
+    DataFrames are built.
+
+    When `changes_only` is True, an agent is only recorded at the steps its
+    variables change (and when it is first recorded). An agent that stops
+    being recorded gets a last record with its last values and a `removed`
+    column set to 1. The dense view of every agent at every step is rebuilt
+    with `result_sink.forward_fill`.
+
+    When a `sink` is given, the buffers hold `flush_every` steps only. Every
+    time they are full, the collected model and agent records are handed to
+    the sink (see `result_sink.ResultSink`) and the buffers are reused, so the
+    DataFrames only hold the records that are not flushed yet. `close` must be
+    called at the end of the run to flush the last records.
+
+    """
+
+    def __init__(self, agent_ids, max_steps, model_reporters=None, agent_reporters=None,
+                 agent_dtypes=None, constants=None, id_columns=None, changes_only=False, sink=None,
+                 flush_every=None, tables=None):
+        """Instantiate a ColumnarDataCollector.
+
+        Args:
+            agent_ids: Ids of the recorded agents.
+            max_steps: Expected number of steps of the run.
+            model_reporters: Dictionary of reporter names and attributes/funcs.
+            agent_reporters: Dictionary of reporter names and attribute names.
+            agent_dtypes: Dictionary of reporter names and the dtype of their
+                buffer, float64 by default.
+            constants: Dictionary of column names and values of the run,
+                added to both the model and the agent DataFrames.
+            id_columns: Pair of column names repeating the step and the agent
+                id in the agent DataFrame.
+            changes_only: Record the agents only when their variables change.
+            sink: Writer of the records, with a `write(table, columns)` and a
+                `close()` method.
+            flush_every: Number of steps collected between two flushes to
+                the sink.
+            tables: Dictionary of table names to lists of column names.
+
+        """
+        super().__init__(model_reporters=model_reporters, tables=tables)
+        self.agent_ids = np.sort(np.asarray(agent_ids))
+        self._traced = set(self.agent_ids.tolist())
+        self.constants = dict(constants or {})
+        self.id_columns = id_columns
+        self.sink = sink
+        self.agent_reporters = {}
+        self.agent_dtypes = {}
+        self._agent_buffers = {}
+        num_rows = max_steps + 1 if sink is None else flush_every
+        self._recorded = np.zeros((num_rows, len(self.agent_ids)), dtype=bool)
+        self._steps = []
+        agent_dtypes = agent_dtypes or {}
+        for name, attribute_name in (agent_reporters or {}).items():
+            if type(attribute_name) is not str:
+                raise TypeError(f"The reporter of {name} must be an attribute name.")
+            self.agent_reporters[name] = attribute_name
+            self.agent_dtypes[name] = np.dtype(agent_dtypes.get(name, np.float64))
+            self._agent_buffers[name] = np.zeros(self._recorded.shape, dtype=self.agent_dtypes[name])
+        self.changes_only = changes_only
+        if changes_only:
+            # the last recorded values of each agent and the agents recorded at the last step
+            self._last = {name: np.zeros(len(self.agent_ids), dtype=buffer.dtype)
+                          for name, buffer in self._agent_buffers.items()}
+            self._present = np.zeros(len(self.agent_ids), dtype=bool)
+            self._agent_buffers["removed"] = np.zeros(self._recorded.shape, dtype=np.int8)
+
+    def __getstate__(self):
+        """Pickle the buffers up to the last collected step only."""
+        state = self.__dict__.copy()
+        rows = len(self._steps)
+        state["_num_rows"] = len(self._recorded)
+        state["_recorded"] = self._recorded[:rows]
+        state["_agent_buffers"] = {name: buffer[:rows] for name, buffer in self._agent_buffers.items()}
+        return state
+
+    def __setstate__(self, state):
+        """Restore the buffers to the number of steps they held."""
+        num_rows = state.pop("_num_rows")
+        self.__dict__.update(state)
+        shape = (num_rows - len(self._recorded), len(self.agent_ids))
+        self._recorded = np.concatenate([self._recorded, np.zeros(shape, dtype=bool)])
+        for name, buffer in self._agent_buffers.items():
+            self._agent_buffers[name] = np.concatenate([buffer, np.zeros(shape, dtype=buffer.dtype)])
+
+    def _grow(self):
+        """Double the number of steps the buffers can hold."""
+        self._recorded = np.concatenate([self._recorded, np.zeros_like(self._recorded)])
+        for name, buffer in self._agent_buffers.items():
+            self._agent_buffers[name] = np.concatenate([buffer, np.zeros_like(buffer)])
+
+    def _read_agents(self, model):
+        """Read the ids and the variables of the recorded agents."""
+        population = getattr(model, "population", None)
+        if population is not None:
+            ids = population.report("consumer_ids")
+            traced = np.isin(ids, self.agent_ids)
+            columns = {name: population.report(attribute_name)[traced]
+                       for name, attribute_name in self.agent_reporters.items()}
+            return ids[traced], columns
+        agents = [agent for agent in model.consumers
+                  if agent.unique_id in self._traced]
+        ids = np.fromiter((agent.unique_id for agent in agents), dtype=np.int64, count=len(agents))
+        columns = {}
+        for name, attribute_name in self.agent_reporters.items():
+            values = map(attrgetter(attribute_name), agents)
+            if self.agent_dtypes[name] == object:
+                columns[name] = list(values)
+            else:
+                columns[name] = np.fromiter(values, dtype=self.agent_dtypes[name], count=len(agents))
+        return ids, columns
+
+    def collect(self, model):
+        """Collect all the data for the given model object."""
+        if len(self._steps) == len(self._recorded):
+            if self.sink is None:
+                self._grow()
+            else:
+                self.flush()
+        row = len(self._steps)
+        self._steps.append(model.schedule.steps)
+
+        for var, reporter in self.model_reporters.items():
+            if isinstance(reporter, list):
+                self.model_vars[var].append(reporter[0](*reporter[1]))
+            else:
+                self.model_vars[var].append(reporter(model))
+
+        if self._agent_buffers:
+            ids, columns = self._read_agents(model)
+            agents = np.searchsorted(self.agent_ids, ids)
+            if self.changes_only:
+                self._record_changes(row, agents, columns)
+                return
+            self._recorded[row, agents] = True
+            for name, values in columns.items():
+                self._agent_buffers[name][row, agents] = values
+
+    def _record_changes(self, row, agents, columns):
+        """Record the agents whose variables changed since their last record
+        and the agents that are no longer recorded."""
+        changed = ~self._present[agents]
+        for name, values in columns.items():
+            values = np.asarray(values, dtype=self.agent_dtypes[name])
+            changed |= values != self._last[name][agents]
+            columns[name] = values
+        present = np.zeros(len(self.agent_ids), dtype=bool)
+        present[agents] = True
+        removed = np.flatnonzero(self._present & ~present)
+        self._present = present
+        changed_agents = agents[changed]
+        self._recorded[row, changed_agents] = True
+        self._recorded[row, removed] = True
+        self._agent_buffers["removed"][row, changed_agents] = 0
+        self._agent_buffers["removed"][row, removed] = 1
+        for name, values in columns.items():
+            self._last[name][changed_agents] = values[changed]
+            self._agent_buffers[name][row, changed_agents] = values[changed]
+            self._agent_buffers[name][row, removed] = self._last[name][removed]
+
+    def _constant_columns(self, length):
+        """Repeat the constants as categorical columns of the given length."""
+        return {name: pd.Categorical.from_codes(np.zeros(length, dtype=np.int8), [value])
+                for name, value in self.constants.items()}
+
+    def _model_columns(self):
+        """Build the columns of the collected model variables."""
+        length = len(next(iter(self.model_vars.values()), []))
+        columns = self._constant_columns(length)
+        columns.update(self.model_vars)
+        return columns
+
+    def _agent_columns(self):
+        """Build the columns of the collected agent variables, with the steps
+        and the ids of the recorded agents."""
+        recorded = self._recorded[:len(self._steps)]
+        rows, agents = np.nonzero(recorded)
+        steps = np.asarray(self._steps, dtype=np.int64)[rows]
+        ids = self.agent_ids[agents]
+        columns = {}
+        if self.id_columns is not None:
+            columns[self.id_columns[0]] = steps
+            columns[self.id_columns[1]] = ids
+        columns.update(self._constant_columns(len(rows)))
+        for name, buffer in self._agent_buffers.items():
+            columns[name] = buffer[:len(self._steps)][recorded]
+        return columns, steps, ids
+
+    def flush(self):
+        """Hand the collected records to the sink and empty the buffers."""
+        if not self._steps:
+            return
+        if self.model_vars:
+            self.sink.write("model", self._model_columns())
+            self.model_vars = {name: [] for name in self.model_vars}
+        if self._agent_buffers:
+            self.sink.write("agents", self._agent_columns()[0])
+        self._recorded[:] = False
+        self._steps = []
+
+    def spill(self, flush_every=1):
+        """Hand the collected records to the sink and shrink the buffers to
+        `flush_every` steps, to lower the memory held by the collector.
+
+        Args:
+            flush_every: Number of steps collected between two flushes to
+                the sink from now on.
+
+        """
+        if self.sink is None:
+            raise ValueError("The records can only be spilled to a sink")
+        self.flush()
+        self._recorded = np.zeros((flush_every, len(self.agent_ids)), dtype=bool)
+        for name, buffer in self._agent_buffers.items():
+            self._agent_buffers[name] = np.zeros(self._recorded.shape, dtype=buffer.dtype)
+
+    @property
+    def nbytes(self):
+        """Number of bytes of the buffers of the agent records."""
+        return self._recorded.nbytes + sum(buffer.nbytes for buffer in self._agent_buffers.values())
+
+    def close(self):
+        """Flush the last records and close the sink."""
+        self.flush()
+        self.sink.close()
+
+    def get_model_vars_dataframe(self):
+        """Create a pandas DataFrame from the model variables and the
+        constants of the run."""
+        return pd.DataFrame(self._model_columns())
+
+    def get_agent_vars_dataframe(self):
+        """Create a pandas DataFrame from the agent variables.
+
+        The DataFrame has one row per step and recorded agent, indexed by the
+        step and the agent id, and one column for each variable and constant.
+
+        """
+        columns, steps, ids = self._agent_columns()
+        index = pd.MultiIndex.from_arrays([steps, ids], names=["Step", "AgentID"])
+        return pd.DataFrame(columns, index=index)
+
+
+class AggregateDataCollector(ColumnarDataCollector):
+    """Class for collecting per-step summaries of agent-level variables
+    instead of one record per agent.
+
+    At each step, the mean, the variance, the quantiles and the histogram of
+    every summarized variable are computed over the recorded agents, and the
+    counted variables are summed. They are added to the model variables as
+    `{name}_mean`, `{name}_var`, `{name}_q{percent}`, `{name}_hist{bin}` and
+    `num_{name}` columns, along with the number of recorded agents
+    (`num_active`) and of agents that are no longer recorded
+    (`num_dropout`). No agent records are kept.
+
+    """
+
+    def __init__(self, agent_ids, max_steps, model_reporters=None, summaries=None, counts=None,
+                 quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), bins=10, constants=None, sink=None,
+                 flush_every=None, tables=None):
+        """Instantiate an AggregateDataCollector.
+
+        Args:
+            agent_ids: Ids of all the agents that can be recorded.
+            max_steps: Expected number of steps of the run.
+            model_reporters: Dictionary of reporter names and attributes/funcs.
+            summaries: Dictionary of variable names and pairs of an attribute
+                name and the (min, max) range of its histogram.
+            counts: Dictionary of variable names and attribute names of
+                variables summed over the agents.
+            quantiles: Quantiles of the summarized variables.
+            bins: Number of bins of the histograms.
+            constants: Dictionary of column names and values of the run.
+            sink: Writer of the records, see ColumnarDataCollector.
+            flush_every: Number of steps collected between two flushes to
+                the sink.
+            tables: Dictionary of table names to lists of column names.
+
+        """
+        super().__init__(agent_ids, max_steps, model_reporters=model_reporters, constants=constants,
+                         sink=sink, flush_every=flush_every, tables=tables)
+        self.summaries = dict(summaries or {})
+        self.counts = dict(counts or {})
+        self.quantiles = np.asarray(quantiles, dtype=np.float64)
+        self.bins = bins
+        # the agents are read through the same attribute reporters, without buffers
+        for name, (attribute_name, _) in self.summaries.items():
+            self.agent_reporters[name] = attribute_name
+            self.agent_dtypes[name] = np.dtype(np.float64)
+        for name, attribute_name in self.counts.items():
+            self.agent_reporters[name] = attribute_name
+            self.agent_dtypes[name] = np.dtype(np.int64)
+        self.model_vars.update({name: [] for name in self._aggregate_names()})
+
+    def _aggregate_names(self):
+        """List the names of the summary columns."""
+        names = ["num_active", "num_dropout"]
+        for name in self.summaries:
+            names += [f"{name}_mean", f"{name}_var"]
+            names += [f"{name}_q{round(q * 100):02d}" for q in self.quantiles]
+            names += [f"{name}_hist{i}" for i in range(self.bins)]
+        names += [f"num_{name}" for name in self.counts]
+        return names
+
+    def collect(self, model):
+        """Collect the model variables and the summaries of the agent
+        variables for the given model object."""
+        super().collect(model)
+        ids, columns = self._read_agents(model)
+        self.model_vars["num_active"].append(len(ids))
+        self.model_vars["num_dropout"].append(len(self.agent_ids) - len(ids))
+        for name, (_, value_range) in self.summaries.items():
+            values = np.asarray(columns[name], dtype=np.float64)
+            if len(values):
+                mean, var = values.mean(), values.var()
+                quantiles = np.quantile(values, self.quantiles)
+            else:
+                mean, var = np.nan, np.nan
+                quantiles = np.full(len(self.quantiles), np.nan)
+            histogram, _ = np.histogram(values, bins=self.bins, range=value_range)
+            self.model_vars[f"{name}_mean"].append(mean)
+            self.model_vars[f"{name}_var"].append(var)
+            for q, value in zip(self.quantiles, quantiles):
+                self.model_vars[f"{name}_q{round(q * 100):02d}"].append(value)
+            for i, count in enumerate(histogram):
+                self.model_vars[f"{name}_hist{i}"].append(int(count))
+        for name in self.counts:
+            self.model_vars[f"num_{name}"].append(int(np.sum(columns[name])))
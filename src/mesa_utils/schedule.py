@@ -1,4 +1,3 @@
-import random
 from collections import defaultdict
 
 from mesa.time import RandomActivation
@@ -11,12 +10,21 @@ class RandomActivationByType(RandomActivation):
     This is equivalent to the NetLogo 'ask type...' and is generally the
     default behavior for an ABM.
     Assumes that all agents have a step() method.
+
+    The agents of each type are kept in slots that never move while the
+    agents are in the schedule, and the activation order is a list of slot
+    indices that is shuffled in place every step. Removing an agent only
+    empties its slot, the emptied slots are dropped from the activation order
+    at the next step, keeping the order of the remaining agents, and the slots
+    are compacted when most of them are empty.
     '''
-    agents_by_type = defaultdict(list)
 
     def __init__(self, model):
         super().__init__(model)
-        self.agents_by_type = defaultdict(list)
+        self._slots = defaultdict(list)
+        self._order = defaultdict(list)
+        self._num_removed = defaultdict(int)
+        self._slot_of = {}
 
     def add(self, agent):
         '''
@@ -24,22 +32,43 @@ class RandomActivationByType(RandomActivation):
         Args:
             agent: An Agent to be added to the schedule.
         '''
-
-        self.agents.append(agent)
-        agent_class = type(agent)
-        self.agents_by_type[agent_class].append(agent)
+        super().add(agent)
+        slots = self._slots[type(agent)]
+        self._slot_of[agent] = len(slots)
+        self._order[type(agent)].append(len(slots))
+        slots.append(agent)
 
     def remove(self, agent):
         '''
-        Remove all instances of a given agent from the schedule.
+        Remove an agent from the schedule, in constant time.
+        Args:
+            agent: An Agent in the schedule.
         '''
+        slot = self._slot_of.pop(agent, None)
+        if slot is None:
+            return
+        super().remove(agent)
+        self._slots[type(agent)][slot] = None
+        self._num_removed[type(agent)] += 1
 
-        while agent in self.agents:
-            self.agents.remove(agent)
-
-        agent_class = type(agent)
-        while agent in self.agents_by_type[agent_class]:
-            self.agents_by_type[agent_class].remove(agent)
+    def _compact(self, type):
+        '''
+        Drop the emptied slots from the activation order of a type, and
+        compact the slots when most of them are empty.
+        Args:
+            type: Class object of the type.
+        '''
+        if not self._num_removed[type]:
+            return
+        slots = self._slots[type]
+        order = [i for i in self._order[type] if slots[i] is not None]
+        if 2 * self._num_removed[type] > len(slots):
+            slots = [slots[i] for i in order]
+            order = list(range(len(slots)))
+            self._slots[type] = slots
+            self._slot_of.update((agent, i) for i, agent in enumerate(slots))
+            self._num_removed[type] = 0
+        self._order[type] = order
 
     def step(self, by_type=True):
         '''
@@ -49,7 +78,7 @@ class RandomActivationByType(RandomActivation):
                       the next one.
         '''
         if by_type:
-            for agent_class in self.agents_by_type:
+            for agent_class in list(self._slots):
                 self.step_type(agent_class)
             self.steps += 1
             self.time += 1
@@ -62,13 +91,35 @@ class RandomActivationByType(RandomActivation):
         Args:
             type: Class object of the type to run.
         '''
-        agents = self.agents_by_type[type]
-        random.shuffle(agents)
-        for agent in agents:
-            agent.step()
+        self._compact(type)
+        order = self._order[type]
+        self.model.random.shuffle(order)
+        slots = self._slots[type]
+        for i in order:
+            # the agents removed during the step are skipped
+            if slots[i] is not None:
+                slots[i].step()
+
+    def get_agents(self, type_class):
+        '''
+        Returns the agents of a given type in the schedule, in their last
+        activation order.
+        Args:
+            type_class: Class object of the type.
+        '''
+        slots = self._slots.get(type_class, [])
+        return [slots[i] for i in self._order.get(type_class, []) if slots[i] is not None]
+
+    @property
+    def agents_by_type(self):
+        '''
+        A dict of the agents of each type in the schedule, by type, in the
+        order the types were added.
+        '''
+        return {agent_class: self.get_agents(agent_class) for agent_class in self._slots}
 
     def get_type_count(self, type_class):
         '''
         Returns the current number of agents of certain type in the queue.
         '''
-        return len(self.agents_by_type[type_class])
\ No newline at end of file
+        return len(self._slots.get(type_class, [])) - self._num_removed.get(type_class, 0)
@@ -1,22 +1,53 @@
 # -*- coding: utf-8 -*-
 
-import itertools
-import pickle
+import random
 import time
 from collections import defaultdict
+from functools import partial
 import numpy as np
+from checkpoint import get_checkpoint_path, save_checkpoint
 from consumer import ConsumerAgent
+from consumer_population import ConsumerPopulation
+from instrumentation import StepInstrumentation, create_sink
 from mesa.model import Model
-from mesa_utils.datacollection import DataCollector
+from memory_accounting import create_memory_accounting
+from mesa_utils.datacollection import AggregateDataCollector, ColumnarDataCollector
 from mesa_utils.schedule import RandomActivationByType
+from random_streams import StepDraws
 from read_config import *
+from recommendation_store import RecommendationStore
+from result_sink import ResultSink
 from service_provider import providerAgent
+from simulation_context import get_simulation_context
 from utils import *
 
+# the timed phases and the counters of a step, see `StepInstrumentation`
+STEP_PHASES = ["thresholds", "recompute_utilities", "draws", "provider", "consumers", "remove_dropouts", "collect"]
+STEP_COUNTERS = ["consumptions", "feedback", "social_posts", "dropouts"]
+# the components of a run whose memory is accounted, see `get_memory_components`
+MEMORY_COMPONENTS = ["recommendations", "utilities", "ratings", "collector"]
+
+
+def get_step(model: object) -> int:
+    """
+
+    :param model: RecommendationModel.
+    :return: int of the current step of the model.
+    """
+    return model.schedule.steps
 
-class RecommendationModel(Model):
-    c = itertools.count(1)
 
+def get_rounded(name: str, model: object) -> float:
+    """
+
+    :param name: str of the name of an attribute of the model.
+    :param model: RecommendationModel.
+    :return: float of the attribute rounded to 3 decimals.
+    """
+    return np.round(getattr(model, name), 3)
+
+
+class RecommendationModel(Model):
     def __init__(self, **kwargs):
         self.schedule = RandomActivationByType(self)
         self.running = True
@@ -26,54 +57,92 @@ class RecommendationModel(Model):
         self.create_provider()
         self.create_consumers()
 
-        # collecting data from the simulation
-        self.datacollector = DataCollector(
-            model_reporters={"strategy": "recommendation_strategy",
-                             "model_params": get_params,
-                             "step": lambda m: m.schedule.steps,
-                             "total_profit": lambda m: np.round(m.total_profit, 3),
-                             "number_of_consumption": lambda m: np.round(m.number_of_consumption, 3),
-                             "avg_profit_per_consumption": lambda m: np.round(m.avg_profit_per_consumption, 3)
+        # collecting data from the simulation, both consumer modes report the same attributes
+        # when a `result_dir` is given, the records are streamed to files of the run instead of being kept in memory
+        self.run_name = f"{get_params(self)}-run{self.iteration}"
+        self.result_dir = kwargs.get("result_dir")
+        self.checkpoint_every = model_input["checkpoint_every"]
+        sink = None
+        if kwargs.get("result_dir") is not None:
+            sink = ResultSink(kwargs["result_dir"], self.run_name, model_input["results_format"])
+        # memory of the run sampled at every step and compared to its budget
+        self.memory = create_memory_accounting(MEMORY_COMPONENTS, model_input["memory_accounting"],
+                                               model_input["memory_budget_mb"])
+        self.spilled = False
+        # timings of the phases of each step and counters of its events, a sink can also be given to the model
+        self.instrumentation = StepInstrumentation(
+            STEP_PHASES, STEP_COUNTERS,
+            kwargs.get("instrumentation_sink") or create_sink(model_input["instrumentation"], kwargs.get("result_dir"),
+                                                              self.run_name),
+            gauges=self.memory.fields if self.memory is not None else ())
+        collector_args = dict(
+            agent_ids=range(1, self.num_consumers + 1),
+            max_steps=model_parameters["timesteps"],
+            # the reporters are module functions so the model can be checkpointed, see `checkpoint`
+            model_reporters={"step": get_step,
+                             "total_profit": partial(get_rounded, "total_profit"),
+                             "number_of_consumption": partial(get_rounded, "number_of_consumption"),
+                             "avg_profit_per_consumption": partial(get_rounded, "avg_profit_per_consumption")
                              },
-            agent_reporters={
-                "step": lambda a: a.model.schedule.steps if a.__class__.__name__ == "ConsumerAgent" else None,
-                "consumerId": lambda a: a.consumer_id if a.__class__.__name__ == "ConsumerAgent" else None,
-                "trust": lambda a: a.trust if a.__class__.__name__ == "ConsumerAgent" else None,
-
-                "minimum_utility_threshold": lambda
-                a: a.minimum_utility_threshold if a.__class__.__name__ == "ConsumerAgent" else None,
-                "true_utility": lambda a: a.true_utility if a.__class__.__name__ == "ConsumerAgent" else None,
-                "selecteditem": lambda a: a.selecteditem if a.__class__.__name__ == "ConsumerAgent" else None,
-                "consumption_probability": lambda a: a.consumption_probability if a.__class__.__name__ == "ConsumerAgent" else None,
-                "lower_limit": lambda a: a.consumption_probability_limits[0] if a.__class__.__name__ == "ConsumerAgent" else None,
-                "upper_limit": lambda a: a.consumption_probability_limits[1] if a.__class__.__name__ == "ConsumerAgent" else None,
-                "model_params": lambda a: get_params(a) if a.__class__.__name__ == "ConsumerAgent" else None,
-                "strategy": lambda a: a.model.recommendation_strategy if a.__class__.__name__ == "ConsumerAgent" else None,
-                "is_satisfied": lambda a: a.is_satisfied() if a.__class__.__name__ == "ConsumerAgent" else None,
-                "num_positive_personal": lambda a: np.round(a.positive_negative_experience[0],
-                                                            3) if a.__class__.__name__ == "ConsumerAgent" else None,
-                "num_negative_personal": lambda a: np.round(a.positive_negative_experience[1],
-                                                            3) if a.__class__.__name__ == "ConsumerAgent" else None
-            }
+            constants={"strategy": self.recommendation_strategy, "model_params": get_params(self)},
+            sink=sink,
+            flush_every=model_input["flush_every"]
         )
+        if model_input["collection_mode"] == "aggregates":
+            # per-step summaries of the consumers are added to the model variables, no consumer record is kept
+            self.datacollector = AggregateDataCollector(
+                summaries={"trust": ("trust", (0, 1)),
+                           "consumption_probability": ("consumption_probability", (0, 1)),
+                           "true_utility": ("true_utility", (0, 5))},
+                counts={"satisfied": "satisfied"},
+                quantiles=model_input["aggregate_quantiles"],
+                bins=model_input["aggregate_histogram_bins"],
+                **collector_args
+            )
+        else:
+            # only the consumers of the traced cohort are recorded
+            self.datacollector = ColumnarDataCollector(
+                agent_reporters={"trust": "trust",
+                                 "minimum_utility_threshold": "minimum_utility_threshold",
+                                 "true_utility": "true_utility",
+                                 "selecteditem": "selecteditem",
+                                 "consumption_probability": "consumption_probability",
+                                 "lower_limit": "lower_limit",
+                                 "upper_limit": "upper_limit",
+                                 "is_satisfied": "satisfied",
+                                 "num_positive_personal": "num_positive_personal",
+                                 "num_negative_personal": "num_negative_personal"},
+                agent_dtypes={"selecteditem": object, "is_satisfied": np.int8},
+                id_columns=("step", "consumerId"),
+                changes_only=bool(model_input["record_changes_only"]),
+                **dict(collector_args, agent_ids=self.traced_consumers)
+            )
         self.datacollector.collect(self)
+        if self.memory is not None:
+            self.check_memory()
 
     def create_provider(self: object) -> None:
         """
 
          This function creates a provider agent and adds it to the scheduler to be activated before any agent.
         """
-        provider = providerAgent(0, self)
-        self.schedule.add(provider)
+        self.provider = providerAgent(0, self)
+        self.schedule.add(self.provider)
 
     def create_consumers(self: object) -> None:
         """
 
          A function creates consumer agents and adds them to the scheduler to be activated in a random order.
+         When `consumer_mode` is "population", the consumers are created as one vectorized ConsumerPopulation instead.
         """
-        datapath = get_data_dir()
-        initials_betapath = os.path.join(datapath, "trust", "beta_initials.p")
-        initial_beta = pickle.load(open(initials_betapath, "rb"))
+        initial_beta = self.context.initial_beta
+        self.traced_consumers = self.context.traced_consumers
+        if model_parameters["consumer_mode"] == "population":
+            consumer_ids = list(range(1, self.num_consumers + 1))
+            self.population = ConsumerPopulation(
+                self, consumer_ids, [initial_beta[i] for i in consumer_ids],
+                [self.consumers_thresholds[i] for i in consumer_ids])
+            return
         for i in range(1, self.num_consumers + 1):
             beta_params = initial_beta[i]
             consumer = ConsumerAgent(
@@ -87,31 +156,56 @@ class RecommendationModel(Model):
 
          This function initialize model variables using the parameters defined in the config file.
          Model variables hold values to be shared with all agents.
+         The profit data depends on the `iteration` of the run only, so all scenarios are compared on the same profits,
+         and the random decisions of the run are drawn from a Generator seeded with `seed`, derived from the scenario
+         and the iteration by default.
         """
         self.consumers_thresholds = {}
-        recdata_path = get_rec_dir()
-        self.recommendations = pickle.load(
-            open(f"{recdata_path}/consumers_items_utilities_predictions.p", "rb"))
-        self.ratings_df = get_ratings_data()
+        self.context = kwargs.get("context") or get_simulation_context()
+        self.item_ids = self.context.item_ids
+        self.ratings = self.context.get_ratings()
+        self.popularity = self.context.get_popularity()
         self.recommendation_strategy = kwargs["recommendation_strategy"]
         self.quantile_consumer_expectation = kwargs["quantile_consumer_expectation"]
         self.recommendation_length = model_parameters["recommendation_length"]
-        self.seed = next(self.c)
-        self.profit_data = generate_profitdata(self.seed)
-        self.num_consumers = self.ratings_df["userId"].nunique()
+        # a consumer consumes at most one item per step, so the items below this rank can never be recommended
+        self.pool_size = self.recommendation_length + model_parameters["timesteps"]
+        self.iteration = kwargs.get("iteration", 0)
+        self.seed = kwargs.get("seed", get_run_seed(kwargs, self.iteration))
+        self.profits = self.context.get_profits(self.iteration + 1)
+        users, items, utilities = self.context.utilities
+        # the predicted utilities of all the items, updated when the predictions are recomputed
+        self.predicted_consumers = users
+        self.predicted_candidates = self.context.candidates
+        self.predicted_utilities = utilities
+        self.svd_factors = None
+        # the number of ratings the SVD factors were fitted on
+        self.ratings_fitted = len(self.ratings)
+        def rank():
+            store = RecommendationStore.from_utilities(users, self.item_ids, utilities, self.predicted_candidates,
+                                                       pool_size=self.pool_size)
+            # the initial thresholds of all the quantiles of the sweep are computed at once and shared by the runs
+            store.compute_thresholds(model_parameters["quantile_consumer_expectation"])
+            return store
+        self.recommendations = self.context.get_recommendations(
+            ("consumer_only", self.pool_size, None), rank).overlay(self.profits)
+        self.num_consumers = self.context.num_consumers
         self.num_items = get_num_items
         self.user_consumed_items = defaultdict(list)
+        self.consumed_items = defaultdict(list)
         self.time = model_parameters["timesteps"]
-        self.runs = model_parameters["number_of_runs"]
         self.feedback_likelihood = model_parameters["feedback_likelihood"]
-        if self.seed == self.runs:
-            setattr(RecommendationModel, "c", itertools.count(1))
+        self.random = random.Random(self.seed)
+        self.rng = np.random.default_rng(self.seed)
+        self.step_draws = None
+        self.picked_positions = None
         # compute the consumers" expectation thresholds
         self.compute_thresholds()
         # get the recommendations
         self.get_precomputed_consumers_utilities(0)
         self.social_media = [0, 0]  # [number_of_likes, number_of dislikes]
         self.dropout_consumers = []
+        self.population = None
         self.topn = None
         # the output of these variables are taken from the provider agent
         self.total_profit = 0
@@ -123,12 +217,11 @@ class RecommendationModel(Model):
 
          This function computes the expectation threshold for each consumer by taking the quantile value of the items ranked
          descendingly according to their perceived utilities to each consumer.
+         The thresholds are cached by the recommendations, see `RecommendationStore.get_thresholds`.
         """
         print("Compute consumer's expectation thresholds..")
-        for c, recs in self.recommendations.items():
-            ratings_c = [r["rating"] for r in recs]
-            self.consumers_thresholds[c] = np.quantile(
-                ratings_c, self.quantile_consumer_expectation)
+        thresholds = self.recommendations.get_thresholds(self.quantile_consumer_expectation)
+        self.consumers_thresholds = dict(zip(self.recommendations.consumer_ids, thresholds))
         print("Done")
 
     def update_consumer_thresholds(self: object) -> None:
@@ -137,40 +230,70 @@ class RecommendationModel(Model):
          This function adds precomputed the expectation thresholds for each consumer.
         """
         self.compute_thresholds()
-        consumers_class = list(self.schedule.agents_by_type.keys())[1]
-        for a in self.schedule.agents_by_type[consumers_class]:
+        if self.population is not None:
+            self.population.minimum_utility_threshold = np.array(
+                [self.consumers_thresholds[c] for c in self.population.consumer_ids], dtype=np.float64)
+            return
+        for a in self.consumers:
             a.minimum_utility_threshold = self.consumers_thresholds[a.consumer_id]
 
     def get_precomputed_consumers_utilities(self, i: bool) -> None:
         """
         :param i: bool as flag to distinguish initial consumer utilities or an update of the predictions.
          A function loads the precomputed consumers items" utilities or update the previous utilities.
+         The initial rankings are shared by the runs of the process: they only depend on the strategy and, when the
+         items are reranked with their profits, on the iteration. A run gets an overlay of the shared ranking that
+         only holds its consumed items.
         """
-        weights = [[0.5, 0.5], [0, 1], [0.9, 0.1]]
-        recdata_path = get_rec_dir()
         if self.recommendation_strategy == "consumer_only":
-            pass
+            return
+        if i == 0:
+            profits_seed = None if self.recommendation_strategy == "popular_based" else self.iteration + 1
+            base = self.context.get_recommendations((self.recommendation_strategy, self.pool_size, profits_seed),
+                                                    lambda: self.rank_recommendations(i))
+            self.recommendations = base.overlay(self.profits)
+        else:
+            self.recommendations = self.rank_recommendations(i)
 
-        elif self.recommendation_strategy == "balance_equal_weights":
-            self.recommendations = rerank_items_consider_profit(
-                self.recommendations, self.profit_data, weights[0])
+    def rank_recommendations(self, i: bool) -> RecommendationStore:
+        """
+        :param i: bool as flag to distinguish initial consumer utilities or an update of the predictions.
+        :return: RecommendationStore of the recommendations ranked by the strategy of the model.
+        """
+        weights = [[0.5, 0.5], [0, 1], [0.9, 0.1]]
+        if self.recommendation_strategy == "balance_equal_weights":
+            return rerank_items_consider_profit(
+                self.recommendations, self.profits, weights[0], self.pool_size)
 
         elif self.recommendation_strategy == "profit_only":
-            self.recommendations = rerank_items_consider_profit(
-                self.recommendations, self.profit_data, weights[1])
+            return rerank_items_consider_profit(
+                self.recommendations, self.profits, weights[1], self.pool_size)
 
         elif self.recommendation_strategy == "balance_unequal_weights":
-            self.recommendations = rerank_items_consider_profit(
-                self.recommendations, self.profit_data, weights[2])
+            return rerank_items_consider_profit(
+                self.recommendations, self.profits, weights[2], self.pool_size)
 
         else:
             if i == 0:
-                self.recommendations = pickle.load(
-                    open(f"{recdata_path}/consumers_items_utilities_predictions_popular.p", "rb"))
+                users, items, utilities = load_utilities("consumers_items_utilities_popular")
+                return RecommendationStore.from_utilities(
+                    users, self.item_ids, utilities, get_items_indices(self.item_ids, items), sort=False,
+                    profits=self.profits, pool_size=self.pool_size)
             else:
-                popular_items = get_popular_items(get_ratings_data())
-                self.recommendations = get_predictions_popular_items(
-                    self.num_consumers, popular_items, self.predictive_model)
+                candidates = self.popularity.top()
+                consumers = list(range(1, self.num_consumers + 1))
+                utilities = predict_utilities_matrix(self.svd_factors, consumers, self.item_ids[candidates])
+                return RecommendationStore.from_utilities(
+                    consumers, self.item_ids, utilities, candidates, sort=False, profits=self.profits,
+                    pool_size=self.pool_size)
+
+    @property
+    def consumers(self: object) -> list:
+        """
+
+        :return: list of the consumer agents in the schedule, empty when the consumers are a ConsumerPopulation.
+        """
+        return self.schedule.get_agents(ConsumerAgent)
 
     def update_provider_utilities(self: object, item: int) -> None:
         """
@@ -179,24 +302,65 @@ class RecommendationModel(Model):
 
          This function summed up the profit gained from consumed items
         """
-        # get the provider instance from the scheduler
-        provider_class = list(self.schedule.agents_by_type.keys())[0]
-        provider = self.schedule.agents_by_type[provider_class][0]
-        provider.update_provider_utilities(item)
-        self.total_profit = provider.total_profit_of_consumed_items
-        self.number_of_consumption = provider.number_of_consumption
-        self.avg_profit_per_consumption = provider.avg_profit_per_consumption
+        self.provider.update_provider_utilities(item)
+        self.total_profit = self.provider.total_profit_of_consumed_items
+        self.number_of_consumption = self.provider.number_of_consumption
+        self.avg_profit_per_consumption = self.provider.avg_profit_per_consumption
+
+    def add_provider_utilities(self: object, profits: np.ndarray) -> None:
+        """
+
+        :param profits: np.ndarray of the profits of the items consumed by several consumers.
+
+         This function summed up the profit gained from several consumed items at once
+        """
+        self.provider.add_consumptions(profits)
+        self.total_profit = self.provider.total_profit_of_consumed_items
+        self.number_of_consumption = self.provider.number_of_consumption
+        self.avg_profit_per_consumption = self.provider.avg_profit_per_consumption
 
     def update_predictions(self: object) -> None:
         """
 
-         A function predicts consumers' utilities periodically in the simulation.
-         considering consumers' feedback
+         A function predicts consumers' utilities periodically in the simulation, considering consumers' feedback.
+         In the "full" retrain mode, a new SVD model is fitted on all the ratings and all the utilities are predicted again.
+         In the "incremental" mode, the previous factors are updated with the ratings added since they were fitted and a
+         sample of the older ones, and only the utilities of the consumers or the items whose factors moved are predicted
+         again: the rows of the moved consumers and the columns of the moved items.
          """
-        predictions, predictive_model = predict_consumers_items_utilities(
-            self.ratings_df)
-        self.predictive_model = predictive_model
-        self.recommendations = get_ordered_recs(predictions)
+        consumers = self.predicted_consumers
+        if model_parameters["retrain_mode"] == "incremental":
+            params = model_parameters["incremental_retrain"]
+            if self.svd_factors is None:
+                self.svd_factors = load_svd_factors()
+            columns = (self.ratings.users, self.ratings.items, self.ratings.ratings)
+            # the replayed old ratings scale with the new ones, so the factors they do not touch are kept
+            new_ratings = len(self.ratings) - self.ratings_fitted
+            size = min(int(params["old_ratings_per_new"] * new_ratings), self.ratings_fitted)
+            sample = self.rng.choice(self.ratings_fitted, size=size, replace=False)
+            self.svd_factors, moved_users, moved_items = partial_fit_svd_factors(
+                self.svd_factors, tuple(c[self.ratings_fitted:] for c in columns), tuple(c[sample] for c in columns),
+                self.rng, epochs=params["epochs"], learning_rate=params["learning_rate"],
+                regularization=params["regularization"], batch_size=params["batch_size"], tolerance=params["tolerance"])
+            candidates = self.item_ids[self.predicted_candidates]
+            rows = np.flatnonzero(np.isin(consumers, moved_users))
+            columns = np.flatnonzero(np.isin(candidates, moved_items))
+            if not self.predicted_utilities.flags.writeable:
+                self.predicted_utilities = np.array(self.predicted_utilities)
+            others = np.delete(np.arange(len(consumers)), rows)
+            self.predicted_utilities[rows] = predict_utilities_matrix(self.svd_factors, consumers[rows], candidates)
+            self.predicted_utilities[np.ix_(others, columns)] = predict_utilities_matrix(
+                self.svd_factors, consumers[others], candidates[columns])
+        else:
+            predictive_model = train_predictive_model(
+                self.ratings.to_dataframe(), random_state=int(self.rng.integers(2 ** 31)))
+            self.svd_factors = get_svd_factors(predictive_model)
+            self.predicted_candidates = np.arange(len(self.item_ids))
+            self.predicted_utilities = predict_utilities_matrix(self.svd_factors, consumers, self.item_ids)
+        self.ratings_fitted = len(self.ratings)
+        self.recommendations = RecommendationStore.from_utilities(
+            consumers, self.item_ids, self.predicted_utilities, self.predicted_candidates, profits=self.profits,
+            pool_size=self.pool_size)
         self.get_precomputed_consumers_utilities(1)
         self.remove_consumed_items()
 
@@ -205,27 +369,24 @@ class RecommendationModel(Model):
 
         A function to replace the predicted consumers utilities with the true utilities of the consumed items
         """
-        for k, vlist in self.user_consumed_items.items():
-            for v in vlist:
-                # if the flag of sending feedback is on
-                if v["feedback"]:
-                    row = {
-                        "userId": k, "movieId": v["iid"], "rating": rescale_rating(v["rating"])}
-                    self.ratings_df = self.ratings_df.append(
-                        row, ignore_index=True)
+        # the consumed items whose feedback flag is on
+        feedback = [(k, v["iid"], v["rating"]) for k, vlist in self.user_consumed_items.items()
+                    for v in vlist if v["feedback"]]
+        if feedback:
+            users, items, ratings = zip(*feedback)
+            self.popularity.add(get_items_indices(self.item_ids, items), len(self.ratings))
+            self.ratings.extend(users, items, rescale_rating(ratings))
         self.update_predictions()
         self.user_consumed_items = defaultdict(list)
 
     def remove_consumed_items(self: object) -> None:
         """
 
-        A function to remove the consumed items for each consumer to make sure consumers receive unique recommendations
+        A function to remove the items consumed since the beginning of the run for each consumer to make sure consumers
+        receive unique recommendations, e.g. after the recommendations are computed again.
         """
-        for uid, recs in self.recommendations.items():
-            s = set([(x["iid"]) for x in self.user_consumed_items[uid]])
-            recs = [x for x in recs if x["iid"] not in s]
-            self.recommendations[uid] = recs
-        self.user_consumed_items = defaultdict(list)
+        for uid, consumed_items in self.consumed_items.items():
+            self.recommendations.remove_items(uid, consumed_items)
 
     def store_consumed_items(self: object, consumer_id: int, item_id: int) -> None:
         """
@@ -236,6 +397,131 @@ class RecommendationModel(Model):
          A function to store consumed items for each consumer in a dict
         """
         self.user_consumed_items[consumer_id].append(item_id)
+        self.instrumentation.count("feedback", item_id["feedback"])
+        self.consumed_items[consumer_id].append(item_id["iid"])
+
+    def draw_step_randoms(self: object) -> None:
+        """
+
+        A function draws the random numbers of the active consumers for the step, see `random_streams`.
+        """
+        if self.population is not None:
+            consumer_ids = self.population.consumer_ids[self.population.active]
+        else:
+            consumer_ids = sorted(a.consumer_id for a in self.consumers)
+        self.step_draws = StepDraws(self.rng, consumer_ids, self.recommendation_length)
+        self.picked_positions = None
+
+    def count_active_consumers(self: object) -> int:
+        """
+
+        :return: int of the number of consumers who did not drop out.
+        """
+        if self.population is not None:
+            return int(self.population.active.sum())
+        return self.schedule.get_type_count(ConsumerAgent)
+
+    def get_picked_positions(self: object) -> np.ndarray:
+        """
+
+        :return: np.ndarray of the position picked by each active consumer in its recommended list, see `random_streams`.
+
+        A function picks the positions of all active consumers at once, the first time they are needed in a step.
+        """
+        if self.picked_positions is None:
+            draws = self.step_draws
+            topn = self.topn[self.recommendations.get_rows(draws.consumer_ids)]
+            self.picked_positions = draws.pick_positions(
+                np.arange(len(draws.consumer_ids)), (topn >= 0).sum(axis=1))
+        return self.picked_positions
+
+    def get_memory_components(self: object) -> dict:
+        """
+
+        :return: dict of the bytes of each component of `MEMORY_COMPONENTS`.
+        """
+        return {"recommendations": self.recommendations.nbytes,
+                "utilities": self.predicted_utilities.nbytes,
+                "ratings": self.ratings.nbytes,
+                "collector": self.datacollector.nbytes}
+
+    def check_memory(self: object) -> None:
+        """
+
+        A function samples the memory of the run, hands it to the instrumentation and enforces the memory budget: when the
+        budget is exceeded the first time and `memory_budget_action` is "spill", the buffered records are written to the
+        results files and the records are written at every step from then on, otherwise the run fails with a report of
+        its memory. The records of a run without results files cannot be spilled.
+        """
+        sample = self.memory.sample(self.get_memory_components())
+        for name, value in sample.items():
+            self.instrumentation.gauge(name, value)
+        if not self.memory.exceeds_budget(sample):
+            return
+        report = self.memory.report(sample, self.run_name, self.schedule.steps)
+        if model_input["memory_budget_action"] == "spill" and not self.spilled and \
+                getattr(self.datacollector, "sink", None) is not None:
+            self.datacollector.spill()
+            self.spilled = True
+            print(f"Memory budget exceeded by {report}, the records are written at every step")
+            return
+        self.memory.close()
+        raise MemoryError(f"Memory budget exceeded by {report}")
+
+    def set_scenario(self: object, recommendation_strategy: str = None, quantile_consumer_expectation: float = None,
+                     iteration: int = None, seed: int = None) -> None:
+        """
+
+        :param recommendation_strategy: str of the new strategy.
+        :param quantile_consumer_expectation: float of the new quantile of the expectation thresholds.
+        :param iteration: int of the new iteration, it only names the run: the profits stay those of the run.
+        :param seed: int of the new seed of the random decisions of the run.
+
+         A function switches the run to another scenario, e.g. a branch forked from a checkpoint (see `checkpoint`). The
+         expectation thresholds are computed with the new quantile from the current recommendations, then the
+         recommendations are ranked by the new strategy from the current predicted utilities, without the consumed items,
+         as when the predictions are recomputed. A new seed draws the random decisions from now on from new streams.
+        """
+        if quantile_consumer_expectation is not None and \
+                quantile_consumer_expectation != self.quantile_consumer_expectation:
+            self.quantile_consumer_expectation = quantile_consumer_expectation
+            self.update_consumer_thresholds()
+        if recommendation_strategy is not None and recommendation_strategy != self.recommendation_strategy:
+            self.recommendation_strategy = recommendation_strategy
+            if recommendation_strategy == "popular_based" and self.svd_factors is None:
+                self.svd_factors = load_svd_factors()
+            self.recommendations = RecommendationStore.from_utilities(
+                self.predicted_consumers, self.item_ids, self.predicted_utilities, self.predicted_candidates,
+                profits=self.profits, pool_size=self.pool_size)
+            self.get_precomputed_consumers_utilities(1)
+            self.remove_consumed_items()
+        if iteration is not None:
+            self.iteration = iteration
+        if seed is not None and seed != self.seed:
+            self.seed = seed
+            self.random = random.Random(seed)
+            self.rng = np.random.default_rng(seed)
+        self.run_name = f"{get_params(self)}-run{self.iteration}"
+        self.datacollector.constants.update(strategy=self.recommendation_strategy, model_params=get_params(self))
+
+    def reopen_outputs(self: object, result_dir: str = None) -> None:
+        """
+
+        :param result_dir: str of the directory of the results files of the run, the records are kept in memory when None.
+
+         A function creates again the writers of the outputs of a run restored from a checkpoint (see `checkpoint`): the
+         results files, the instrumentation sink and the memory accounting. The records collected before the checkpoint
+         and not written yet are written to the new results files.
+        """
+        self.result_dir = result_dir
+        self.memory = create_memory_accounting(MEMORY_COMPONENTS, model_input["memory_accounting"],
+                                               model_input["memory_budget_mb"])
+        self.instrumentation.set_sink(create_sink(model_input["instrumentation"], result_dir, self.run_name),
+                                      self.memory.fields if self.memory is not None else ())
+        self.datacollector.sink = None
+        if result_dir is not None:
+            self.datacollector.sink = ResultSink(result_dir, self.run_name, model_input["results_format"])
+            self.datacollector.spill(model_input["flush_every"])
 
     def step(self):
         """
@@ -243,25 +529,58 @@ class RecommendationModel(Model):
         A function to handle model adaptation each time step
         """
         t0 = time.process_time()
-        if (self.schedule.steps + 1) % model_parameters["frequency_update_expectation"] == 0:
-            self.update_consumer_thresholds()
+        instrumentation = self.instrumentation
+        instrumentation.start_step()
+        if instrumentation.enabled:
+            posts_before = self.social_media[0] + self.social_media[1]
+            active_before = self.count_active_consumers()
+        with instrumentation.phase("thresholds"):
+            if (self.schedule.steps + 1) % model_parameters["frequency_update_expectation"] == 0:
+                self.update_consumer_thresholds()
 
         # recompute consumers' utilities
-        # if (self.schedule.steps + 1) % model_parameters["frequency_recompute_utilities"] == 0:
-        #     self.recompute_consumers_utilities()
+        with instrumentation.phase("recompute_utilities"):
+            if model_parameters["recompute_utilities_on"] and \
+                    (self.schedule.steps + 1) % model_parameters["frequency_recompute_utilities"] == 0:
+                self.recompute_consumers_utilities()
 
         # compute a, as the influence strength of social media, model_parameters["numposts_threshold"]: is the minimum amount of posts required by
         # consumers to be influenced by the social media
         num_posts = self.social_media[0] + \
             self.social_media[1]
         self.a = min((num_posts / (model_parameters["numposts_threshold"])), 1)
-        self.schedule.step()
+        with instrumentation.phase("draws"):
+            self.draw_step_randoms()
+        # the provider then the consumers are activated, as `schedule.step` does, to time them separately
+        with instrumentation.phase("provider"):
+            self.schedule.step_type(providerAgent)
+        with instrumentation.phase("consumers"):
+            if self.population is not None:
+                self.population.step()
+            else:
+                self.schedule.step_type(ConsumerAgent)
+        self.schedule.steps += 1
+        self.schedule.time += 1
         # remove dropout consumers from the platform
-        for c in self.dropout_consumers:
-            c.active = False
-            self.schedule.remove(c)
-        self.dropout_consumers = []
+        with instrumentation.phase("remove_dropouts"):
+            for c in self.dropout_consumers:
+                c.active = False
+                self.schedule.remove(c)
+            self.dropout_consumers = []
         # collect data
-        self.datacollector.collect(self)
+        with instrumentation.phase("collect"):
+            self.datacollector.collect(self)
+        if self.memory is not None:
+            self.check_memory()
+        if instrumentation.enabled:
+            instrumentation.count("consumptions", self.provider.number_of_consumption)
+            instrumentation.count("social_posts", self.social_media[0] + self.social_media[1] - posts_before)
+            instrumentation.count("dropouts", active_before - self.count_active_consumers())
+        instrumentation.end_step(self.schedule.steps)
+        # the run can be resumed from its last checkpoint, the last step is always checkpointed
+        if self.checkpoint_every and self.result_dir is not None and \
+                (self.schedule.steps % self.checkpoint_every == 0 or
+                 self.schedule.steps == model_parameters["timesteps"]):
+            save_checkpoint(self, get_checkpoint_path(self.result_dir, self.run_name))
         t1 = time.process_time()
         print(f"step {self.schedule.steps}, time spent: {t1 - t0}")
@@ -1,33 +1,130 @@
-import time
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 from read_config import *
-from utils import get_exec_path, store_scenarios, create_directory
+from result_sink import get_run_files, merge_csv_files, read_chunks
+from utils import SCENARIOS, store_scenarios, store_traced_cohort
 
 
-def plot_results(model_data: pd.DataFrame, agents_data: pd.DataFrame, t: time) -> None:
+def plot_results(exec_path: str) -> None:
     """
 
-     :param model_data: pandas dataframe holds model's state variables.
-     :param agents_data: pandas dataframe holds consumers' state variables.
-     :param t: time used to be contacted to the execution directory name.
+     :param exec_path: str of the execution directory the runs wrote their records to.
 
-     A function creates all the figures from the generated csv files.
+     A function creates all the figures from the records of the runs. The agents records are aggregated chunk by chunk,
+     so they are never loaded in memory at once. In the "aggregates" collection mode, the consumers' means are read
+     from the model records. When the records are CSV files, the files of the runs of each scenario are then merged into
+     one file per scenario.
     """
-    exec_path = get_exec_path()
-    exec_path += t
-    create_directory(exec_path)
     store_scenarios(exec_path)
-    scenarios = agents_data["model_params"].unique()
-    agents_groups = agents_data.groupby("model_params")
-    model_groups = model_data.groupby("model_params")
-    for s in scenarios:
-        agent_scenario = agents_groups.get_group(s)
-        model_scenario = model_groups.get_group(s)
+    aggregates = model_input["collection_mode"] == "aggregates"
+    if not aggregates:
+        store_traced_cohort(exec_path)
+    for s in SCENARIOS.values():
+        agent_files = get_run_files(exec_path, "agents", s)
+        model_files = get_run_files(exec_path, "model", s)
+        if not model_files:
+            continue
+        if aggregates:
+            # the consumers' means are weighted by the number of active consumers of each run
+            columns = ["step", "total_profit", "num_active", "trust_mean", "consumption_probability_mean"]
+            model_scenario = pd.concat(read_chunks(model_files, columns))
+            agent_scenario = get_aggregates_step_means(model_scenario, ["trust", "consumption_probability"])
+        elif model_input["record_changes_only"]:
+            model_scenario = pd.concat(read_chunks(model_files, ["step", "total_profit"]))
+            agent_scenario = get_changes_step_means(agent_files, model_files, ["trust", "consumption_probability"])
+        else:
+            model_scenario = pd.concat(read_chunks(model_files, ["step", "total_profit"]))
+            agent_scenario = get_step_means(agent_files, ["trust", "consumption_probability"])
         plot_all(exec_path, agent_scenario, model_scenario, s)
-        agent_scenario.to_csv(f"{exec_path}/agents-data-{s}.csv", index=False)
-        model_scenario.to_csv(f"{exec_path}/model-data-{s}.csv", index=False)
+        if model_input["results_format"] == "csv":
+            merge_csv_files(model_files, f"{exec_path}/model-data-{s}.csv")
+            if agent_files:
+                merge_csv_files(agent_files, f"{exec_path}/agents-data-{s}.csv")
+
+
+def get_step_means(paths: list, columns: list) -> pd.DataFrame:
+    """
+
+    :param paths: list of paths of agents records files.
+    :param columns: list of the averaged columns.
+    :return: pandas dataframe of the mean of each column per step.
+
+     A function averages agents variables per step over the records files, chunk by chunk.
+    """
+    sums = None
+    counts = None
+    for chunk in read_chunks(paths, ["step"] + columns):
+        groups = chunk.groupby("step")[columns]
+        sums = groups.sum() if sums is None else sums.add(groups.sum(), fill_value=0)
+        counts = groups.count() if counts is None else counts.add(groups.count(), fill_value=0)
+    return (sums / counts).reset_index()
+
+
+def get_changes_step_means(agent_paths: list, model_paths: list, columns: list) -> pd.DataFrame:
+    """
+
+    :param agent_paths: list of paths of agents records files recorded with `record_changes_only`, one per run.
+    :param model_paths: list of paths of the model records files of the same runs.
+    :param columns: list of the averaged columns.
+    :return: pandas dataframe of the mean of each column per step.
+
+     A function averages agents variables per step from the records of their changes, chunk by chunk. The current
+     values of the consumers of a run are kept in an array indexed by their id, and the sums of the run are updated
+     with the rows recorded at each step only. The steps without any change keep the sums of the previous step.
+    """
+    sums = None
+    counts = None
+    for agent_path, model_path in zip(agent_paths, model_paths):
+        steps = pd.concat(read_chunks([model_path], ["step"]))["step"].to_numpy()
+        values = np.zeros((0, len(columns)))
+        present = np.zeros(0, dtype=bool)
+        total = np.zeros(len(columns))
+        count = 0
+        snapshots = {}
+        for chunk in read_chunks([agent_path], ["step", "consumerId", "removed"] + columns):
+            ids = chunk["consumerId"].to_numpy(dtype=np.int64)
+            if ids.max() >= len(present):
+                size = ids.max() + 1
+                values = np.concatenate([values, np.zeros((size - len(present), len(columns)))])
+                present = np.concatenate([present, np.zeros(size - len(present), dtype=bool)])
+            chunk_steps = chunk["step"].to_numpy()
+            chunk_values = chunk[columns].to_numpy(dtype=np.float64)
+            kept = chunk["removed"].to_numpy() == 0
+            # the records of a run are ordered by step
+            for rows in np.split(np.arange(len(chunk)), np.flatnonzero(np.diff(chunk_steps)) + 1):
+                consumers = ids[rows]
+                previous = consumers[present[consumers]]
+                total -= values[previous].sum(axis=0)
+                count -= len(previous)
+                present[consumers] = kept[rows]
+                added = rows[kept[rows]]
+                values[ids[added]] = chunk_values[added]
+                total += chunk_values[added].sum(axis=0)
+                count += len(added)
+                snapshots[chunk_steps[rows[0]]] = (total.copy(), count)
+        run_sums = pd.DataFrame({step: s for step, (s, _) in snapshots.items()}, index=columns).T.reindex(steps).ffill()
+        run_counts = pd.Series({step: c for step, (_, c) in snapshots.items()}).reindex(steps).ffill()
+        sums = run_sums if sums is None else sums.add(run_sums, fill_value=0)
+        counts = run_counts if counts is None else counts.add(run_counts, fill_value=0)
+    return sums.div(counts, axis=0).rename_axis("step").reset_index()
+
+
+def get_aggregates_step_means(model_data: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+
+    :param model_data: pandas dataframe of model records holding the per-step means of consumers variables.
+    :param columns: list of the averaged consumers variables.
+    :return: pandas dataframe of the mean of each variable per step over all the consumers of the runs.
+
+     A function averages the per-step means of consumers variables of several runs.
+    """
+    weighted = pd.DataFrame({c: model_data[f"{c}_mean"] * model_data["num_active"] for c in columns})
+    weighted["step"] = model_data["step"]
+    weighted["num_active"] = model_data["num_active"]
+    sums = weighted.groupby("step").sum()
+    return sums[columns].div(sums["num_active"], axis=0).reset_index()
 
 
 def plot_per_type(exec_path: str, scenario_df: pd.DataFrame, s: str, plot_type: str) -> None:
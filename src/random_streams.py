@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Random numbers of the consumers' decisions.
+
+Each run owns a `numpy.random.Generator` seeded with the seed of the run. At the beginning of every step, the model draws
+one block of random numbers for the active consumers. The consumer with the i-th smallest id among the active consumers
+reads the i-th row of each array of the block:
+
+    uniforms[i, CONSUME]    decision to consume an item (`consume_item`)
+    uniforms[i, LOOK]       decision to look at the social media (`look_to_social_media`)
+    uniforms[i, POST]       decision to post to the social media (`post_to_social_media`)
+    uniforms[i, FEEDBACK]   decision to send feedback to the provider (`send_feedback_decision`)
+    uniforms[i, PICK]       position picked from the recommended list (`sample_rank_positions`)
+    normals[i]              standard normal error of the true utility (`compute_true_utility`)
+    exponentials[i, :]      standard exponentials normalized into the Dirichlet rank probabilities (`sample_rank_positions`)
+
+The whole block is drawn whether the numbers are used or not, so the numbers of a consumer depend neither on the order
+the consumers are activated in nor on the decisions of the other consumers.
+"""
+
+import numpy as np
+
+CONSUME, LOOK, POST, FEEDBACK, PICK = range(5)
+
+
+def sample_rank_positions(exponentials: np.ndarray, uniforms: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+
+    :param exponentials: np.ndarray of standard exponentials, one row per consumer and one column per recommended position.
+    :param uniforms: np.ndarray of one uniform random number per consumer.
+    :param lengths: np.ndarray of the number of items in the recommended list of each consumer.
+    :return: np.ndarray of the picked position of each consumer, -1 when its list is empty.
+
+    A function picks a position in the recommended lists of several consumers at once. The normalized exponentials are
+     Dirichlet distributed rank probabilities, they are sorted descendingly so the items on the top of the lists get higher
+     probabilities. When a list is shorter than the recommendation length, the probabilities of the missing positions are
+     dropped and the remaining ones are renormalized.
+    """
+    rank_dist = -np.sort(-exponentials, axis=1)
+    rank_dist[np.arange(rank_dist.shape[1]) >= lengths[:, None]] = 0
+    cdf = np.cumsum(rank_dist, axis=1)
+    total = cdf[:, -1]
+    positions = (cdf <= (uniforms * total)[:, None]).sum(axis=1)
+    positions[lengths <= 0] = -1
+    return positions
+
+
+class StepDraws:
+    """
+    A block of random numbers drawn for the active consumers at the beginning of a step.
+    """
+
+    def __init__(self, rng: np.random.Generator, consumer_ids: np.ndarray, recommendation_length: int) -> None:
+        """
+
+        :param rng: np.random.Generator of the run.
+        :param consumer_ids: np.ndarray of the ids of the active consumers, sorted ascendingly.
+        :param recommendation_length: int of number of items in the recommended list.
+        """
+        self.consumer_ids = np.asarray(consumer_ids)
+        num_consumers = len(self.consumer_ids)
+        self.uniforms = rng.random((num_consumers, 5))
+        self.normals = rng.standard_normal(num_consumers)
+        self.exponentials = rng.standard_exponential((num_consumers, recommendation_length))
+
+    def rows(self, consumer_ids: np.ndarray) -> np.ndarray:
+        """
+
+        :param consumer_ids: np.ndarray of ids of active consumers.
+        :return: np.ndarray of the rows of the consumers in the block.
+
+        A function maps consumers ids to their rows in the block.
+        """
+        return np.searchsorted(self.consumer_ids, consumer_ids)
+
+    def row(self, consumer_id: int) -> int:
+        """
+
+        :param consumer_id: int of an active consumer id.
+        :return: int of the row of the consumer in the block.
+
+        A function maps a consumer id to its row in the block.
+        """
+        return int(np.searchsorted(self.consumer_ids, consumer_id))
+
+    def pick_positions(self, rows: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+
+        :param rows: np.ndarray of the rows of consumers in the block.
+        :param lengths: np.ndarray of the number of items in the recommended list of each consumer.
+        :return: np.ndarray of the picked position of each consumer, -1 when its list is empty.
+
+        A function picks a position in the recommended lists of the given consumers, see `sample_rank_positions`.
+        """
+        return sample_rank_positions(self.exponentials[rows], self.uniforms[rows, PICK], lengths)
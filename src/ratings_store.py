@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+
+class RatingsStore:
+    """
+    A columnar store of the consumers' ratings that grows as feedback is received.
+
+    The users ids, the items ids and the ratings are held in three NumPy arrays whose capacity is doubled when they are
+    full, so appending ratings costs amortized O(1) per rating instead of copying all the ratings. The stored ratings
+    are exposed as views of the arrays, without copying them.
+    """
+
+    def __init__(self: object, users: np.ndarray, items: np.ndarray, ratings: np.ndarray) -> None:
+        """
+
+        :param users: np.ndarray of the users ids of the ratings.
+        :param items: np.ndarray of the items ids of the ratings.
+        :param ratings: np.ndarray of the ratings.
+        """
+        self.size = len(ratings)
+        capacity = max(self.size, 1)
+        self._users = np.empty(capacity, dtype=np.int32)
+        self._items = np.empty(capacity, dtype=np.int32)
+        self._ratings = np.empty(capacity, dtype=np.float32)
+        self._users[:self.size] = users
+        self._items[:self.size] = items
+        self._ratings[:self.size] = ratings
+
+    @classmethod
+    def from_dataframe(cls, ratings_df: pd.DataFrame) -> "RatingsStore":
+        """
+
+        :param ratings_df: pd.DataFrame of the ratings with userId, movieId and rating columns.
+        :return: RatingsStore.
+
+        A function builds a store from the ratings dataset.
+        """
+        return cls(ratings_df["userId"].to_numpy(), ratings_df["movieId"].to_numpy(), ratings_df["rating"].to_numpy())
+
+    def __len__(self: object) -> int:
+        return self.size
+
+    @property
+    def nbytes(self: object) -> int:
+        """
+
+        :return: int of the bytes of the arrays of the store, their spare capacity included.
+        """
+        return self._users.nbytes + self._items.nbytes + self._ratings.nbytes
+
+    @property
+    def users(self: object) -> np.ndarray:
+        """
+
+        :return: np.ndarray view of the users ids of the stored ratings.
+        """
+        return self._users[:self.size]
+
+    @property
+    def items(self: object) -> np.ndarray:
+        """
+
+        :return: np.ndarray view of the items ids of the stored ratings.
+        """
+        return self._items[:self.size]
+
+    @property
+    def ratings(self: object) -> np.ndarray:
+        """
+
+        :return: np.ndarray view of the stored ratings.
+        """
+        return self._ratings[:self.size]
+
+    def reserve(self: object, capacity: int) -> None:
+        """
+
+        :param capacity: int of the number of ratings the arrays can hold at least.
+
+        A function grows the arrays, doubling their capacity until it is enough.
+        """
+        new_capacity = len(self._ratings)
+        if capacity <= new_capacity:
+            return
+        while new_capacity < capacity:
+            new_capacity *= 2
+        for name in ("_users", "_items", "_ratings"):
+            old = getattr(self, name)
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def append(self: object, user_id: int, item_id: int, rating: float) -> None:
+        """
+
+        :param user_id: int of the user id.
+        :param item_id: int of the item id.
+        :param rating: float of the rating.
+
+        A function appends one rating.
+        """
+        self.extend([user_id], [item_id], [rating])
+
+    def extend(self: object, users: np.ndarray, items: np.ndarray, ratings: np.ndarray) -> None:
+        """
+
+        :param users: np.ndarray of the users ids.
+        :param items: np.ndarray of the items ids.
+        :param ratings: np.ndarray of the ratings.
+
+        A function appends several ratings at once.
+        """
+        n = len(ratings)
+        self.reserve(self.size + n)
+        self._users[self.size:self.size + n] = users
+        self._items[self.size:self.size + n] = items
+        self._ratings[self.size:self.size + n] = ratings
+        self.size += n
+
+    def to_dataframe(self: object) -> pd.DataFrame:
+        """
+
+        :return: pd.DataFrame of the ratings with userId, movieId and rating columns.
+
+        A function gets the ratings as a dataframe built on views of the arrays, e.g. for the SVD trainer.
+        """
+        return pd.DataFrame({"userId": self.users, "movieId": self.items, "rating": self.ratings}, copy=False)
+
+    def item_counts(self: object) -> (np.ndarray, np.ndarray):
+        """
+
+        :return: tuple of the np.ndarray of the rated items ids and the np.ndarray of their numbers of ratings.
+
+        A function counts the ratings of each item.
+        """
+        return np.unique(self.items, return_counts=True)
+
+
+class PopularityIndex:
+    """
+    An index of the popularity of the items of the catalog, i.e. their numbers of ratings.
+
+    The numbers of ratings are held in an array aligned with the catalog and the items are kept ranked by their numbers
+    of ratings descendingly, the items rated first coming first among items with the same number of ratings. Adding
+    ratings only moves the rated items in the ranking, so the most popular items are read from the ranking without
+    counting or sorting the ratings again.
+    """
+
+    def __init__(self: object, num_items: int) -> None:
+        """
+
+        :param num_items: int of the number of items in the catalog.
+        """
+        self.counts = np.zeros(num_items, dtype=np.int64)
+        # the position of the first rating of each item, the sentinel for unrated items ranks them last
+        self.first_rated = np.full(num_items, np.iinfo(np.uint32).max, dtype=np.int64)
+        self.ranking = np.arange(num_items)
+        self.keys = self.get_keys(self.ranking)
+        self.num_rated = 0
+
+    @classmethod
+    def from_items(cls, num_items: int, items: np.ndarray) -> "PopularityIndex":
+        """
+
+        :param num_items: int of the number of items in the catalog.
+        :param items: np.ndarray of the items indices of the ratings, in the order they were rated.
+        :return: PopularityIndex.
+
+        A function builds the index of a ratings dataset.
+        """
+        index = cls(num_items)
+        index.add(items, 0)
+        return index
+
+    def get_keys(self: object, items: np.ndarray) -> np.ndarray:
+        """
+
+        :param items: np.ndarray of items indices.
+        :return: np.ndarray of the ranking keys of the items, higher keys rank first.
+        """
+        return (self.counts[items] << 32) - self.first_rated[items]
+
+    def add(self: object, items: np.ndarray, first_position: int) -> None:
+        """
+
+        :param items: np.ndarray of the items indices of new ratings, in the order they were rated.
+        :param first_position: int of the position of the first of these ratings among all the ratings.
+
+        A function counts new ratings and moves the rated items up in the ranking.
+        """
+        items = np.asarray(items, dtype=np.int64)
+        if not len(items):
+            return
+        rated, first, counts = np.unique(items, return_index=True, return_counts=True)
+        self.num_rated += int((self.counts[rated] == 0).sum())
+        self.counts[rated] += counts
+        self.first_rated[rated] = np.minimum(self.first_rated[rated], first_position + first)
+        # take the rated items out of the ranking and insert them back at their new places
+        keep = ~np.isin(self.ranking, rated)
+        ranking, keys = self.ranking[keep], self.keys[keep]
+        new_keys = self.get_keys(rated)
+        order = np.argsort(-new_keys, kind="stable")
+        rated, new_keys = rated[order], new_keys[order]
+        places = np.searchsorted(-keys, -new_keys, side="right")
+        self.ranking = np.insert(ranking, places, rated)
+        self.keys = np.insert(keys, places, new_keys)
+
+    def top(self: object, k: int = None) -> np.ndarray:
+        """
+
+        :param k: int of the number of items, all the rated items by default.
+        :return: np.ndarray of the indices of the `k` most popular rated items, the most popular first.
+        """
+        k = self.num_rated if k is None else min(k, self.num_rated)
+        return self.ranking[:k]
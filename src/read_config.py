@@ -19,3 +19,4 @@ def parseconfig() -> object:
 config_data = parseconfig()
 model_parameters = config_data["model_parameters"]
 model_input = config_data["model_input"]
+benchmark_parameters = config_data["benchmark"]
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+import copy
+from collections import defaultdict
+
+import numpy as np
+
+
+def rank_candidates(scores: np.ndarray, pool_size: int = None, ties: np.ndarray = None) -> np.ndarray:
+    """
+
+    :param scores: np.ndarray of the scores of the candidate items (consumers x candidates).
+    :param pool_size: int of the number of top candidates to keep, all the candidates are ordered when it is None.
+    :param ties: np.ndarray of secondary scores that order candidates with equal scores.
+    :return: np.ndarray of the columns of the `pool_size` highest scores of each consumer, ordered descendingly.
+
+    A function ranks the candidates of all consumers at once. The top candidates are selected with a partial sort
+    (argpartition) and only they are ordered; the full order is computed when the pool covers all the candidates.
+    Candidates with equal scores are ordered by `ties` descendingly and then by their column.
+    """
+    num_candidates = scores.shape[1]
+    if pool_size is None or pool_size >= num_candidates:
+        if ties is None:
+            return np.argsort(-scores, axis=1, kind="stable")
+        columns = np.broadcast_to(np.arange(num_candidates), scores.shape)
+    else:
+        columns = np.argpartition(-scores, pool_size - 1, axis=1)[:, :pool_size]
+    keys = [columns]
+    if ties is not None:
+        keys.append(-np.take_along_axis(ties, columns, axis=1))
+    keys.append(-np.take_along_axis(scores, columns, axis=1))
+    order = np.lexsort(keys, axis=1)
+    return np.take_along_axis(columns, order, axis=1)
+
+
+class RecommendationStore:
+    """
+    A columnar store of the ranked recommendations of all consumers.
+
+    The store keeps the predicted utilities of the candidate items (`utilities`, one row per consumer and one column per
+    candidate) and the ranked pool of items each consumer can be recommended. Each consumer owns one row of `items`
+    (dense item indices ordered by rank) and one row of `ratings` (the predicted utilities in the same order). The profit
+    of an item is looked up from the `profits` array shared by all consumers, and the consumed items are flagged in the
+    `consumed` bitmask instead of being deleted, so consuming an item and querying the next unconsumed top-N items do not
+    rebuild any list.
+    """
+
+    def __init__(self, consumer_ids: list, item_ids: list, items: np.ndarray, ratings: np.ndarray,
+                 utilities: np.ndarray, candidates: np.ndarray, profits: np.ndarray = None) -> None:
+        """
+
+        :param consumer_ids: list of consumers ids, one row per consumer.
+        :param item_ids: list of the raw items ids, the position of an id is its dense item index.
+        :param items: np.ndarray of the ranked items indices (consumers x pool size).
+        :param ratings: np.ndarray of the predicted utilities aligned with `items`.
+        :param utilities: np.ndarray of the predicted utilities of all the candidates (consumers x candidates).
+        :param candidates: np.ndarray of the items indices of the columns of `utilities`.
+        :param profits: np.ndarray of the profit of each item aligned with `item_ids`.
+        """
+        self.consumer_ids = np.asarray(consumer_ids)
+        self.item_ids = np.asarray(item_ids)
+        # the ranked pool is never modified, so it can be shared by the stores of several runs (see `overlay`)
+        self.items = np.asarray(items, dtype=np.int32).view()
+        self.items.flags.writeable = False
+        self.ratings = np.asarray(ratings, dtype=np.float32).view()
+        self.ratings.flags.writeable = False
+        # the utilities may be a read-only memory-mapped matrix, they are kept in their stored type to avoid copying them
+        self.utilities = utilities
+        self.candidates = np.asarray(candidates, dtype=np.int32)
+        self.profits = None if profits is None else np.asarray(profits, dtype=np.float32)
+        self.consumed = np.zeros(self.items.shape, dtype=bool)
+        # the columns of the consumed items that are not part of the ranked pool
+        self.consumed_outside_pool = defaultdict(list)
+        # the expectation thresholds of each quantile, and the consumers whose thresholds changed since they were computed
+        self.thresholds = {}
+        self.stale = np.zeros(len(self.consumer_ids), dtype=bool)
+        # the rank of the first unconsumed item of each consumer
+        self.head = np.zeros(len(self.consumer_ids), dtype=np.int64)
+        self.row_of = {int(c): r for r, c in enumerate(self.consumer_ids)}
+        self.consumers_order = np.argsort(self.consumer_ids)
+        self.index_of = {int(i): j for j, i in enumerate(self.item_ids)}
+        self.column_of = np.full(len(self.item_ids), -1, dtype=np.int64)
+        self.column_of[self.candidates] = np.arange(len(self.candidates))
+
+    @classmethod
+    def from_utilities(cls, consumer_ids: list, item_ids: list, utilities: np.ndarray, candidates: np.ndarray = None,
+                       sort: bool = True, profits: np.ndarray = None, pool_size: int = None) -> "RecommendationStore":
+        """
+
+        :param consumer_ids: list of consumers ids, one row of `utilities` per consumer.
+        :param item_ids: list of the raw items ids of the catalog.
+        :param utilities: np.ndarray of the predicted utilities (consumers x candidates).
+        :param candidates: np.ndarray of the items indices of the columns of `utilities`, all the catalog by default.
+        :param sort: bool, if True the candidates are ranked descendingly by their utilities, otherwise their given order is kept.
+        :param profits: np.ndarray of the profit of each item aligned with `item_ids`.
+        :param pool_size: int of the number of ranked items kept for each consumer, all the candidates by default.
+        :return: RecommendationStore.
+
+        A function builds a store from a matrix of predicted utilities.
+        """
+        if candidates is None:
+            candidates = np.arange(utilities.shape[1])
+        candidates = np.asarray(candidates, dtype=np.int32)
+        if sort:
+            order = rank_candidates(utilities, pool_size)
+            items = candidates[order]
+            ratings = np.take_along_axis(utilities, order, axis=1)
+        else:
+            pool_size = utilities.shape[1] if pool_size is None else min(pool_size, utilities.shape[1])
+            items = np.broadcast_to(candidates[:pool_size], (utilities.shape[0], pool_size))
+            ratings = utilities[:, :pool_size]
+        return cls(consumer_ids, item_ids, items, ratings, utilities, candidates, profits)
+
+    def overlay(self, profits: np.ndarray = None) -> "RecommendationStore":
+        """
+
+        :param profits: np.ndarray of the profit of each item aligned with `item_ids`, the profits of the store by default.
+        :return: RecommendationStore.
+
+        A function creates a store for a run on top of this one: the ranked pool, the utilities and the indices are shared
+        read-only, and the new store only owns the items consumed in the run and the head of each consumer.
+        """
+        store = copy.copy(self)
+        if profits is not None:
+            store.profits = np.asarray(profits, dtype=np.float32)
+        store.consumed = np.zeros(self.items.shape, dtype=bool)
+        store.consumed_outside_pool = defaultdict(list)
+        # the thresholds of the store are shared until a consumption changes them
+        store.thresholds = dict(self.thresholds)
+        store.stale = np.zeros(len(self.consumer_ids), dtype=bool)
+        store.head = np.zeros(len(self.consumer_ids), dtype=np.int64)
+        return store
+
+    @property
+    def nbytes(self) -> int:
+        """
+
+        :return: int of the bytes of the arrays of the store, the ranked pool included and the utilities excluded.
+        """
+        arrays = [self.items, self.ratings, self.consumed, self.head, self.stale, self.column_of, self.candidates]
+        arrays += list(self.thresholds.values())
+        return sum(a.nbytes for a in arrays)
+
+    def top_n(self, n: int) -> np.ndarray:
+        """
+
+        :param n: int of number of items in the recommended list.
+        :return: np.ndarray of the ranks of the `n` first unconsumed items of each consumer, padded with -1.
+
+        A function finds the next unconsumed top-N items of all consumers at once.
+        """
+        num_consumers, length = self.items.shape
+        rows = np.arange(num_consumers)[:, None]
+        width = n
+        while True:
+            ranks = self.head[:, None] + np.arange(width)
+            valid = ranks < length
+            ranks = np.minimum(ranks, length - 1)
+            available = valid & ~self.consumed[rows, ranks]
+            count = np.cumsum(available, axis=1)
+            # a consumer is done when it has `n` items or when its candidates are exhausted
+            if ((count[:, -1] >= n) | ~valid[:, -1]).all():
+                break
+            width *= 2
+        keep = available & (count <= n)
+        topn = np.full((num_consumers, n), -1, dtype=np.int64)
+        r, c = np.nonzero(keep)
+        topn[r, count[r, c] - 1] = ranks[r, c]
+        return topn
+
+    def get_item(self, consumer_id: int, rank: int) -> dict:
+        """
+
+        :param consumer_id: int of consumer id.
+        :param rank: int of the rank of the item in the consumer's recommendations.
+        :return: dict of the item id, its predicted utility and its profit.
+
+        A function gets the details of a recommended item.
+        """
+        r = self.row_of[consumer_id]
+        j = self.items[r, rank]
+        item = {"iid": int(self.item_ids[j]), "rating": round(float(self.ratings[r, rank]), 3)}
+        if self.profits is not None:
+            item["profit"] = float(self.profits[j])
+        return item
+
+    def consume(self, consumer_id: int, rank: int) -> None:
+        """
+
+        :param consumer_id: int of consumer id.
+        :param rank: int of the rank of the consumed item.
+
+        A function flags an item as consumed, so it won't be recommended again to the consumer.
+        """
+        r = self.row_of[consumer_id]
+        self.consumed[r, rank] = True
+        self.stale[r] = True
+        length = self.items.shape[1]
+        while self.head[r] < length and self.consumed[r, self.head[r]]:
+            self.head[r] += 1
+
+    def consume_many(self, rows: np.ndarray, ranks: np.ndarray) -> None:
+        """
+
+        :param rows: np.ndarray of the rows of the consumers, one consumed item per row.
+        :param ranks: np.ndarray of the ranks of the consumed items.
+
+        A function flags the items consumed by several consumers at once.
+        """
+        self.consumed[rows, ranks] = True
+        self.stale[rows] = True
+        length = self.items.shape[1]
+        rows = np.unique(rows)
+        while len(rows):
+            rows = rows[self.head[rows] < length]
+            rows = rows[self.consumed[rows, self.head[rows]]]
+            self.head[rows] += 1
+
+    def get_rows(self, consumer_ids: np.ndarray) -> np.ndarray:
+        """
+
+        :param consumer_ids: np.ndarray of consumers ids.
+        :return: np.ndarray of the rows of the consumers in the store.
+
+        A function maps consumers ids to their rows.
+        """
+        positions = np.searchsorted(self.consumer_ids, consumer_ids, sorter=self.consumers_order)
+        return self.consumers_order[positions]
+
+    def remove_items(self, consumer_id: int, item_ids: list) -> None:
+        """
+
+        :param consumer_id: int of consumer id.
+        :param item_ids: list of raw items ids.
+
+        A function flags the given items as consumed for a consumer.
+        """
+        r = self.row_of[consumer_id]
+        indices = np.array([self.index_of[int(i)] for i in item_ids], dtype=np.int32)
+        in_pool = np.isin(indices, self.items[r])
+        for rank in np.flatnonzero(np.isin(self.items[r], indices)):
+            self.consume(consumer_id, rank)
+        columns = self.column_of[indices[~in_pool]]
+        self.consumed_outside_pool[r].extend(columns[columns >= 0].tolist())
+        self.stale[r] = True
+
+    def get_unavailable(self, rows: np.ndarray) -> np.ndarray:
+        """
+
+        :param rows: np.ndarray of the rows of consumers.
+        :return: np.ndarray of bool flagging the consumed candidates of the consumers (rows x candidates).
+
+        A function finds the candidates that can no longer be recommended to several consumers.
+        """
+        unavailable = np.zeros((len(rows), self.utilities.shape[1]), dtype=bool)
+        r, ranks = np.nonzero(self.consumed[rows])
+        unavailable[r, self.column_of[self.items[rows[r], ranks]]] = True
+        for i, row in enumerate(rows):
+            unavailable[i, self.consumed_outside_pool.get(row, [])] = True
+        return unavailable
+
+    def available_ratings(self, consumer_id: int) -> np.ndarray:
+        """
+
+        :param consumer_id: int of consumer id.
+        :return: np.ndarray of the predicted utilities of the unconsumed candidates.
+
+        A function gets the predicted utilities of the items that could still be recommended to a consumer.
+        """
+        r = self.row_of[consumer_id]
+        return self.utilities[r][~self.get_unavailable(np.array([r]))[0]]
+
+    def compute_quantiles(self, rows: np.ndarray, quantiles: list) -> np.ndarray:
+        """
+
+        :param rows: np.ndarray of the rows of consumers.
+        :param quantiles: list of quantiles in [0, 1].
+        :return: np.ndarray of the quantiles of the predicted utilities of the unconsumed candidates (quantiles x rows).
+
+        A function computes quantiles of the utilities that could still be recommended to several consumers at once.
+        The unconsumed utilities of each consumer are sorted, the consumed ones being moved to the end, and each quantile
+        is interpolated between two of them as the default ("linear") method of `np.quantile` does. The utilities are
+        stored as float32, they are taken back to the float64 values of the predictions (rounded to three decimals), so
+        the values are the same as `np.quantile` of the predicted ratings of each consumer.
+        """
+        unavailable = self.get_unavailable(rows)
+        utilities = np.round(self.utilities[rows].astype(np.float64), 3)
+        utilities = np.sort(np.where(unavailable, np.inf, utilities), axis=1)
+        counts = (~unavailable).sum(axis=1)
+        r = np.arange(len(rows))
+        values = np.empty((len(quantiles), len(rows)), dtype=utilities.dtype)
+        for i, q in enumerate(quantiles):
+            index = (counts - 1) * q
+            previous = np.floor(index).astype(np.int64)
+            gamma = index - previous
+            below = utilities[r, previous]
+            above = utilities[r, np.minimum(previous + 1, counts - 1)]
+            diff = above - below
+            values[i] = np.where(gamma >= 0.5, above - diff * (1 - gamma), below + diff * gamma)
+        return values
+
+    def compute_thresholds(self, quantiles: list) -> None:
+        """
+
+        :param quantiles: list of quantiles in [0, 1].
+
+        A function computes the thresholds of several quantiles for all consumers at once, e.g. all the quantiles of a
+        sweep before the store is shared by its runs.
+        """
+        quantiles = [q for q in dict.fromkeys(quantiles) if q not in self.thresholds]
+        if not quantiles:
+            return
+        values = self.compute_quantiles(np.arange(len(self.consumer_ids)), quantiles)
+        for q, thresholds in zip(quantiles, values):
+            thresholds.flags.writeable = False
+            self.thresholds[q] = thresholds
+
+    def get_thresholds(self, quantile: float) -> np.ndarray:
+        """
+
+        :param quantile: float in [0, 1].
+        :return: np.ndarray of the `quantile` of the predicted utilities of the unconsumed candidates of each consumer.
+
+        A function gets the expectation thresholds of all consumers. They are computed once and only the thresholds of
+        the consumers who consumed items since then are computed again.
+        """
+        if self.stale.any():
+            rows = np.flatnonzero(self.stale)
+            cached = list(self.thresholds)
+            for q, values in zip(cached, self.compute_quantiles(rows, cached) if cached else []):
+                thresholds = self.thresholds[q].copy()
+                thresholds[rows] = values
+                self.thresholds[q] = thresholds
+            self.stale[:] = False
+        self.compute_thresholds([quantile])
+        return self.thresholds[quantile]
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import queue
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+class ResultSink:
+    """
+    A writer of the records of one run to disk. Chunks of records are handed to a background thread through a bounded
+    queue, so the simulation goes on while a chunk is written, and it waits when `max_pending_chunks` chunks are not
+    written yet instead of holding more records in memory.
+
+    Each table is written to one file per run, `{table}-data-{run_name}.csv` or `.parquet`. CSV chunks are appended to
+    the file and Parquet chunks are written as row groups of the file (Parquet requires pyarrow).
+    """
+
+    def __init__(self: object, directory: str, run_name: str, results_format: str = "csv",
+                 max_pending_chunks: int = 2) -> None:
+        """
+
+        :param directory: str of the directory of the files.
+        :param run_name: str of the name of the run, part of the files names.
+        :param results_format: str of the format of the files, "csv" or "parquet".
+        :param max_pending_chunks: int of the number of chunks that can wait to be written.
+        """
+        if results_format not in ("csv", "parquet"):
+            raise ValueError(f"Unknown results format: {results_format}")
+        if results_format == "parquet":
+            import pyarrow  # noqa: F401, fail before the run starts when pyarrow is missing
+        self.directory = directory
+        self.run_name = run_name
+        self.results_format = results_format
+        self.paths = {}
+        self.parquet_writers = {}
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending_chunks)
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def path(self: object, table: str) -> str:
+        """
+
+        :param table: str of the table name, e.g. "agents" or "model".
+        :return: str of the path of the file of the table.
+        """
+        return os.path.join(self.directory, f"{table}-data-{self.run_name}.{self.results_format}")
+
+    def write(self: object, table: str, columns: dict) -> None:
+        """
+
+        :param table: str of the table name.
+        :param columns: dict of column names and arrays of equal length.
+
+        A function queues a chunk of records to be written, it blocks while the queue is full.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((table, columns))
+
+    def write_loop(self: object) -> None:
+        """
+
+         A function writes the queued chunks until the sink is closed, it runs in the writer thread.
+        """
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.queue.task_done()
+                return
+            if self.error is None:
+                try:
+                    self.write_chunk(*chunk)
+                except Exception as e:
+                    self.error = e
+            self.queue.task_done()
+
+    def write_chunk(self: object, table: str, columns: dict) -> None:
+        """
+
+        :param table: str of the table name.
+        :param columns: dict of column names and arrays of equal length.
+
+        A function appends a chunk of records to the file of a table.
+        """
+        frame = pd.DataFrame(columns)
+        path = self.paths.setdefault(table, self.path(table))
+        if self.results_format == "csv":
+            frame.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # objects (e.g. the selected items) are written as strings, as in the CSV files
+        for column in frame.columns[frame.dtypes == object]:
+            frame[column] = frame[column].map(lambda v: None if v is None else str(v)).astype("string")
+        arrow_table = pa.Table.from_pandas(frame, preserve_index=False)
+        if table not in self.parquet_writers:
+            self.parquet_writers[table] = pq.ParquetWriter(path, arrow_table.schema)
+        self.parquet_writers[table].write_table(arrow_table)
+
+    def wait(self: object) -> None:
+        """
+
+         A function waits for the queued chunks to be written, e.g. before the files are checkpointed.
+        """
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self: object) -> None:
+        """
+
+         A function waits for the queued chunks to be written and closes the files.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        for writer in self.parquet_writers.values():
+            writer.close()
+        self.parquet_writers = {}
+        if self.error is not None:
+            raise self.error
+
+
+def get_run_files(directory: str, table: str, scenario: str) -> list:
+    """
+
+    :param directory: str of the directory of the files.
+    :param table: str of the table name.
+    :param scenario: str of the scenario name.
+    :return: list of the paths of the files of the runs of the scenario, ordered by run.
+
+    A function finds the files written by the sinks of the runs of a scenario.
+    """
+    paths = glob.glob(os.path.join(directory, f"{table}-data-{scenario}-run*.*"))
+    return sorted(paths, key=lambda p: int(os.path.splitext(p)[0].rsplit("-run", 1)[1]))
+
+
+def merge_csv_files(paths: list, path: str) -> None:
+    """
+
+    :param paths: list of paths of CSV files with the same columns.
+    :param path: str of the path of the merged file.
+
+    A function concatenates CSV files without loading them, the header of the first file is kept and the input files
+    are removed.
+    """
+    with open(path, "w") as merged:
+        for i, p in enumerate(paths):
+            with open(p, "r") as part:
+                header = part.readline()
+                if i == 0:
+                    merged.write(header)
+                shutil.copyfileobj(part, merged)
+            os.remove(p)
+
+
+def read_chunks(paths: list, columns: list, chunksize: int = 1000000) -> object:
+    """
+
+    :param paths: list of paths of CSV or Parquet files.
+    :param columns: list of the columns to read.
+    :param chunksize: int of the number of rows of each chunk of the CSV files.
+    :return: generator of pandas dataframes.
+
+    A function reads some columns of result files chunk by chunk.
+    """
+    for path in paths:
+        if path.endswith(".parquet"):
+            yield pd.read_parquet(path, columns=columns)
+        else:
+            yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+
+def forward_fill(records: pd.DataFrame, steps: list = None, step_column: str = "step",
+                 id_column: str = "consumerId") -> pd.DataFrame:
+    """
+
+    :param records: pandas dataframe of the agents records of one run, recorded with `changes_only`.
+    :param steps: list of the steps of the run, all the steps between the first and the last record by default.
+    :param step_column: str of the name of the step column.
+    :param id_column: str of the name of the agent id column.
+    :return: pandas dataframe of the records of every agent at every step it was recorded, ordered by step and id.
+
+    A function rebuilds the dense records from the records of the changes: the last record of an agent is repeated at
+    the following steps until its next record, and the agents are dropped after their `removed` record.
+    """
+    if steps is None:
+        steps = np.arange(records[step_column].min(), records[step_column].max() + 1)
+    records = records.reset_index(drop=True)
+    index = pd.MultiIndex.from_product([np.unique(records[id_column]), steps], names=[id_column, step_column])
+    # the position of the last record of each agent at each step
+    positions = pd.Series(np.arange(len(records), dtype=np.float64),
+                          index=pd.MultiIndex.from_arrays([records[id_column], records[step_column]]))
+    positions = positions.reindex(index).groupby(level=0).ffill().dropna()
+    dense = records.iloc[positions.to_numpy(dtype=np.int64)]
+    dense[step_column] = positions.index.get_level_values(step_column).to_numpy()
+    dense = dense[dense["removed"] == 0].drop(columns="removed")
+    return dense.sort_values([step_column, id_column], kind="stable").reset_index(drop=True)
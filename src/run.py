@@ -1,42 +1,52 @@
 # -*- coding: utf-8 -*-
 
+import argparse
+import os
 import time
-import pandas as pd
-from mesa.batchrunner import BatchRunner
+from functools import partial
+from checkpoint import create_or_resume, fork_warmup, run_warmup
+from mesa_utils.batchrunner import ParallelBatchRunner
 from model import RecommendationModel
 from plots import *
 from read_config import *
-from utils import store_recommender_systems_generated_data  # create_all_directories
+from utils import create_directory, get_exec_path, get_run_seed, store_recommender_systems_generated_data  # create_all_directories
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the simulation of all the scenarios.")
+    parser.add_argument("--resume", metavar="EXECUTION_DIRECTORY",
+                        help="resume an interrupted execution from the last checkpoints of its runs")
+    args = parser.parse_args()
     print("Simulation begins ...\n")
     var_params = {"recommendation_strategy": model_parameters["recommendation_strategy"],
                   "quantile_consumer_expectation": model_parameters["quantile_consumer_expectation"]}
 
     # create a timestamp for each result fol
     timestr = time.strftime("%Y%m%d-%H%M%S")
+    exec_path = os.path.abspath(args.resume) if args.resume else get_exec_path() + timestr
+    create_directory(exec_path)
 
     # create_all_directories()
     store_recommender_systems_generated_data()
-    batch_run = BatchRunner(RecommendationModel,
-                            fixed_parameters=None,
-                            variable_parameters=var_params,
-                            iterations=model_parameters["number_of_runs"],
-                            max_steps=model_parameters["timesteps"],
-                            model_reporters={
-                                "DataCollector": lambda m: m.datacollector},
-                            display_progress=True
-                            )
+    create_model = RecommendationModel
+    if model_parameters["warmup_steps"]:
+        # the warm-up of each iteration runs once with the first scenario, the scenarios are forked from it
+        warmup_params = {name: values[0] for name, values in var_params.items()}
+        for iteration in range(model_parameters["number_of_runs"]):
+            run_warmup(RecommendationModel, exec_path, model_parameters["warmup_steps"], iteration=iteration,
+                       seed=get_run_seed(warmup_params, iteration), **warmup_params)
+        create_model = partial(fork_warmup, exec_path)
+    if args.resume:
+        create_model = partial(create_or_resume, create_model)
+    batch_run = ParallelBatchRunner(create_model,
+                                    variable_parameters=var_params,
+                                    seed_function=get_run_seed,
+                                    iterations=model_parameters["number_of_runs"],
+                                    max_steps=model_parameters["timesteps"],
+                                    processes=model_parameters["number_of_processes"],
+                                    result_dir=exec_path,
+                                    display_progress=True
+                                    )
     batch_run.run_all()
 
-    br_df = batch_run.get_model_vars_dataframe()
-    br_step_model_data = pd.DataFrame()
-    br_step_agent_data = pd.DataFrame()
-    for i in range(len(br_df["DataCollector"])):
-        i_run_model = br_df["DataCollector"][i].get_model_vars_dataframe()
-        br_step_model_data = br_step_model_data.append(i_run_model)
-        i_run_agent = br_df["DataCollector"][i].get_agent_vars_dataframe()
-        br_step_agent_data = br_step_agent_data.append(i_run_agent)
-
-    plot_results(br_step_model_data, br_step_agent_data, timestr)
+    plot_results(exec_path)
     print("Data is stored")
@@ -8,7 +8,6 @@ class providerAgent(Agent):
     def __init__(self: Agent, id: int, model: Model) -> None:
         super().__init__(id, model)
         self.recommendation_strategy = None
-        self.recommendations = model.recommendations
         self.total_profit_of_consumed_items = 0
         self.number_of_consumption = 0
         self.avg_profit_per_consumption = 0
@@ -16,15 +15,27 @@ class providerAgent(Agent):
     def update_provider_utilities(self: Agent, item: int) -> None:
         """
 
-         :param item: int of item id.
+         :param item: dict of the consumed item, with its profit.
 
          A function computes service provider"s utilities.
         """
-        self.total_profit_of_consumed_items += self.model.profit_data[item["iid"]]
+        self.total_profit_of_consumed_items += item["profit"]
         self.number_of_consumption += 1
         self.avg_profit_per_consumption = self.total_profit_of_consumed_items / \
             self.number_of_consumption
 
+    def add_consumptions(self: Agent, profits: np.ndarray) -> None:
+        """
+
+         :param profits: np.ndarray of the profits of the items consumed by several consumers.
+
+         A function computes service provider"s utilities after several consumptions at once.
+        """
+        self.total_profit_of_consumed_items += profits.sum()
+        self.number_of_consumption += len(profits)
+        self.avg_profit_per_consumption = self.total_profit_of_consumed_items / \
+            self.number_of_consumption
+
     def get_total_profit(self) -> None:
         return self.total_profit
 
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+from ratings_store import PopularityIndex, RatingsStore
+from read_config import model_input
+from recommendation_store import RecommendationStore
+from utils import (generate_profitdata, get_initial_beta, get_items_ids, get_items_indices, get_ratings_data,
+                   get_traced_cohort, load_utilities)
+
+
+class SimulationContext:
+    """
+    The inputs shared by all the runs of a process: the catalog, the ratings dataset, the initial experiences of the
+    consumers, the traced cohort, the precomputed utilities, the profits and the initial rankings. They are loaded and
+    indexed once, when the first run of the process needs them, and are not modified by the runs: a run gets its own
+    copy of what it updates (e.g. the ratings, or an `overlay` of a ranking) and reads the rest. The utilities are
+    memory-mapped read-only, so their pages are also shared by the processes of the machine.
+    """
+
+    def __init__(self: object) -> None:
+        self.item_ids = get_items_ids()
+        ratings_df = get_ratings_data()
+        self.ratings = RatingsStore.from_dataframe(ratings_df)
+        self.num_consumers = len(np.unique(self.ratings.users))
+        # the items indices of the ratings, to build the popularity index of a run
+        self.rated_items = get_items_indices(self.item_ids, self.ratings.items)
+        self.initial_beta = get_initial_beta()
+        self.traced_consumers = get_traced_cohort(self.initial_beta)
+        self.utilities = load_utilities("consumers_items_utilities")
+        self.candidates = get_items_indices(self.item_ids, self.utilities[1])
+        # the least recently used profits and rankings are dropped when there are more than the size of their cache
+        self.profits = OrderedDict()
+        self.rankings = OrderedDict()
+        for array in (self.item_ids, self.rated_items, self.traced_consumers, self.candidates):
+            array.flags.writeable = False
+
+    def get_ratings(self: object) -> RatingsStore:
+        """
+
+        :return: RatingsStore of a copy of the ratings dataset, to which a run adds the consumers' feedback.
+        """
+        return RatingsStore(self.ratings.users, self.ratings.items, self.ratings.ratings)
+
+    def get_popularity(self: object) -> PopularityIndex:
+        """
+
+        :return: PopularityIndex of the ratings dataset, updated by a run with the consumers' feedback.
+        """
+        return PopularityIndex.from_items(len(self.item_ids), self.rated_items)
+
+    def get_profits(self: object, seed: int) -> np.ndarray:
+        """
+
+        :param seed: int of the seed of the profits.
+        :return: np.ndarray of the profit of each item aligned with `item_ids`, shared by the runs with the same seed.
+
+        A function gets the profits of the items from the cache of the process, or generates and caches them.
+        """
+        def generate():
+            profits = generate_profitdata(seed, len(self.item_ids))
+            profits.flags.writeable = False
+            return profits
+        return self.get_cached(self.profits, seed, generate, model_input["profits_cache_size"])
+
+    def get_recommendations(self: object, key: tuple, rank: callable) -> RecommendationStore:
+        """
+
+        :param key: tuple identifying the ranking, e.g. the strategy, the pool size and the seed of the profits.
+        :param rank: callable returning the RecommendationStore of the ranking, called when it is not cached.
+        :return: RecommendationStore shared by the runs, a run uses an `overlay` of it.
+
+        A function gets a ranking of the recommendations from the cache of the process, or ranks and caches it.
+        """
+        return self.get_cached(self.rankings, key, rank, model_input["rankings_cache_size"])
+
+    @staticmethod
+    def get_cached(cache: OrderedDict, key: object, compute: callable, size: int) -> object:
+        """
+
+        :param cache: OrderedDict of the cached values, the most recently used last.
+        :param key: object identifying the value.
+        :param compute: callable returning the value, called when it is not cached.
+        :param size: int of the number of values kept in the cache.
+        :return: object of the value.
+
+        A function gets a value from a cache, the least recently used values are dropped when the cache is full.
+        """
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        cache[key] = compute()
+        while len(cache) > size:
+            cache.popitem(last=False)
+        return cache[key]
+
+
+_context = None
+
+
+def get_simulation_context() -> SimulationContext:
+    """
+
+    :return: SimulationContext of the current process.
+
+    A function loads the shared inputs the first time it is called in a process and returns the same context afterwards.
+    """
+    global _context
+    if _context is None:
+        _context = SimulationContext()
+    return _context
+
+
+def set_data_directory(directory: str) -> None:
+    """
+
+    :param directory: str of the path of a data directory with the layout of `data`, e.g. a synthetic one.
+
+    A function makes the runs of the current process read their inputs from another data directory, the shared inputs
+    are loaded again by the next run. It can be given as the `initializer` of a ParallelBatchRunner.
+    """
+    global _context
+    model_input["data_directory"] = os.path.abspath(directory)
+    _context = None
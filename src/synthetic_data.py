@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic datasets with the schema of the MovieLens dataset of `data/dataset`, to measure how the simulation scales.
+
+A synthetic data directory has the layout of `data`: the ratings and the movies in the dataset directory, and the
+initial experiences of the consumers in `trust/beta_initials.p`. The recommendations data are generated by
+`store_recommender_systems_generated_data` once the directory is used (see `simulation_context.set_data_directory`).
+
+Usage:
+    python synthetic_data.py OUTPUT_DIRECTORY [--users-scale 10] [--items-scale 10] [--seed 0]
+"""
+
+import argparse
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from read_config import model_input
+
+# the size of the MovieLens "latest-small" dataset, scaled by the users and items scales
+NUM_USERS = 610
+NUM_ITEMS = 9742
+NUM_RATINGS = 100836
+MIN_RATINGS_PER_USER = 20
+GENRES = ["Action", "Adventure", "Animation", "Children", "Comedy", "Crime", "Documentary", "Drama", "Fantasy",
+          "Film-Noir", "Horror", "IMAX", "Musical", "Mystery", "Romance", "Sci-Fi", "Thriller", "War", "Western"]
+
+
+def generate_ratings(num_users: int, movie_ids: np.ndarray, num_ratings: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+
+    :param num_users: int of the number of users.
+    :param movie_ids: np.ndarray of the items ids.
+    :param num_ratings: int of the approximate number of ratings.
+    :param rng: np.random.Generator.
+    :return: pd.DataFrame of the ratings with userId, movieId, rating and timestamp columns.
+
+    A function generates ratings resembling the MovieLens ones: every user rates at least `MIN_RATINGS_PER_USER` items
+    and the numbers of ratings of the users are heavy-tailed, the items are picked by a power law of their popularity,
+    and a rating is the sum of a user bias, an item bias and a noise, rounded to the rating scale.
+    """
+    num_items = len(movie_ids)
+    extra = rng.lognormal(mean=0, sigma=1.2, size=num_users)
+    extra = np.floor(extra / extra.sum() * max(num_ratings - MIN_RATINGS_PER_USER * num_users, 0)).astype(np.int64)
+    counts = np.minimum(MIN_RATINGS_PER_USER + extra, num_items)
+    users = np.repeat(np.arange(num_users), counts)
+    # the popularity ranks of the items are shuffled, so the popular items are spread over the ids
+    popularity = 1 / (rng.permutation(num_items) + 10.0) ** 0.9
+    cdf = np.cumsum(popularity) / popularity.sum()
+    items = np.minimum(np.searchsorted(cdf, rng.random(len(users))), num_items - 1)
+    # a user rates an item at most once
+    _, first = np.unique(users * num_items + items, return_index=True)
+    users, items = users[first], items[first]
+    user_bias = rng.normal(0, 0.5, num_users)
+    item_bias = rng.normal(0, 0.5, num_items)
+    scale = np.asarray(model_input["rating_scale"], dtype=np.float64)
+    ratings = 3.5 + user_bias[users] + item_bias[items] + rng.normal(0, 0.8, len(users))
+    ratings = np.clip(np.round(ratings * 2) / 2, scale.min(), scale.max())
+    timestamps = rng.integers(828124615, 1537799257, len(users))
+    return pd.DataFrame({"userId": users + 1, "movieId": movie_ids[items], "rating": ratings, "timestamp": timestamps})
+
+
+def generate_movies(movie_ids: np.ndarray, rng: np.random.Generator) -> pd.DataFrame:
+    """
+
+    :param movie_ids: np.ndarray of the items ids.
+    :param rng: np.random.Generator.
+    :return: pd.DataFrame of the movies with movieId, title and genres columns.
+    """
+    years = rng.integers(1902, 2019, len(movie_ids))
+    num_genres = rng.integers(1, 4, len(movie_ids))
+    genres = ["|".join(rng.choice(GENRES, size=n, replace=False)) for n in num_genres]
+    titles = [f"Movie {i} ({y})" for i, y in zip(movie_ids, years)]
+    return pd.DataFrame({"movieId": movie_ids, "title": titles, "genres": genres})
+
+
+def generate_initial_beta(num_users: int, rng: np.random.Generator) -> dict:
+    """
+
+    :param num_users: int of the number of users.
+    :param rng: np.random.Generator.
+    :return: dict of the initial [positive, negative] experiences of each user id.
+    """
+    experiences = rng.gamma(shape=3, scale=2, size=(num_users, 2)) + 0.5
+    return {i + 1: experiences[i].tolist() for i in range(num_users)}
+
+
+def generate_synthetic_data(directory: str, users_scale: float = 1, items_scale: float = 1, seed: int = 0) -> None:
+    """
+
+    :param directory: str of the data directory to create.
+    :param users_scale: float multiplying the number of users (and ratings) of the MovieLens dataset.
+    :param items_scale: float multiplying the number of items of the MovieLens dataset.
+    :param seed: int of the seed of the generated data.
+
+    A function generates a synthetic data directory, the same seed and scales always give the same data.
+    """
+    rng = np.random.default_rng(seed)
+    num_users = round(NUM_USERS * users_scale)
+    num_items = round(NUM_ITEMS * items_scale)
+    # the MovieLens ids are not contiguous
+    movie_ids = np.sort(rng.choice(20 * num_items, size=num_items, replace=False)) + 1
+    dataset_dir = os.path.join(directory, model_input["dataset_directory"])
+    trust_dir = os.path.join(directory, "trust")
+    for path in (dataset_dir, trust_dir, os.path.join(directory, model_input["recommendation_data_directory"])):
+        os.makedirs(path, exist_ok=True)
+    ratings = generate_ratings(num_users, movie_ids, round(NUM_RATINGS * users_scale), rng)
+    ratings.to_csv(os.path.join(dataset_dir, model_input["ratings_dataset"]), index=False)
+    generate_movies(movie_ids, rng).to_csv(os.path.join(dataset_dir, model_input["items_dataset"]), index=False)
+    with open(os.path.join(trust_dir, "beta_initials.p"), "wb") as f:
+        pickle.dump(generate_initial_beta(num_users, rng), f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic data directory with the MovieLens schema.")
+    parser.add_argument("output", help="data directory to create")
+    parser.add_argument("--users-scale", type=float, default=1, help="multiple of the number of users and ratings")
+    parser.add_argument("--items-scale", type=float, default=1, help="multiple of the number of items")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    generate_synthetic_data(args.output, args.users_scale, args.items_scale, args.seed)
@@ -6,11 +6,11 @@ This is a temporary script file.
 """
 #from kumaraswamy import kumaraswamy
 
-import pickle
+import numpy as np
 
 
 
-pop = pickle.load(open(f"../data/recdata//consumers_items_utilities_predictions_popular.p", "rb"))
+pop = np.load(f"../data/recdata/consumers_items_utilities_popular.npy", mmap_mode="r")
 for i in range(5):
     print(pop[i][:5])
     print('\n')
@@ -3,57 +3,180 @@
 import json
 import os
 import pickle
-from collections import defaultdict, OrderedDict, Counter
+from collections import defaultdict
 from itertools import product
 import numpy as np
 import pandas as pd
 from read_config import *
+from ratings_store import PopularityIndex
+from recommendation_store import RecommendationStore, rank_candidates
 from scipy.stats import truncnorm
 from surprise import SVD, Dataset, Reader
 
 
-def predict_consumers_items_utilities(ratings_df: pd.DataFrame) -> (defaultdict, object):
+def train_predictive_model(ratings_df: pd.DataFrame, random_state: int = None) -> object:
     """
 
     :param ratings_df: pd.DataFrame of consumers' ratings.
-    :return: dict to store the items' predictions for each consumer and an object of the trained recommender engine model.
+    :param random_state: int of the seed of the initial factors.
+    :return: object of the trained recommender engine model.
 
-     A function computes consumers' utilities of all the available items using a machine learning algorithm.
+    A function trains the SVD algorithm on the given ratings.
     """
-    print("Predicting consumers items' utilities, it will take sometime...")
-    data_path = get_dataset_dir()
-    items_path = os.path.join(data_path, model_input["items_dataset"])
-    items = pd.read_csv(items_path)["movieId"].unique()
-    users = ratings_df["userId"].unique()
     reader = Reader(rating_scale=(0.5, 5))
     ratings_df = ratings_df.iloc[:, :3]
     data = Dataset.load_from_df(ratings_df, reader)
     trainset = data.build_full_trainset()
-    model = SVD()
+    model = SVD(random_state=random_state)
     model.fit(trainset)
-    predictions = defaultdict(list)
+    return model
 
-    for uid in users:
-        for iid in items:
-            est = model.predict(uid, iid).est
-            predictions[uid].append(
-                {"iid": int(iid), "rating": float(round(est, 3))})
-    print("End predicting utilities")
-    return predictions, model
 
+def get_svd_factors(svdmodel: object) -> dict:
+    """
+
+    :param svdmodel: object of the svd trained model.
+    :return: dict of the fitted factors and the mappings from raw to inner ids.
 
-def get_ordered_recs(predictions: defaultdict) -> defaultdict:
+    A function extracts the learned parameters of a trained SVD model, so the utilities can be scored in batch.
     """
+    trainset = svdmodel.trainset
+    factors = {"pu": np.asarray(svdmodel.pu),
+               "qi": np.asarray(svdmodel.qi),
+               "bu": np.asarray(svdmodel.bu),
+               "bi": np.asarray(svdmodel.bi),
+               "global_mean": trainset.global_mean,
+               "biased": svdmodel.biased,
+               "rating_scale": trainset.rating_scale,
+               "raw2inner_users": trainset._raw2inner_id_users,
+               "raw2inner_items": trainset._raw2inner_id_items}
+    return factors
 
-    :param ratings_df: pd.DataFrame of consumers' ratings.
-    :return: defaultdict to store the items' predictions for each consumer.
 
-    A function takes the items' predictions and sorts them in descending order.
+def predict_utilities_matrix(factors: dict, users: list, items: list) -> np.ndarray:
     """
-    for uid, user_ratings in predictions.items():
-        user_ratings.sort(key=lambda x: x["rating"], reverse=True)
-        predictions[uid] = user_ratings
-    return predictions
+
+    :param factors: dict of the fitted factors returned by `get_svd_factors`.
+    :param users: list of raw consumers ids, one row per consumer.
+    :param items: list of raw items ids, one column per item. It can be the whole catalog or a subset of it (e.g. popular items).
+    :return: np.ndarray of the predicted utilities clipped to the rating scale and rounded to three decimals.
+
+    A function scores the utilities of all the given consumers and items with one matrix product,
+     it gives the same estimates as calling `predict(uid, iid).est` of the SVD model for each pair.
+    """
+    inner_users = np.array([factors["raw2inner_users"].get(u, -1) for u in users], dtype=np.int64)
+    inner_items = np.array([factors["raw2inner_items"].get(i, -1) for i in items], dtype=np.int64)
+    known_users = inner_users >= 0
+    known_items = inner_items >= 0
+    # unknown users/items get zero factors, so the dot product is only added when both are known
+    pu = np.zeros((len(inner_users), factors["pu"].shape[1]))
+    pu[known_users] = factors["pu"][inner_users[known_users]]
+    qi = np.zeros((len(inner_items), factors["qi"].shape[1]))
+    qi[known_items] = factors["qi"][inner_items[known_items]]
+    utilities = pu @ qi.T
+    if factors["biased"]:
+        bu = np.zeros(len(inner_users))
+        bu[known_users] = factors["bu"][inner_users[known_users]]
+        bi = np.zeros(len(inner_items))
+        bi[known_items] = factors["bi"][inner_items[known_items]]
+        utilities += factors["global_mean"] + bu[:, None] + bi[None, :]
+    else:
+        # the prediction is impossible, the SVD model falls back to the global mean
+        utilities[~known_users, :] = factors["global_mean"]
+        utilities[:, ~known_items] = factors["global_mean"]
+    lower_bound, higher_bound = factors["rating_scale"]
+    np.clip(utilities, lower_bound, higher_bound, out=utilities)
+    np.round(utilities, 3, out=utilities)
+    return utilities
+
+
+def partial_fit_svd_factors(factors: dict, new_ratings: tuple, old_ratings: tuple, rng: np.random.Generator,
+                            epochs: int = 5, learning_rate: float = 0.005, regularization: float = 0.02,
+                            batch_size: int = 256, tolerance: float = 1e-3) -> (dict, np.ndarray, np.ndarray):
+    """
+
+    :param factors: dict of the fitted factors returned by `get_svd_factors`.
+    :param new_ratings: tuple of np.ndarray of the users ids, items ids and ratings added since the factors were fitted.
+    :param old_ratings: tuple of np.ndarray of a sample of the ratings the factors were fitted on.
+    :param rng: np.random.Generator used to initialize new factors and to shuffle the ratings.
+    :param epochs: int of number of passes over the ratings.
+    :param learning_rate: float of the learning rate of the SGD.
+    :param regularization: float of the regularization term of the SGD.
+    :param batch_size: int of number of ratings per SGD step.
+    :param tolerance: float, a user or an item whose factors or bias changed more than it is considered as moved.
+    :return: tuple of the dict of the updated factors, the np.ndarray of the raw ids of the moved users and the
+        np.ndarray of the raw ids of the moved items.
+
+    A function warm-starts the SVD factors from their previous values and runs a few epochs of mini-batch SGD (the SVD
+     update rules of surprise) over the new ratings and a sample of the old ones. Users and items that are not known
+     yet get new factors initialized as surprise does, and are always moved. The users and items that did not move keep
+     their previous factors and the global mean is kept, so only the predictions of the pairs with a moved user or a
+     moved item change: the rows of the moved users and the columns of the moved items.
+    """
+    factors = dict(factors)
+    raw2inner_users = dict(factors["raw2inner_users"])
+    raw2inner_items = dict(factors["raw2inner_items"])
+    users, items, ratings = (np.concatenate([n, o]) for n, o in zip(new_ratings, old_ratings))
+    n_factors = factors["pu"].shape[1]
+    pu, qi, bu, bi = factors["pu"], factors["qi"], factors["bu"], factors["bi"]
+    new_users = [u for u in dict.fromkeys(users.tolist()) if u not in raw2inner_users]
+    new_items = [i for i in dict.fromkeys(items.tolist()) if i not in raw2inner_items]
+    raw2inner_users.update({u: len(bu) + j for j, u in enumerate(new_users)})
+    raw2inner_items.update({i: len(bi) + j for j, i in enumerate(new_items)})
+    pu = np.concatenate([pu, rng.normal(0, 0.1, (len(new_users), n_factors))])
+    qi = np.concatenate([qi, rng.normal(0, 0.1, (len(new_items), n_factors))])
+    bu = np.concatenate([bu, np.zeros(len(new_users))])
+    bi = np.concatenate([bi, np.zeros(len(new_items))])
+    previous_pu, previous_qi, previous_bu, previous_bi = pu.copy(), qi.copy(), bu.copy(), bi.copy()
+    inner_users = np.array([raw2inner_users[u] for u in users.tolist()], dtype=np.int64)
+    inner_items = np.array([raw2inner_items[i] for i in items.tolist()], dtype=np.int64)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    for _ in range(epochs):
+        order = rng.permutation(len(ratings))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            u, i = inner_users[batch], inner_items[batch]
+            pu_u, qi_i = pu[u], qi[i]
+            err = ratings[batch] - np.einsum("ij,ij->i", pu_u, qi_i)
+            if factors["biased"]:
+                err -= factors["global_mean"] + bu[u] + bi[i]
+                np.add.at(bu, u, learning_rate * (err - regularization * bu[u]))
+                np.add.at(bi, i, learning_rate * (err - regularization * bi[i]))
+            np.add.at(pu, u, learning_rate * (err[:, None] * qi_i - regularization * pu_u))
+            np.add.at(qi, i, learning_rate * (err[:, None] * pu_u - regularization * qi_i))
+    moved_users = (np.abs(pu - previous_pu).max(axis=1) > tolerance) | (np.abs(bu - previous_bu) > tolerance)
+    moved_items = (np.abs(qi - previous_qi).max(axis=1) > tolerance) | (np.abs(bi - previous_bi) > tolerance)
+    # the new users and items were predicted without factors before
+    moved_users[len(factors["bu"]):] = True
+    moved_items[len(factors["bi"]):] = True
+    # the changes within the tolerance are dropped, so the predictions that are not computed again stay exact
+    pu[~moved_users], bu[~moved_users] = previous_pu[~moved_users], previous_bu[~moved_users]
+    qi[~moved_items], bi[~moved_items] = previous_qi[~moved_items], previous_bi[~moved_items]
+    inner2raw_users = np.empty(len(bu), dtype=np.int64)
+    inner2raw_users[list(raw2inner_users.values())] = list(raw2inner_users.keys())
+    inner2raw_items = np.empty(len(bi), dtype=np.int64)
+    inner2raw_items[list(raw2inner_items.values())] = list(raw2inner_items.keys())
+    factors.update({"pu": pu, "qi": qi, "bu": bu, "bi": bi,
+                    "raw2inner_users": raw2inner_users, "raw2inner_items": raw2inner_items})
+    return factors, inner2raw_users[moved_users], inner2raw_items[moved_items]
+
+
+def predictions_to_utilities(predictions: dict, items: list) -> (np.ndarray, np.ndarray):
+    """
+
+    :param predictions: dict of consumers and their lists of items predictions {"iid", "rating"}.
+    :param items: list of raw items ids, one column per item.
+    :return: np.ndarray of consumers ids and np.ndarray of their utilities (consumers x items).
+
+    A function converts the items' predictions of each consumer to a matrix of utilities.
+    """
+    users = np.array(sorted(predictions.keys()))
+    column_of = {int(iid): j for j, iid in enumerate(items)}
+    utilities = np.empty((len(users), len(items)), dtype=np.float32)
+    for r, uid in enumerate(users):
+        columns = [column_of[x["iid"]] for x in predictions[uid]]
+        utilities[r, columns] = [x["rating"] for x in predictions[uid]]
+    return users, utilities
 
 
 def get_ratings_data() -> pd.DataFrame:
@@ -74,158 +197,219 @@ def get_ratings_data() -> pd.DataFrame:
 def store_recommender_systems_generated_data() -> None:
     """
 
-    A function stores the data generated by the recommender systems algorithm into pickle files.
+    A function stores the data generated by the recommender systems algorithm into binary files: the utilities as `.npy`
+     matrices with the ids of their consumers and items, and the factors of the SVD model as a `.npz` file.
+     The predictions pickled by the previous versions are converted when they are available, otherwise they are predicted.
      It is executed only once to store the predictions for further experimentations.
     """
     recdata_path = get_rec_dir()
     create_directory(recdata_path)
-    if len(os.listdir(recdata_path)) < 3:
+    if all(os.path.exists(os.path.join(recdata_path, f)) for f in get_recdata_files()):
+        return
+    item_ids = get_items_ids()
+    model = load_pickle(f"{recdata_path}/SVDmodel.p")
+    predictions = load_pickle(f"{recdata_path}/consumers_items_utilities_predictions.p")
+    predictions_popular = load_pickle(f"{recdata_path}/consumers_items_utilities_predictions_popular.p")
+    if model is None or predictions is None or predictions_popular is None:
+        print("Predicting consumers items' utilities, it will take sometime...")
         ratings_df = get_ratings_data()
-        predictions, model = predict_consumers_items_utilities(ratings_df)
-        popular_items = get_popular_items(ratings_df)
-
-        if not os.path.exists(f"{recdata_path}/SVDmodel.p"):
-            pickle.dump(
-                model,
-                open(
-                    f"{recdata_path}/SVDmodel.p",
-                    "wb"),
-                protocol=pickle.HIGHEST_PROTOCOL)
-        if not os.path.exists(f"{recdata_path}/consumers_items_utilities_predictions.p"):
-            recommendations = get_ordered_recs(predictions)
-            pickle.dump(
-                recommendations,
-                open(
-                    f"{recdata_path}/consumers_items_utilities_predictions.p",
-                    "wb"),
-                protocol=pickle.HIGHEST_PROTOCOL)
-
-        if not os.path.exists(f"{recdata_path}/consumers_items_utilities_predictions_popular.p"):
-            num_cons = len(list(ratings_df["userId"].unique()))
-            recommendations = get_predictions_popular_items(
-                num_cons, popular_items, model)
-            pickle.dump(
-                recommendations,
-                open(
-                    f"{recdata_path}/consumers_items_utilities_predictions_popular.p",
-                    "wb"),
-                protocol=pickle.HIGHEST_PROTOCOL)
-
-
-def get_top_n(predictions: defaultdict, n: int) -> defaultdict:
-    """
-
-    :param predictions: defaultdict of consumers and their proposed recommendations.
-    :param n: int of number of items in the recommended list.
-    :return: defaultdict of items with the `n` highest predicted ratings for each consumer.
+        model = train_predictive_model(ratings_df)
+        factors = get_svd_factors(model)
+        users = np.sort(ratings_df["userId"].unique())
+        utilities = predict_utilities_matrix(factors, users, item_ids)
+        save_utilities("consumers_items_utilities", users, item_ids, utilities)
+        popularity = PopularityIndex.from_items(len(item_ids), get_items_indices(item_ids, ratings_df["movieId"]))
+        popular_items = item_ids[popularity.top()]
+        utilities = predict_utilities_matrix(factors, users, popular_items)
+        save_utilities("consumers_items_utilities_popular", users, popular_items, utilities)
+        print("End predicting utilities")
+    else:
+        factors = get_svd_factors(model)
+        users, utilities = predictions_to_utilities(predictions, item_ids)
+        save_utilities("consumers_items_utilities", users, item_ids, utilities)
+        popular_items = [x["iid"] for x in predictions_popular[min(predictions_popular)]]
+        users, utilities = predictions_to_utilities(predictions_popular, popular_items)
+        save_utilities("consumers_items_utilities_popular", users, popular_items, utilities)
+    save_svd_factors(factors)
 
-    A function takes the items of the highest ratings as recommendations.
+
+def get_recdata_files() -> list:
     """
-    topn_recommendations = defaultdict(list)
-    for uid, recs in predictions.items():
-        topn_recommendations[uid] = recs[:n]
-    return topn_recommendations
 
+    :return: list of file names.
 
-def get_predictions_popular_items(num_consumers: int, popular_items: list, svdmodel: object) -> defaultdict:
+    A function lists the files generated by the recommender systems algorithm.
     """
-    :param num_consumers: int of the number of consumers .
-    :param popular_items: list of the popular items.
-    :param svdmodel: object of the svd trained model
-    :return: defaultdict to store the items' predictions for each consumer.
+    files = ["svd_factors.npz"]
+    for name in ["consumers_items_utilities", "consumers_items_utilities_popular"]:
+        files += [f"{name}.npy", f"{name}_users.npy", f"{name}_items.npy"]
+    return files
 
-    A function adds the predicted utilities of the popular items.
+
+def load_pickle(path: str) -> object:
     """
-    predictions = defaultdict(list)
-    for uid in range(1, num_consumers + 1):
-        for iid in popular_items:
-            est = svdmodel.predict(uid, iid).est
-            predictions[uid].append(
-                {"iid": int(iid), "rating": float(round(est, 3))})
-    return predictions
 
+    :param path: str of the path of a pickle file.
+    :return: object stored in the file or None if it is missing or it cannot be unpickled (e.g. a Git LFS pointer).
 
-def get_popular_items(ratings_df: pd.DataFrame) -> OrderedDict:
+    A function loads a pickle file if it is available.
     """
-    :param ratings_df: pd.DataFrame of the ratings data.
-    :return: list of popular items.
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (pickle.UnpicklingError, EOFError):
+        return None
+
 
-    A function finds the popular items in the dataset. The most popular items are the ones that have the most ratings from the given dataset.
+def save_utilities(name: str, users: list, items: list, utilities: np.ndarray) -> None:
     """
-    rated_items = list(ratings_df["movieId"])
-    popular_items = dict(Counter(rated_items))
-    popular_items = dict(
-        OrderedDict(
-            sorted(
-                popular_items.items(),
-                key=lambda i: i[1],
-                reverse=True)))
-    return popular_items
 
+    :param name: str of the name of the utilities.
+    :param users: list of the consumers ids of the rows.
+    :param items: list of the raw items ids of the columns.
+    :param utilities: np.ndarray of the predicted utilities (consumers x items).
 
-def rescale_rating(consumer_true_utility: float) -> float:
+    A function saves a matrix of utilities with the `utilities_dtype` type and the ids of its rows and columns as `.npy` files.
     """
+    recdata_path = get_rec_dir()
+    np.save(f"{recdata_path}/{name}.npy", np.asarray(utilities, dtype=model_input["utilities_dtype"]))
+    np.save(f"{recdata_path}/{name}_users.npy", np.asarray(users, dtype=np.int64))
+    np.save(f"{recdata_path}/{name}_items.npy", np.asarray(items, dtype=np.int64))
 
-    :param consumer_true_utility: float of consumer's true utility.
-    :return: float of consumer's true utilities scaled.
 
-    A function maps a given `true utility` to a given scale
+def load_utilities(name: str) -> (np.ndarray, np.ndarray, np.ndarray):
     """
-    scales = model_input["rating_scale"]
-    n = len(scales)
-    if consumer_true_utility in scales or consumer_true_utility == 0:
-        pass
-    elif consumer_true_utility < scales[0]:
-        consumer_true_utility = scales[0]
-    elif consumer_true_utility > scales[n - 1]:
-        consumer_true_utility = scales[n - 1]
-    else:
-        for i in range(1, n):
-            if consumer_true_utility < scales[i]:
-                mid = (scales[i - 1] + scales[i]) / 2
-                if consumer_true_utility < mid:
-                    consumer_true_utility = scales[i - 1]
-                else:
-                    consumer_true_utility = scales[i]
-                break
-    return consumer_true_utility
+
+    :param name: str of the name of the utilities.
+    :return: np.ndarray of the consumers ids, np.ndarray of the raw items ids and np.ndarray of the utilities.
+
+    A function opens a matrix of utilities stored by `save_utilities`. The files are memory-mapped read-only,
+     so they are not copied in memory and concurrent runs share the same pages.
+    """
+    recdata_path = get_rec_dir()
+    utilities = np.load(f"{recdata_path}/{name}.npy", mmap_mode="r")
+    users = np.load(f"{recdata_path}/{name}_users.npy", mmap_mode="r")
+    items = np.load(f"{recdata_path}/{name}_items.npy", mmap_mode="r")
+    return users, items, utilities
+
+
+def save_svd_factors(factors: dict) -> None:
+    """
+
+    :param factors: dict of the fitted factors returned by `get_svd_factors`.
+
+    A function saves the factors of the SVD model as a `.npz` file.
+    """
+    recdata_path = get_rec_dir()
+    raw_users = sorted(factors["raw2inner_users"], key=factors["raw2inner_users"].get)
+    raw_items = sorted(factors["raw2inner_items"], key=factors["raw2inner_items"].get)
+    np.savez(f"{recdata_path}/svd_factors.npz",
+             pu=factors["pu"], qi=factors["qi"], bu=factors["bu"], bi=factors["bi"],
+             global_mean=factors["global_mean"], biased=factors["biased"],
+             rating_scale=factors["rating_scale"], raw_users=raw_users, raw_items=raw_items)
+
+
+def load_svd_factors() -> dict:
+    """
+
+    :return: dict of the fitted factors, in the same format as `get_svd_factors`.
+
+    A function loads the factors of the SVD model saved by `save_svd_factors`.
+    """
+    recdata_path = get_rec_dir()
+    with np.load(f"{recdata_path}/svd_factors.npz") as data:
+        factors = {"pu": data["pu"],
+                   "qi": data["qi"],
+                   "bu": data["bu"],
+                   "bi": data["bi"],
+                   "global_mean": float(data["global_mean"]),
+                   "biased": bool(data["biased"]),
+                   "rating_scale": tuple(data["rating_scale"].tolist()),
+                   "raw2inner_users": {int(u): i for i, u in enumerate(data["raw_users"])},
+                   "raw2inner_items": {int(iid): i for i, iid in enumerate(data["raw_items"])}}
+    return factors
+
+
+def get_top_n(recommendations: RecommendationStore, n: int) -> np.ndarray:
+    """
+
+    :param recommendations: RecommendationStore of consumers and their proposed recommendations.
+    :param n: int of number of items in the recommended list.
+    :return: np.ndarray of the ranks of the `n` highest unconsumed items for each consumer, padded with -1.
+
+    A function takes the items of the highest ratings as recommendations.
+    """
+    return recommendations.top_n(n)
 
 
-def rerank_per_consumer(items_with_ratings_predictions: list, profits: dict, weights: list) -> list:
+def rescale_rating(consumer_true_utility: np.ndarray) -> np.ndarray:
     """
 
-    :param items_with_ratings_predictions: list of the items objects predictions for all consumers.
-    :param profits: dict of profit data given to each item.
-    :param weights: list of two float values in range [0,1].
-    :return: list of dicts of items.
+    :param consumer_true_utility: np.ndarray (or float) of consumers' true utilities.
+    :return: np.ndarray (or float) of consumers' true utilities scaled.
 
-    A function reranks items based on a weighted sum based on predicted utilities of items for each consumer and profit of one consumer.
+    A function maps given `true utilities` to the closest values of the rating scale, the middle of two values being
+    mapped to the upper one. Utilities out of the scale are mapped to its bounds, and a utility of 0 is kept.
+    """
+    scales = np.asarray(model_input["rating_scale"], dtype=np.float64)
+    utilities = np.asarray(consumer_true_utility, dtype=np.float64)
+    upper = np.clip(np.searchsorted(scales, utilities, side="right"), 1, len(scales) - 1)
+    lower_values, upper_values = scales[upper - 1], scales[upper]
+    scaled = np.where(utilities < (lower_values + upper_values) / 2, lower_values, upper_values)
+    scaled = np.where(utilities == 0, 0, scaled)
+    return scaled if scaled.ndim else float(scaled)
+
+
+def rerank_items_consider_profit(recommendations: RecommendationStore, profits: np.ndarray, weights: list,
+                                 pool_size: int = None) -> RecommendationStore:
+    """
+
+    :param recommendations: RecommendationStore of items predictions for all consumers.
+    :param profits: np.ndarray of profit data given to each item, aligned with the items of the store.
+    :param weights: list of two float values in range [0,1]
+    :param pool_size: int of the number of ranked items kept for each consumer, all the items are ranked when it is None.
+    :return: RecommendationStore of new items ranking.
+
+    A function reorders items by a weighted sum of the predicted utilities of items for each consumer and their profit.
+     The weighted sums of all consumers are computed as one matrix and only the top `pool_size` items are ordered.
     """
-    # model_parameters["balanced_strategy"]["RW"]  # weight for the rating
     consumer_w = weights[0]
     provider_w = weights[1]
-    for i in items_with_ratings_predictions:
-        i["rank"] = consumer_w * i["rating"] + provider_w * profits[i["iid"]]
-        i["profit"] = profits[i["iid"]]
-    items_with_ratings_predictions.sort(key=lambda x: x["rank"], reverse=True)
-    return items_with_ratings_predictions
+    utilities = recommendations.utilities
+    candidates = recommendations.candidates
+    ranks = consumer_w * np.asarray(utilities, dtype=np.float32) + provider_w * profits[candidates]
+    # items with equal ranks keep their order by predicted utility
+    order = rank_candidates(ranks, pool_size, ties=utilities)
+    items = candidates[order]
+    ratings = np.take_along_axis(utilities, order, axis=1)
+    return RecommendationStore(recommendations.consumer_ids, recommendations.item_ids, items, ratings,
+                               utilities, candidates, profits)
 
 
-def rerank_items_consider_profit(items_with_ratings_predictions: defaultdict, profits: dict, weights: list) -> defaultdict:
+def get_items_ids() -> np.ndarray:
     """
 
-    :param items_with_ratings_predictions: defaultdict of items predictions for all consumers.
-    :param profits: dict of profit data given to each item.
-    :param weights: list of two float values in range [0,1]
-    :return: defaultdict of new items ranking.
+    :return: np.ndarray of the items ids.
+
+    A function gets the ids of the items in the catalog, the position of an id is used as its dense item index.
+    """
+    datasetdir = get_dataset_dir()
+    items_data_path = os.path.join(datasetdir, model_input["items_dataset"])
+    return pd.read_csv(items_data_path)["movieId"].unique()
+
+
+def get_items_indices(item_ids: np.ndarray, items: list) -> np.ndarray:
+    """
 
-    A function uses `rerank_per_consumer` function to reorder items by balancing consumer utility and profit
+    :param item_ids: np.ndarray of the items ids of the catalog.
+    :param items: list of raw items ids.
+    :return: np.ndarray of the dense items indices of `items`.
+
+    A function maps raw items ids to their positions in the catalog.
     """
-    ordered_items_for_recommendations = defaultdict(list)
-    for uid, recs in items_with_ratings_predictions.items():
-        ordered_items_for_recommendations[uid] = rerank_per_consumer(
-            recs, profits, weights)
-    return ordered_items_for_recommendations
+    return pd.Index(item_ids).get_indexer(items)
 
 
 def get_num_items() -> int:
@@ -348,20 +532,18 @@ def get_params(obj: object) -> str:
     return SCENARIOS[str(d_params)]
 
 
-def generate_profitdata(seed: float) -> dict:
+def generate_profitdata(seed: float, num_items: int = None) -> np.ndarray:
     """
 
-    :param obj: An object of agents or model class.
-    :return: str represents a senario name.
+    :param seed: float of the seed of the profits.
+    :param num_items: int of the number of items in the catalog, read from the items dataset when it is None.
+    :return: np.ndarray of the profit of each item, aligned with the items of the catalog (see `get_items_ids`).
 
     A function generates random profit data for each item drawn from normal distribution (mu=2.5,sigma=1).
-    different seed values are used each simulation iteration.
+    different seed values are used each simulation iteration, the values are drawn from a dedicated Generator.
     """
-    np.random.seed(seed)
-    data_directory = get_dataset_dir()
-    items_path = os.path.join(data_directory, model_input["items_dataset"])
-    items = pd.read_csv(items_path)
-    items = items["movieId"].unique()
+    if num_items is None:
+        num_items = len(get_items_ids())
     lower, upper = 0, 5
     mu, sigma = 2.5, 1
     profits = truncnorm(
@@ -369,9 +551,24 @@ def generate_profitdata(seed: float) -> dict:
         (upper - mu) / sigma,
         loc=mu,
         scale=sigma).rvs(
-        len(items))
-    items_profits = {i: p for i, p in zip(items, profits)}
-    return items_profits
+        num_items, random_state=np.random.default_rng(seed))
+    return profits.astype(np.float32)
+
+
+def get_run_seed(params: dict, iteration: int) -> int:
+    """
+
+    :param params: dict of the values of the sensitive parameters of a run.
+    :param iteration: int of the iteration of the run.
+    :return: int of the seed of the run.
+
+    A function derives the seed of a simulation run from its scenario, its iteration and the `seed` parameter, so a run
+     gives the same results whichever process executes it.
+    """
+    d_params = {p: params[p] for p in get_sensitive_params()}
+    scenario_number = int(SCENARIOS[str(d_params)].replace("scenario", ""))
+    seed_sequence = np.random.SeedSequence([model_parameters["seed"], scenario_number, iteration])
+    return int(seed_sequence.generate_state(1)[0])
 
 
 def create_scenarios(sensitive_params: list) -> dict:
@@ -407,6 +604,67 @@ def store_scenarios(path: str) -> None:
         json.dump(SCENARIOS, fp, indent=4)
 
 
+def get_initial_beta() -> dict:
+    """
+
+    :return: dict of the initial [positive, negative] experiences of each consumer id.
+
+    A function loads the initial experiences of the consumers, from which their initial trust is computed.
+    """
+    initials_betapath = os.path.join(get_data_dir(), "trust", "beta_initials.p")
+    with open(initials_betapath, "rb") as f:
+        return pickle.load(f)
+
+
+def get_traced_cohort(initial_beta: dict = None) -> np.ndarray:
+    """
+
+    :param initial_beta: dict of the initial experiences of each consumer id, loaded when it is None.
+    :return: np.ndarray of the sorted ids of the consumers recorded in the "agents" collection mode.
+
+    A function selects the traced cohort defined by `traced_cohort` in the config file:
+     "all": all the consumers.
+     "fraction": a random `fraction` of the consumers.
+     "ids": the consumers whose ids are listed in `ids`.
+     "trust_strata": `per_stratum` random consumers from each of the `strata` quantile groups of the initial trust.
+    The random cohorts are drawn from a Generator seeded with the `seed` of the cohort, so all the runs and scenarios
+    trace the same consumers.
+    """
+    cohort = model_input["traced_cohort"]
+    if initial_beta is None:
+        initial_beta = get_initial_beta()
+    consumer_ids = np.array(sorted(initial_beta), dtype=np.int64)
+    rng = np.random.default_rng(cohort.get("seed", 0))
+    if cohort["type"] == "all":
+        return consumer_ids
+    if cohort["type"] == "fraction":
+        size = max(1, round(cohort["fraction"] * len(consumer_ids)))
+        return np.sort(rng.choice(consumer_ids, size=size, replace=False))
+    if cohort["type"] == "ids":
+        return np.intersect1d(consumer_ids, np.asarray(cohort["ids"], dtype=np.int64))
+    if cohort["type"] == "trust_strata":
+        beta_params = np.array([initial_beta[i] for i in consumer_ids], dtype=np.float64)
+        trust = beta_params[:, 0] / beta_params.sum(axis=1)
+        edges = np.quantile(trust, np.linspace(0, 1, cohort["strata"] + 1))
+        strata = np.clip(np.searchsorted(edges, trust, side="right") - 1, 0, cohort["strata"] - 1)
+        selected = []
+        for s in range(cohort["strata"]):
+            members = consumer_ids[strata == s]
+            selected.append(rng.choice(members, size=min(cohort["per_stratum"], len(members)), replace=False))
+        return np.sort(np.concatenate(selected))
+    raise ValueError(f"Unknown traced cohort type: {cohort['type']}")
+
+
+def store_traced_cohort(path: str) -> None:
+    """
+
+    A function stores the definition of the traced cohort and the ids of its consumers in json file.
+    """
+    cohort = {"definition": model_input["traced_cohort"], "consumer_ids": get_traced_cohort().tolist()}
+    with open(f"{path}/TRACED_COHORT.json", "w") as fp:
+        json.dump(cohort, fp, indent=4)
+
+
 def update_consumer_personal_experiences(exp: float) -> float:
     """
 
@@ -418,7 +676,7 @@ def update_consumer_personal_experiences(exp: float) -> float:
     if distance == "euclidean":
         inc = exp * exp
     elif distance == "manhattan":
-        inc = d
+        inc = exp
     else:
         inc = 1
     return inc
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from simulation_context import set_data_directory  # noqa: E402
+from synthetic_data import generate_synthetic_data  # noqa: E402
+from utils import store_recommender_systems_generated_data  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def data_directory(tmp_path_factory: pytest.TempPathFactory) -> str:
+    """
+    A small synthetic dataset (a tenth of the users and items of the MovieLens dataset) read by the runs of the tests.
+    """
+    directory = str(tmp_path_factory.mktemp("data"))
+    generate_synthetic_data(directory, users_scale=0.1, items_scale=0.1, seed=0)
+    set_data_directory(directory)
+    store_recommender_systems_generated_data()
+    return directory
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import os
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+
+import pytest
+from checkpoint import create_or_resume, get_checkpoint_path, get_rankings_path, restore_model
+from mesa_utils.batchrunner import run_model
+from model import RecommendationModel
+from read_config import model_input, model_parameters
+from result_sink import get_run_files, merge_csv_files
+from simulation_context import get_simulation_context
+
+TIMESTEPS = 4
+
+
+@pytest.fixture
+def run_kwargs(data_directory, tmp_path, monkeypatch) -> dict:
+    monkeypatch.setitem(model_parameters, "timesteps", TIMESTEPS)
+    monkeypatch.setitem(model_input, "checkpoint_every", 2)
+    return {"recommendation_strategy": model_parameters["recommendation_strategy"][0],
+            "quantile_consumer_expectation": model_parameters["quantile_consumer_expectation"][0],
+            "iteration": 0, "seed": 0, "result_dir": str(tmp_path)}
+
+
+def test_resume_skips_a_finished_run_whose_files_were_merged(run_kwargs):
+    result_dir = run_kwargs["result_dir"]
+    run_model(RecommendationModel, run_kwargs, TIMESTEPS)
+    scenario = RecommendationModel(**dict(run_kwargs, result_dir=None)).run_name.rsplit("-run", 1)[0]
+    merged = {}
+    for table in ("model", "agents"):
+        merged[table] = os.path.join(result_dir, f"{table}-data-{scenario}.csv")
+        merge_csv_files(get_run_files(result_dir, table, scenario), merged[table])
+    contents = {table: open(path).read() for table, path in merged.items()}
+
+    run_model(partial(create_or_resume, RecommendationModel), run_kwargs, TIMESTEPS)
+
+    assert {table: open(path).read() for table, path in merged.items()} == contents
+    assert not get_run_files(result_dir, "model", scenario)
+
+
+def test_restore_of_an_unfinished_run_without_its_files_fails(run_kwargs):
+    result_dir = run_kwargs["result_dir"]
+    model = RecommendationModel(**run_kwargs)
+    for _ in range(TIMESTEPS // 2):
+        model.step()
+    model.datacollector.close()
+    for path in get_run_files(result_dir, "model", model.run_name.rsplit("-run", 1)[0]):
+        os.remove(path)
+
+    with pytest.raises(FileNotFoundError, match="cannot be resumed"):
+        restore_model(get_checkpoint_path(result_dir, model.run_name), result_dir)
+
+
+def test_restore_reads_the_shared_ranking_in_another_process(run_kwargs, monkeypatch):
+    result_dir = run_kwargs["result_dir"]
+    model = RecommendationModel(**dict(run_kwargs, recommendation_strategy="balance_equal_weights"))
+    for _ in range(TIMESTEPS // 2):
+        model.step()
+    model.datacollector.close()
+    key, = (k for k, store in get_simulation_context().rankings.items() if store.items is model.recommendations.items)
+    assert os.path.exists(get_rankings_path(result_dir, key))
+    # a process that has not ranked the recommendations
+    monkeypatch.setattr(get_simulation_context(), "rankings", OrderedDict())
+
+    restored = restore_model(get_checkpoint_path(result_dir, model.run_name), result_dir)
+
+    assert restored.recommendations.items is get_simulation_context().rankings[key].items
+    assert np.array_equal(restored.recommendations.items, model.recommendations.items)
+    assert np.array_equal(restored.recommendations.consumed, model.recommendations.consumed)
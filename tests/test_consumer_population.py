@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+from model import RecommendationModel
+from read_config import model_parameters
+
+
+def run_selected_items(consumer_mode: str, monkeypatch, steps: int = 5) -> list:
+    monkeypatch.setitem(model_parameters, "consumer_mode", consumer_mode)
+    model = RecommendationModel(recommendation_strategy=model_parameters["recommendation_strategy"][-1],
+                                quantile_consumer_expectation=model_parameters["quantile_consumer_expectation"][0],
+                                seed=0)
+    for _ in range(steps):
+        model.step()
+    records = model.datacollector.get_agent_vars_dataframe().reset_index().sort_values(["Step", "AgentID"])
+    return records[["Step", "AgentID", "selecteditem"]].values.tolist()
+
+
+def test_selected_items_are_the_same_in_both_modes(data_directory, monkeypatch):
+    agents = run_selected_items("agent", monkeypatch)
+    population = run_selected_items("population", monkeypatch)
+    consumed = [item for _, _, item in population if isinstance(item, dict)]
+    assert consumed and all("profit" in item for item in consumed)
+    assert population == agents